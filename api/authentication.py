@@ -1,5 +1,7 @@
 
+import hashlib
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Dict, Union
 
@@ -10,9 +12,13 @@ from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from api import schema
+from api.cache import TTLCache, hit_ratio
 from api.crud import CRUDUser
 from api.db import get_session
+from api.lazy import Lazy
+from api.metrics import Gauge, jwt_decode_duration
 from api.models import UserDBModel
+from api.settings import settings
 from api.utils import PasswordHasher
 
 
@@ -21,6 +27,20 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = os.environ.get("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# verified tokens by sha256 digest, each entry lives until the token's exp
+token_cache = Lazy(lambda: TTLCache(max_entries=settings.jwt_cache_size))
+
+
+def token_cache_stats() -> Dict[str, float]:
+    """Hits, misses, size and hit ratio, nothing before the cache is built"""
+    if not token_cache._is_resolved():
+        return {}
+    stats = token_cache.stats()
+    return {**stats, "hit_ratio": hit_ratio(stats["hits"], stats["misses"])}
+
+
+Gauge("spotapp_token_cache", "Verified token cache lookups since start, size and hit ratio", ("stat",),
+      collect=lambda: {(stat,): value for stat, value in token_cache_stats().items()})
 
 
 @spotapp_auth_router.post(
@@ -41,13 +61,14 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(),
             raise HTTPException(status_code=400,
                                 detail="User with this email does not exist")
 
-        if not PasswordHasher().verify_password(form_data.password, user.password):
+        if not await PasswordHasher().verify_password_async(form_data.password,
+                                                            user.password):
             raise HTTPException(status_code=400,
                                 detail="Incorrect password")
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email},
+            data={"sub": user.email, "uid": user.user_id},
             expires_delta=access_token_expires,
         )
 
@@ -74,21 +95,37 @@ def create_access_token(data: dict,
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Getting current authorized user"""
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> schema.TokenData:
+    """Getting current authorized user, verified tokens are served from cache"""
+    digest = hashlib.sha256(token.encode()).digest()
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        schema.TokenData(email=email)
+        with jwt_decode_duration.time():
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        raise credentials_exception
+        raise credentials_exception()
+
+    email: str = payload.get("sub")
+    if email is None:
+        raise credentials_exception()
+    token_data = schema.TokenData(email=email, user_id=payload.get("uid"))
+
+    expires_at = payload.get("exp")
+    if expires_at is not None:
+        token_cache.set(digest, token_data, ttl=expires_at - time.time())
+
+    return token_data
 
 
 async def get_current_active_user(current_user: UserDBModel = Depends(get_current_user)):
@@ -0,0 +1,32 @@
+from typing import Any, Dict, Iterator, List, Sequence, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from api import schema
+
+
+def validate_items(raw_items: List[Dict[str, Any]],
+                   item_schema: Type[BaseModel],
+                   ) -> Tuple[List[Tuple[int, BaseModel]], List[schema.BulkItemResultSchema]]:
+    """Validate every item on its own, so one bad item fails alone"""
+
+    valid, failed = [], []
+    for index, raw_item in enumerate(raw_items):
+        try:
+            valid.append((index, item_schema.parse_obj(raw_item)))
+        except ValidationError as exc:
+            failed.append(schema.BulkItemResultSchema(index=index, error=str(exc)))
+    return valid, failed
+
+
+def bulk_result(items: List[schema.BulkItemResultSchema]) -> schema.BulkResultSchema:
+    items = sorted(items, key=lambda item: item.index)
+    failed = sum(1 for item in items if item.error is not None)
+    return schema.BulkResultSchema(succeeded=len(items) - failed, failed=failed, items=items)
+
+
+def chunked(items: Sequence[Any], size: int) -> Iterator[Sequence[Any]]:
+    """Slices small enough to stay under the driver's bind parameter limit"""
+
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
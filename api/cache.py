@@ -0,0 +1,176 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Type
+
+from pydantic import BaseModel
+
+from api.settings import settings
+from api.singleflight import SingleFlight
+
+
+def hit_ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+class TTLCache:
+    """Bounded in-process LRU cache with a per-entry expiry"""
+
+    def __init__(self, max_entries: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        """Store a value for `ttl` seconds, evicting the least recently used"""
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class MemoryCacheBackend:
+    """Default backend, values stay as objects in process memory"""
+    stores_objects = True
+
+    def __init__(self, max_entries: int):
+        self.entries = TTLCache(max_entries=max_entries)
+
+    async def get(self, key: str) -> Any:
+        return self.entries.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        self.entries.set(key, value, ttl=ttl)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.delete(key)
+
+
+class RedisCacheBackend:
+    """Backend over any client with the redis.asyncio get/set/delete API"""
+    stores_objects = False
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    async def get(self, key: str) -> Any:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.client.set(key, value, ex=max(int(ttl), 1))
+
+    async def delete(self, *keys: str):
+        await self.client.delete(*keys)
+
+
+def make_cache_backend():
+    """Build the backend configured in Settings"""
+    if settings.cache_backend == "redis":
+        from redis import asyncio as aioredis  # optional dependency
+
+        return RedisCacheBackend(aioredis.from_url(settings.cache_redis_url))
+
+    return MemoryCacheBackend(max_entries=settings.cache_max_entries)
+
+
+class ReadThroughCache:
+    """Cache of response schemas by primary key with a stampede guard:
+    concurrent misses on one key share a single load"""
+
+    def __init__(self, namespace: str,
+                 row_schema: Type[BaseModel],
+                 backend: Any,
+                 ttl: Optional[float] = None):
+        self.namespace = namespace
+        self.row_schema = row_schema
+        self.backend = backend
+        self.ttl = ttl  # None reads settings.cache_ttl on every store
+        self.hits = 0
+        self.misses = 0
+        self.flights = SingleFlight(f"{namespace}_cache")
+        self._loading: Dict[str, object] = {}
+
+    def key(self, pk: Any) -> str:
+        return f"spotapp:{self.namespace}:{pk}"
+
+    async def get_or_load(self, pk: Any,
+                          loader: Callable[[], Awaitable[BaseModel]]) -> BaseModel:
+        key = self.key(pk)
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            if self.backend.stores_objects:
+                return cached
+            return self.row_schema.parse_raw(cached)
+
+        self.misses += 1
+        return await self.flights.do(key, lambda: self._load(key, loader))
+
+    def _load(self, key: str,
+              loader: Callable[[], Awaitable[BaseModel]]) -> Awaitable[BaseModel]:
+        # the token is taken synchronously so an invalidation arriving
+        # before the load task starts is noticed as well
+        token = self._loading[key] = object()
+        return self._fill(key, loader, token)
+
+    async def _fill(self, key: str,
+                    loader: Callable[[], Awaitable[BaseModel]],
+                    token: object) -> BaseModel:
+        try:
+            value = await loader()
+            # an invalidation during the load makes the value stale
+            if self._loading.get(key) is token:
+                stored = value if self.backend.stores_objects else value.json()
+                ttl = settings.cache_ttl if self.ttl is None else self.ttl
+                await self.backend.set(key, stored, ttl=ttl)
+            return value
+        finally:
+            if self._loading.get(key) is token:
+                del self._loading[key]
+
+    async def invalidate(self, *pks: Any):
+        keys = [self.key(pk) for pk in pks]
+        for key in keys:
+            self._loading.pop(key, None)
+            self.flights.forget(key)
+        if keys:
+            await self.backend.delete(*keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "loading": len(self._loading)}
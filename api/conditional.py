@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, List, Optional
+
+from fastapi import Request, Response, status
+
+
+class PreconditionFailed(Exception):
+    """The row exists, but not in any version the client's If-Match names"""
+
+
+def etag(namespace: str, pk: Any, version: int) -> str:
+    return f'"{namespace}-{pk}-{version}"'
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(moment.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def parse_etags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def not_modified(request: Request, response: Response,
+                 namespace: str, pk: Any, row: Any) -> Optional[Response]:
+    """Put the validators of a versioned row on the response, and answer 304
+    when the client copy is current, the body is never serialized then"""
+
+    headers = {"ETag": etag(namespace, pk, row.version),
+               "Last-Modified": http_date(row.updated_at)}
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, W/ validators match too
+        tags = [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+        if "*" in tags or headers["ETag"] in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return None
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        if since.tzinfo is not None and row.updated_at.replace(
+                microsecond=0, tzinfo=timezone.utc) <= since:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return None
+
+
+def if_match_versions(request: Request, namespace: str, pk: Any) -> Optional[List[int]]:
+    """Versions an If-Match header allows to update, None when any version will do"""
+
+    if_match = request.headers.get("if-match")
+    if if_match is None:
+        return None
+
+    # strong comparison, W/ validators never match
+    tags = [tag for tag in parse_etags(if_match) if not tag.startswith("W/")]
+    if "*" in tags:
+        return None
+
+    prefix = etag(namespace, pk, "")[:-1]
+    return [int(tag[len(prefix):-1]) for tag in tags
+            if tag.startswith(prefix) and tag[len(prefix):-1].isdigit()]
@@ -1,2 +1,5 @@
 API_TITLE = "SpotApp"
 DEFAULT_LOG_FORMAT = "[%(asctime)s]:%(levelname)s:%(name)s:%(message)s"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+PRIMARY_STICKY_COOKIE = "spotapp_primary_until"
+METRICS_MEDIA_TYPE = "text/plain; version=0.0.4"  # charset is added by the response
@@ -1,16 +1,209 @@
+import functools
+from datetime import timezone
 from http import HTTPStatus
-from typing import Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
 from fastapi import Response
-from sqlalchemy import select
+from sqlalchemy import (Float, and_, bindparam, cast, delete, func, insert, literal_column, or_, select, true,
+                        tuple_, union_all)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import Select
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, load_only, selectinload
 from sqlalchemy import update as sqlalchemy_update
 
-from api.models import CommentDBModel, SpotDBModel, UserDBModel
+from api.bulk import chunked
+from api.cache import ReadThroughCache, hit_ratio, make_cache_backend
+from api.conditional import PreconditionFailed
+from api.db import on_commit, reads_own_writes, shared_read_session
+from api.feed import decode_feed_cursor, encode_feed_cursor, feed_position, feed_store
+from api.geo import (EARTH_RADIUS_KM, bounding_box, covering_prefixes, enclosing_radius_km, encode_geohash,
+                     longitude_ranges)
+from api.lazy import Lazy
+from api.metrics import Gauge
+from api.models import (CommentDBModel, FavouriteSpotDBModel, FriendshipDBModel, RatingDBModel,
+                        SpotDBModel, UserDBModel)
+from api.pagination import decode_cursor, encode_cursor, paginate
+from api.search import search_index, tokenize
+from api.settings import settings
+from api.singleflight import SingleFlight
+from api.utils import schema_columns, trusted
 from api import schema
 
 
+cache_backend = Lazy(make_cache_backend)
+user_cache = ReadThroughCache("user", schema.UserVersionedSchema, backend=cache_backend)
+spot_cache = ReadThroughCache("spot", schema.SpotVersionedSchema, backend=cache_backend)
+comment_cache = ReadThroughCache("comment", schema.CommentVersionedSchema, backend=cache_backend)
+# by-id reads are deduplicated by the caches above
+filtered_spots_flights = SingleFlight("filtered_spots")
+row_caches = (user_cache, spot_cache, comment_cache)
+flights = (*(cache.flights for cache in row_caches), filtered_spots_flights)
+
+Gauge("spotapp_cache_lookups", "Row cache lookups since start by result", ("cache", "result"),
+      collect=lambda: {(cache.namespace, result): count for cache in row_caches
+                       for result, count in (("hit", cache.hits), ("miss", cache.misses))})
+Gauge("spotapp_cache_hit_ratio", "Row cache hits per lookup since start", ("cache",),
+      collect=lambda: {(cache.namespace,): hit_ratio(cache.hits, cache.misses) for cache in row_caches})
+Gauge("spotapp_single_flight_calls", "Single-flight calls and the queries they ran", ("group", "kind"),
+      collect=lambda: {(flight.name, kind): flight.stats()[kind]
+                       for flight in flights for kind in ("calls", "executions")})
+Gauge("spotapp_single_flight_in_flight", "Shared queries running now", ("group",),
+      collect=lambda: {(flight.name,): flight.stats()["in_flight"] for flight in flights})
+Gauge("spotapp_single_flight_fan_out_ratio", "Callers served per query run", ("group",),
+      collect=lambda: {(flight.name,): flight.fan_out_ratio() for flight in flights})
+
+T = TypeVar("T")
+
+
+async def invalidate(db: AsyncSession, cache: ReadThroughCache, *pks: int):
+    """Drop cached rows now and again after commit,
+    so a concurrent read can't bring back the old version"""
+
+    await cache.invalidate(*pks)
+    on_commit(db, lambda: cache.invalidate(*pks))
+
+
+async def shared_read(db: AsyncSession,
+                      load: Callable[[AsyncSession], Awaitable[T]],
+                      share: Callable[[Callable[[], Awaitable[T]]], Awaitable[T]],
+                      primary: bool = False) -> T:
+    """`load` through `share`, a cache or a single flight, in a session of its own,
+    on the primary with `primary`: a cache would keep a row a lagging replica
+    still has for its whole ttl. A request reading its own writes loads on its
+    session, past both: what they hold may come from a lagging replica"""
+
+    if reads_own_writes(db):
+        return await load(db)
+
+    async def load_shared() -> T:
+        async with shared_read_session(db, primary=primary) as shared:
+            return await load(shared)
+
+    return await share(load_shared)
+
+
+async def versioned_read(db: AsyncSession, cache: ReadThroughCache, version_column, pk_column, pk: int,
+                         load: Callable[[AsyncSession], Awaitable[T]]) -> T:
+    """By-id read through `cache`, reloaded when the database holds a newer
+    version: writes in another worker don't invalidate this one's cache, its
+    copy and the ETag built from it would name a superseded version"""
+
+    share = functools.partial(cache.get_or_load, pk)
+    row = await shared_read(db, load, share, primary=True)
+    if reads_own_writes(db):
+        return row
+
+    version = (await db.execute(select(version_column).where(pk_column == pk))).scalar_one_or_none()
+    if version is None or version > row.version:
+        await cache.invalidate(pk)
+        row = await shared_read(db, load, share, primary=True)
+    return row
+
+
+def reindex(db: AsyncSession, kind: str, pk: int,
+            title: Optional[str], *texts: Optional[str]):
+    """Feed a committed document to an index that doesn't follow the tables"""
+
+    if search_index.needs_documents:
+        on_commit(db, lambda: search_index.index_document(kind, pk, title, texts))
+
+
+def unindex(db: AsyncSession, kind: str, pk: int):
+    if search_index.needs_documents:
+        on_commit(db, lambda: search_index.remove_document(kind, pk))
+
+
+def feed_entry(kind: str, pk: int, actor_id: int, text: Optional[str],
+               created_at) -> schema.FeedEntrySchema:
+    return schema.FeedEntrySchema(kind=kind, id=pk, actor_id=actor_id, text=text,
+                                  created_at=created_at,
+                                  score=int(created_at.replace(tzinfo=timezone.utc).timestamp() * 1_000_000))
+
+
+async def publish(db: AsyncSession, entries: Dict[Optional[int], List[schema.FeedEntrySchema]]):
+    """Fan committed entries out to the feeds of their actors' friends, one
+    followers lookup for all actors. Actors with too many friends keep
+    their entries in their outbox for readers to merge"""
+
+    actor_ids = [actor_id for actor_id in entries if actor_id is not None]
+    if not actor_ids:
+        return
+    max_followers = settings.feed_fanout_max_followers
+    # no more than one follower past the cap per actor, it tells a celebrity
+    ranked = (
+        select(FriendshipDBModel.user_id, FriendshipDBModel.friend_id,
+               func.row_number().over(partition_by=FriendshipDBModel.user_id).label("rank"))
+        .where(FriendshipDBModel.user_id.in_(actor_ids))
+        .subquery("ranked")
+    )
+    result = await db.execute(
+        select(ranked.c.user_id, ranked.c.friend_id).where(ranked.c.rank <= max_followers + 1))
+    followers: Dict[int, List[int]] = {}
+    for actor_id, friend_id in result.all():
+        followers.setdefault(actor_id, []).append(friend_id)
+
+    for actor_id in actor_ids:
+        actor_followers = followers.get(actor_id, [])
+        for entry in entries[actor_id]:
+            if len(actor_followers) > max_followers:
+                on_commit(db, functools.partial(feed_store.push_outbox, actor_id, entry))
+            elif actor_followers:
+                on_commit(db, functools.partial(feed_store.push, actor_followers, entry))
+
+
+def distance_km(latitude_column, longitude_column, latitude: float, longitude: float):
+    """Haversine distance as an SQL expression"""
+
+    lat1, lon1 = func.radians(latitude_column), func.radians(longitude_column)
+    lat2, lon2 = func.radians(latitude), func.radians(longitude)
+    a = (func.power(func.sin((lat2 - lat1) / 2), 2)
+         + func.cos(lat1) * func.cos(lat2) * func.power(func.sin((lon2 - lon1) / 2), 2))
+    return 2 * EARTH_RADIUS_KM * func.asin(func.least(1.0, func.sqrt(a)))
+
+
+async def ensure_exists(db: AsyncSession, column, *ids: int):
+    """Raise NoResultFound unless a row exists for every id"""
+
+    ids = set(ids)
+    result = await db.execute(select(func.count()).where(column.in_(ids)))
+    if result.scalar_one() != len(ids):
+        raise NoResultFound
+
+
+async def missed_update(db: AsyncSession, column, pk: int, versions: Optional[List[int]]):
+    """An UPDATE matched nothing: tell a missing row from a stale If-Match"""
+
+    if versions is not None:
+        await ensure_exists(db, column, pk)
+        raise PreconditionFailed
+    raise NoResultFound
+
+
+def utc_now():
+    """Statement time in UTC, as the naive utcnow() column defaults store it"""
+    # a literal, asyncpg can't tell which timezone() a bound name calls
+    return func.timezone(literal_column("'UTC'"), func.now())
+
+
+def rating_values(count_delta, sum_delta) -> Dict[str, Any]:
+    """Spot aggregate columns moved by a rating write, the average
+    is NULL while a spot has no ratings"""
+    count = SpotDBModel.spot_rating_count + count_delta
+    total = SpotDBModel.spot_rating_sum + sum_delta
+
+    return {
+        "spot_rating_count": count,
+        "spot_rating_sum": total,
+        "spot_raiting": cast(total, Float) / func.nullif(count, 0),
+        "version": SpotDBModel.version + 1,
+        # explicit, the onupdate default would bind a second "updated_at"
+        # next to the one of the ratings upsert CTE
+        "updated_at": utc_now(),
+    }
+
+
 class CRUDUser:
     model = UserDBModel
 
@@ -26,23 +219,54 @@ class CRUDUser:
 
     @classmethod
     async def get_user_by_id(cls, db: AsyncSession,
-                             user_id: int) -> schema.UserOpenSchema:
-        """Get user by id"""
+                             user_id: int) -> schema.UserVersionedSchema:
+        """Get user by id with its version, as current as the database it reads"""
 
-        query = select(cls.model).where(cls.model.user_id == user_id)
-        result = await db.execute(query)
+        async def load(session: AsyncSession) -> schema.UserVersionedSchema:
+            query = select(cls.model).where(cls.model.user_id == user_id)
+            result = await session.execute(query)
 
-        return result.scalar_one()
+            return schema.UserVersionedSchema.from_orm(result.scalar_one())
+
+        return await versioned_read(db, user_cache, cls.model.version, cls.model.user_id, user_id, load)
 
     @classmethod
     async def get_all_users(cls, db: AsyncSession,
-                            ) -> List[schema.UserOpenSchema]:
-        """Get all users"""
+                            cursor: Optional[str],
+                            limit: int,
+                            ) -> schema.UserPageSchema:
+        """Get a page of users ordered by user_id, only the columns
+        of the page schema are read and the rows are trusted as they are"""
 
-        query = select(cls.model)
+        query = (
+            select(*schema_columns(cls.model, schema.UserOpenSchema, cls.model.user_id))
+            .order_by(cls.model.user_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("user_id", cursor)
+        if after_id is not None:
+            query = query.where(cls.model.user_id > after_id)
         result = await db.execute(query)
 
-        return [user[cls.model] for user in result.all()]
+        users, next_cursor = paginate(result.all(), "user_id", limit)
+        return schema.UserPageSchema.construct(
+            items=[trusted(schema.UserOpenSchema, user) for user in users],
+            next_cursor=next_cursor)
+
+    @classmethod
+    async def stream_users(cls, db: AsyncSession,
+                           ) -> AsyncIterator[UserDBModel]:
+        """Stream all users through a server-side cursor"""
+
+        query = (
+            select(cls.model)
+            .order_by(cls.model.user_id)
+            .execution_options(yield_per=settings.export_batch_size)
+        )
+        result = await db.stream(query)
+
+        async for user in result.scalars():
+            yield user
 
     @classmethod
     async def add_user(cls, db: AsyncSession,
@@ -51,68 +275,384 @@ class CRUDUser:
 
         db.add(user)
         await db.flush()
+        await invalidate(db, user_cache, user.user_id)
         return schema.UserTerseSchema(nickname=user.nickname,
                                       email=user.email)
 
+    @classmethod
+    async def add_users(cls, db: AsyncSession,
+                        users: List[Tuple[int, Dict[str, Any]]],
+                        ) -> List[schema.BulkItemResultSchema]:
+        """Add users with multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING,
+        a taken nickname or email fails only its own item"""
+
+        results, rows, indexes, seen = [], [], {}, set()
+        for index, user in users:
+            keys = {("nickname", user["nickname"]), ("email", user["email"])}
+            if keys & seen:
+                results.append(schema.BulkItemResultSchema(
+                    index=index, error="Nickname or email repeats in the batch"))
+                continue
+            seen |= keys
+            indexes[user["nickname"]] = index
+            rows.append(user)
+
+        user_ids = []
+        for chunk in chunked(rows, settings.bulk_chunk_size):
+            query = (
+                pg_insert(cls.model)
+                .values(list(chunk))
+                .on_conflict_do_nothing()
+                .returning(cls.model.user_id, cls.model.nickname)
+            )
+            result = await db.execute(query)
+            for user_id, nickname in result.all():
+                user_ids.append(user_id)
+                results.append(schema.BulkItemResultSchema(index=indexes.pop(nickname),
+                                                           id=user_id))
+
+        results.extend(schema.BulkItemResultSchema(index=index,
+                                                   error="Nickname or email is already taken")
+                       for index in indexes.values())
+        await invalidate(db, user_cache, *user_ids)
+        return results
+
     @classmethod
     async def update(cls, db: AsyncSession,
                      user_id: int,
                      data: Dict,
-                     ) -> str:
-        """Update a user from data base"""
+                     versions: Optional[List[int]] = None,
+                     ) -> int:
+        """Update a user with a single UPDATE ... RETURNING the new version,
+        only from one of `versions` if given"""
 
         query = (
             sqlalchemy_update(cls.model)
             .where(cls.model.user_id == user_id)
-            .values(**{k: v for k, v in data.items() if v})
-            .execution_options(synchronize_session="fetch")
+            .values(**{k: v for k, v in data.items() if v}, version=cls.model.version + 1)
+            .returning(cls.model.version)
+            .execution_options(synchronize_session=False)
         )
+        if versions is not None:
+            query = query.where(cls.model.version.in_(versions))
 
         result = await db.execute(query)
+        version = result.scalar_one_or_none()
+        if version is None:
+            await missed_update(db, cls.model.user_id, user_id, versions)
+        await invalidate(db, user_cache, user_id)
 
-        rows_updated = result.rowcount
-        if rows_updated:
-            return f"User with {user_id=} is updated!"
+        return version
 
-        raise NoResultFound
+    @classmethod
+    def delete_users_query(cls, user_ids: List[int]):
+        """DELETE ... RETURNING of users, each row with the spots their ratings
+        left and the spots and comments they owned, all of them cached"""
+
+        removed = (
+            select(RatingDBModel.spot_id,
+                   func.count().label("count"),
+                   func.sum(RatingDBModel.score).label("total"))
+            .where(RatingDBModel.user_id.in_(user_ids))
+            .group_by(RatingDBModel.spot_id)
+            .subquery("removed")
+        )
+        # one UPDATE per spot, however many of the users rated it
+        unrated = (
+            sqlalchemy_update(SpotDBModel)
+            .where(SpotDBModel.spot_id == removed.c.spot_id)
+            .values(**rating_values(-removed.c.count, -removed.c.total))
+            .returning(SpotDBModel.spot_id)
+            .cte("unrated")
+        )
+        # owner_id is cleared by ON DELETE SET NULL, cached copies still have it
+        owned_spots = (
+            select(func.array_agg(SpotDBModel.spot_id))
+            .where(SpotDBModel.owner_id == cls.model.user_id)
+            .scalar_subquery()
+        )
+        owned_comments = (
+            select(func.array_agg(CommentDBModel.comment_id))
+            .where(CommentDBModel.owner_id == cls.model.user_id)
+            .scalar_subquery()
+        )
+        return (
+            delete(cls.model)
+            .where(cls.model.user_id.in_(user_ids))
+            .add_cte(unrated)
+            .returning(cls.model.user_id,
+                       select(func.array_agg(unrated.c.spot_id)).scalar_subquery(),
+                       owned_spots, owned_comments)
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    async def invalidate_deleted(cls, db: AsyncSession, rows: List[Tuple[Any, ...]]):
+        spot_ids, comment_ids = set(), set()
+        for _, unrated_spot_ids, owned_spot_ids, owned_comment_ids in rows:
+            spot_ids.update(unrated_spot_ids or [], owned_spot_ids or [])
+            comment_ids.update(owned_comment_ids or [])
+        await invalidate(db, user_cache, *(row[0] for row in rows))
+        await invalidate(db, spot_cache, *spot_ids)
+        await invalidate(db, comment_cache, *comment_ids)
 
     @classmethod
     async def delete_user(cls, db: AsyncSession,
                           user_id: int) -> Response:
-        """Delete user from data base"""
-
-        query = select(cls.model).filter(cls.model.user_id == user_id)
-        result = await db.execute(query)
-        user = result.scalar_one()
+        """Delete user with a single DELETE ... RETURNING,
+        the ratings going away with the user leave the spot aggregates,
+        the user's spots and comments stay without an owner"""
 
-        await db.delete(user)
+        result = await db.execute(cls.delete_users_query([user_id]))
+        await cls.invalidate_deleted(db, [result.one()])
 
         return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
+    @classmethod
+    async def update_users(cls, db: AsyncSession,
+                           updates: List[Tuple[int, schema.UserBulkUpdateSchema]],
+                           ) -> List[schema.BulkItemResultSchema]:
+        """Update users with one executemany per set of changed columns,
+        a nickname or email taken by another user fails only its own item"""
+
+        user_ids = {update.user_id for _, update in updates}
+        nicknames = {update.nickname for _, update in updates if update.nickname}
+        emails = {update.email for _, update in updates if update.email}
+        query = select(cls.model.user_id, cls.model.nickname, cls.model.email).where(
+            or_(cls.model.user_id.in_(user_ids), cls.model.nickname.in_(nicknames),
+                cls.model.email.in_(emails)))
+        rows = (await db.execute(query)).all()
+        existing = {user_id for user_id, _, _ in rows if user_id in user_ids}
+        # users keeping their own nickname or email don't clash with themselves
+        taken = {("nickname", nickname): user_id for user_id, nickname, _ in rows}
+        taken.update({("email", email): user_id for user_id, _, email in rows})
+
+        results, groups, seen = [], {}, set()
+        for index, update in updates:
+            if update.user_id not in existing:
+                results.append(schema.BulkItemResultSchema(
+                    index=index, error=f"User with user_id={update.user_id} was not found"))
+                continue
+            values = {k: v for k, v in update.dict(exclude={"user_id"}).items() if v}
+            keys = {(key, values[key]) for key in ("nickname", "email") if key in values}
+            if any(taken.get(key, update.user_id) != update.user_id for key in keys) or keys & seen:
+                results.append(schema.BulkItemResultSchema(
+                    index=index, error="Nickname or email is taken"))
+                continue
+            seen |= keys
+            results.append(schema.BulkItemResultSchema(index=index, id=update.user_id))
+            if values:
+                groups.setdefault(tuple(sorted(values)), []).append(
+                    {"b_user_id": update.user_id, **values})
+
+        table = cls.model.__table__
+        for columns, params in groups.items():
+            query = (
+                sqlalchemy_update(table)
+                .where(table.c.user_id == bindparam("b_user_id"))
+                .values({**{column: bindparam(column) for column in columns},
+                         "version": table.c.version + 1})
+            )
+            for chunk in chunked(params, settings.bulk_chunk_size):
+                await db.execute(query, list(chunk))
+
+        await invalidate(db, user_cache,
+                         *(params["b_user_id"] for group in groups.values() for params in group))
+        return results
+
+    @classmethod
+    async def delete_users(cls, db: AsyncSession,
+                           user_ids: List[int],
+                           ) -> List[schema.BulkItemResultSchema]:
+        """Delete users a chunk per DELETE ... RETURNING, as delete_user does"""
+
+        deleted = []
+        for chunk in chunked(user_ids, settings.bulk_chunk_size):
+            deleted += (await db.execute(cls.delete_users_query(list(chunk)))).all()
+
+        await cls.invalidate_deleted(db, deleted)
+        deleted_ids = {row[0] for row in deleted}
+        return [
+            schema.BulkItemResultSchema(index=index, id=user_id) if user_id in deleted_ids
+            else schema.BulkItemResultSchema(
+                index=index, error=f"User with user_id={user_id} was not found")
+            for index, user_id in enumerate(user_ids)
+        ]
+
 
 class CRUDSpot:
     model = SpotDBModel
 
+    @classmethod
+    def spot_values(cls, spot: schema.SpotSchema) -> Dict[str, Any]:
+        """Column values of a new spot with the derived address and geohash"""
+
+        values = spot.dict()
+        values["spot_full_address"] = (f"{spot.spot_street}, {spot.spot_street_number}. "
+                                       f"{spot.spot_country}, {spot.spot_city},")
+        values["spot_geohash"] = None
+        # ratings are earned through CRUDRating, never posted with the spot
+        values.update(spot_raiting=None, spot_rating_count=0, spot_rating_sum=0)
+        if spot.spot_latitude is not None and spot.spot_longitude is not None:
+            values["spot_geohash"] = encode_geohash(spot.spot_latitude, spot.spot_longitude)
+        return values
+
+    @classmethod
+    def update_values(cls, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Columns a partial update sets, coordinates move the geohash along"""
+
+        values = {k: v for k, v in data.items() if v}
+        if data.get("spot_latitude") is not None and data.get("spot_longitude") is not None:
+            values.update(spot_latitude=data["spot_latitude"],
+                          spot_longitude=data["spot_longitude"],
+                          spot_geohash=encode_geohash(data["spot_latitude"],
+                                                      data["spot_longitude"]))
+        return values
+
     @classmethod
     async def get_spot_by_id(cls, db: AsyncSession,
                              spot_id: int,
-                             ) -> schema.SpotSchema:
-        """Get spot by id"""
-        query = select(cls.model).where(cls.model.spot_id == spot_id)
-        result = await db.execute(query)
+                             ) -> schema.SpotVersionedSchema:
+        """Get spot by id with its version, as current as the database it reads"""
 
-        return result.scalar_one()
+        async def load(session: AsyncSession) -> schema.SpotVersionedSchema:
+            query = select(cls.model).where(cls.model.spot_id == spot_id)
+            result = await session.execute(query)
+
+            return schema.SpotVersionedSchema.from_orm(result.scalar_one())
+
+        return await versioned_read(db, spot_cache, cls.model.version, cls.model.spot_id, spot_id, load)
+
+    @classmethod
+    def filtered_spots_query(cls, filter: schema.SpotFilterSchema) -> Select:
+        """Spots matching the filter ordered by spot_id, address parts
+        compare case-insensitively to use the lower() indexes"""
+        query = select(cls.model).order_by(cls.model.spot_id)
+        for name, value in filter.dict().items():
+            if not value:
+                continue
+            column = getattr(cls.model, name)
+            if isinstance(value, str):
+                query = query.where(func.lower(column) == value.lower())
+            else:
+                query = query.where(column == value)
+
+        return query
 
     @classmethod
     async def get_filtered_spots(cls,  db: AsyncSession,
-                                 filter: schema.SpotFilterSchema
-                                 ) -> List[schema.SpotSchema]:
-        """Get all spots"""
-        filter_params = {k: v for k, v in filter.dict().items() if v}
-        query = select(cls.model).filter_by(**filter_params)
+                                 filter: schema.SpotFilterSchema,
+                                 cursor: Optional[str],
+                                 limit: int,
+                                 include_comments: bool = False,
+                                 ) -> schema.SpotPageSchema:
+        """Get a page of filtered spots ordered by spot_id,
+        identical concurrent requests share one query.
+        Comments of the whole page come in one extra IN query.
+        Only the schema columns are read and the rows are trusted as they are"""
+        filter_params = {k: v.lower() if isinstance(v, str) else v
+                         for k, v in filter.dict().items() if v}
+
+        async def load(session: AsyncSession) -> schema.SpotPageSchema:
+            query = cls.filtered_spots_query(filter).limit(limit + 1)
+            if include_comments:
+                query = query.options(
+                    load_only(*schema.SpotSchema.__fields__),
+                    selectinload(cls.model.comments).load_only(*schema.CommentFullSchema.__fields__),
+                )
+            else:
+                query = query.with_only_columns(
+                    *schema_columns(cls.model, schema.SpotSchema, cls.model.spot_id))
+            after_id = decode_cursor("spot_id", cursor)
+            if after_id is not None:
+                query = query.where(cls.model.spot_id > after_id)
+            result = await session.execute(query)
+
+            if include_comments:
+                spots, next_cursor = paginate(result.scalars().all(), "spot_id", limit)
+                items = [
+                    trusted(schema.SpotWithCommentsSchema, spot,
+                            comments=[trusted(schema.CommentFullSchema, comment)
+                                      for comment in spot.comments])
+                    for spot in spots
+                ]
+            else:
+                spots, next_cursor = paginate(result.all(), "spot_id", limit)
+                items = [trusted(schema.SpotSchema, spot) for spot in spots]
+            return schema.SpotPageSchema.construct(items=items, next_cursor=next_cursor)
+
+        key = (tuple(sorted(filter_params.items())), cursor, limit, include_comments)
+        return await shared_read(db, load, functools.partial(filtered_spots_flights.do, key))
+
+    @classmethod
+    async def stream_filtered_spots(cls, db: AsyncSession,
+                                    filter: schema.SpotFilterSchema,
+                                    ) -> AsyncIterator[SpotDBModel]:
+        """Stream all filtered spots through a server-side cursor"""
+        query = (
+            cls.filtered_spots_query(filter)
+            .execution_options(yield_per=settings.export_batch_size)
+        )
+        result = await db.stream(query)
+
+        async for spot in result.scalars():
+            yield spot
+
+    @classmethod
+    async def get_nearby_spots(cls, db: AsyncSession,
+                               area: schema.NearbyQuerySchema,
+                               limit: int,
+                               ) -> List[schema.SpotNearbySchema]:
+        """Get the spots nearest to the area center, narrowed down by the
+        geohash cell ranges around a circle, or around the circle holding a box"""
+        latitude, longitude = area.center()
+        distance = distance_km(cls.model.spot_latitude, cls.model.spot_longitude,
+                               latitude, longitude).label("distance_km")
+        query = select(cls.model, distance).order_by(distance, cls.model.spot_id).limit(limit)
+
+        if area.radius_km is not None:
+            radius_km = area.radius_km
+            min_lat, min_lon, max_lat, max_lon = bounding_box(latitude, longitude, radius_km)
+            query = query.where(distance <= radius_km)
+        else:
+            min_lat, min_lon = area.min_latitude, area.min_longitude
+            max_lat, max_lon = area.max_latitude, area.max_longitude
+            radius_km = enclosing_radius_km(min_lat, min_lon, max_lat, max_lon)
+
+        prefixes = covering_prefixes(latitude, longitude, radius_km)
+        if prefixes:
+            query = query.where(or_(*[
+                and_(cls.model.spot_geohash >= prefix, cls.model.spot_geohash < prefix + "~")
+                for prefix in prefixes
+            ]))
+        query = query.where(cls.model.spot_latitude.between(min_lat, max_lat), or_(*[
+            cls.model.spot_longitude.between(low, high) for low, high in longitude_ranges(min_lon, max_lon)
+        ]))
         result = await db.execute(query)
 
-        return [spot[cls.model] for spot in result.all()]
+        return [
+            schema.SpotNearbySchema(**schema.SpotSchema.from_orm(spot).dict(),
+                                    spot_id=spot.spot_id, distance_km=kilometers)
+            for spot, kilometers in result.all()
+        ]
+
+    @classmethod
+    async def get_top_rated_spots(cls, db: AsyncSession,
+                                  spot_city: str,
+                                  limit: int,
+                                  ) -> List[schema.SpotWithIdSchema]:
+        """Best rated spots of a city, read in ix_spots_city_rating order"""
+
+        query = (
+            select(*schema_columns(cls.model, schema.SpotWithIdSchema))
+            .where(func.lower(cls.model.spot_city) == spot_city.lower(),
+                   cls.model.spot_raiting.isnot(None))
+            .order_by(cls.model.spot_raiting.desc().nullslast(), cls.model.spot_id)
+            .limit(limit)
+        )
+        result = await db.execute(query)
+
+        return [trusted(schema.SpotWithIdSchema, spot) for spot in result.all()]
 
     @classmethod
     async def add_spot(cls, db: AsyncSession,
@@ -121,42 +661,538 @@ class CRUDSpot:
 
         db.add(spot)
         await db.flush()
+        await invalidate(db, spot_cache, spot.spot_id)
+        reindex(db, "spot", spot.spot_id, spot.spot_name,
+                spot.spot_name, spot.spot_description)
+        await publish(db, {spot.owner_id: [feed_entry("spot", spot.spot_id, spot.owner_id,
+                                                      spot.spot_name, spot.created_at)]})
         return spot
 
+    @classmethod
+    async def next_spot_ids(cls, db: AsyncSession, count: int) -> List[int]:
+        """Draw `count` ids from the spot_id sequence in one round trip"""
+
+        sequence = func.pg_get_serial_sequence(cls.model.__tablename__, "spot_id")
+        query = select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+        return list((await db.execute(query)).scalars().all())
+
+    @classmethod
+    async def add_spots(cls, db: AsyncSession,
+                        spots: List[Tuple[int, schema.SpotSchema]],
+                        ) -> List[schema.BulkItemResultSchema]:
+        """Add spots with multi-row INSERT on ids drawn from the sequence, owners
+        are checked up front so an unknown one fails only its own item"""
+
+        owner_ids = {spot.owner_id for _, spot in spots}
+        query = select(UserDBModel.user_id).where(UserDBModel.user_id.in_(owner_ids))
+        known_owners = set((await db.execute(query)).scalars().all())
+
+        results, rows = [], []
+        for index, spot in spots:
+            if spot.owner_id in known_owners:
+                rows.append((index, cls.spot_values(spot)))
+            else:
+                results.append(schema.BulkItemResultSchema(
+                    index=index, error=f"Owner with user_id={spot.owner_id} was not found"))
+
+        spot_ids, entries = [], {}
+        for chunk in chunked(rows, settings.bulk_chunk_size):
+            # RETURNING order is not guaranteed, ids are drawn up front and matched on
+            chunk = [(index, {**values, "spot_id": spot_id})
+                     for (index, values), spot_id in zip(chunk, await cls.next_spot_ids(db, len(chunk)))]
+            query = insert(cls.model).values([values for _, values in chunk]).returning(
+                cls.model.spot_id, cls.model.created_at)
+            created = dict((await db.execute(query)).all())
+            for index, values in chunk:
+                spot_id = values["spot_id"]
+                spot_ids.append(spot_id)
+                results.append(schema.BulkItemResultSchema(index=index, id=spot_id))
+                reindex(db, "spot", spot_id, values["spot_name"],
+                        values["spot_name"], values["spot_description"])
+                entries.setdefault(values["owner_id"], []).append(feed_entry(
+                    "spot", spot_id, values["owner_id"], values["spot_name"], created[spot_id]))
+
+        await invalidate(db, spot_cache, *spot_ids)
+        await publish(db, entries)
+        return results
+
+    @classmethod
+    async def update_spots(cls, db: AsyncSession,
+                           updates: List[Tuple[int, schema.SpotBulkUpdateSchema]],
+                           ) -> List[schema.BulkItemResultSchema]:
+        """Update spots with one executemany per set of changed columns"""
+
+        spot_ids = {update.spot_id for _, update in updates}
+        query = select(cls.model.spot_id).where(cls.model.spot_id.in_(spot_ids))
+        existing = set((await db.execute(query)).scalars().all())
+
+        results, groups = [], {}
+        for index, update in updates:
+            if update.spot_id not in existing:
+                results.append(schema.BulkItemResultSchema(
+                    index=index, error=f"Spot with spot_id={update.spot_id} was not found"))
+                continue
+            results.append(schema.BulkItemResultSchema(index=index, id=update.spot_id))
+            values = cls.update_values(update.dict(exclude={"spot_id"}))
+            if values:
+                groups.setdefault(tuple(sorted(values)), []).append(
+                    {"b_spot_id": update.spot_id, **values})
+
+        table = cls.model.__table__
+        for columns, params in groups.items():
+            query = (
+                sqlalchemy_update(table)
+                .where(table.c.spot_id == bindparam("b_spot_id"))
+                .values({**{column: bindparam(column) for column in columns},
+                         "version": table.c.version + 1})
+            )
+            for chunk in chunked(params, settings.bulk_chunk_size):
+                await db.execute(query, list(chunk))
+
+        updated_ids = [params["b_spot_id"] for group in groups.values() for params in group]
+        await invalidate(db, spot_cache, *updated_ids)
+        if search_index.needs_documents and updated_ids:
+            query = select(cls.model.spot_id, cls.model.spot_name,
+                           cls.model.spot_description).where(cls.model.spot_id.in_(updated_ids))
+            for spot_id, spot_name, spot_description in (await db.execute(query)).all():
+                reindex(db, "spot", spot_id, spot_name, spot_name, spot_description)
+        return results
+
+    @classmethod
+    def delete_spots_query(cls, spot_ids: List[int]):
+        """DELETE ... RETURNING of spots, each row with the comments
+        ON DELETE CASCADE takes along, they are cached and indexed too"""
+
+        comment_ids = (
+            select(func.array_agg(CommentDBModel.comment_id))
+            .where(CommentDBModel.spot_id == cls.model.spot_id)
+            .scalar_subquery()
+        )
+        return (
+            delete(cls.model)
+            .where(cls.model.spot_id.in_(spot_ids))
+            .returning(cls.model.spot_id, comment_ids.label("comment_ids"))
+            .execution_options(synchronize_session=False)
+        )
+
+    @classmethod
+    async def invalidate_deleted(cls, db: AsyncSession, rows: List[Tuple[Any, ...]]):
+        comment_ids = [comment_id for row in rows for comment_id in row.comment_ids or []]
+        await invalidate(db, spot_cache, *(row.spot_id for row in rows))
+        await invalidate(db, comment_cache, *comment_ids)
+        for row in rows:
+            unindex(db, "spot", row.spot_id)
+        for comment_id in comment_ids:
+            unindex(db, "comment", comment_id)
+
+    @classmethod
+    async def delete_spots(cls, db: AsyncSession,
+                           spot_ids: List[int],
+                           ) -> List[schema.BulkItemResultSchema]:
+        """Delete spots with DELETE ... WHERE spot_id IN (...) RETURNING"""
+
+        rows = []
+        for chunk in chunked(spot_ids, settings.bulk_chunk_size):
+            rows += (await db.execute(cls.delete_spots_query(list(chunk)))).all()
+
+        await cls.invalidate_deleted(db, rows)
+        deleted = {row.spot_id for row in rows}
+        return [
+            schema.BulkItemResultSchema(index=index, id=spot_id) if spot_id in deleted
+            else schema.BulkItemResultSchema(
+                index=index, error=f"Spot with spot_id={spot_id} was not found")
+            for index, spot_id in enumerate(spot_ids)
+        ]
+
+    @classmethod
+    async def search(cls, db: AsyncSession,
+                     query: schema.SearchQuerySchema,
+                     cursor: Optional[str],
+                     limit: int,
+                     ) -> schema.SearchPageSchema:
+        """Full-text search over spots and comments, best matches first"""
+
+        offset = decode_cursor("offset", cursor) or 0
+        hits = await search_index.search(db, tokenize(query.q), offset, limit + 1)
+
+        next_cursor = encode_cursor("offset", offset + limit) if len(hits) > limit else None
+        return schema.SearchPageSchema(items=hits[:limit], next_cursor=next_cursor)
+
     @classmethod
     async def update(cls, db: AsyncSession,
                      spot_id: int,
                      data: Dict,
-                     ) -> str:
-        """Update a spot from data base"""
+                     versions: Optional[List[int]] = None,
+                     ) -> int:
+        """Update a spot with a single UPDATE ... RETURNING the new version,
+        only from one of `versions` if given"""
 
         query = (
             sqlalchemy_update(cls.model)
             .where(cls.model.spot_id == spot_id)
-            .values(**{k: v for k, v in data.items() if v})
-            .execution_options(synchronize_session="fetch")
+            .values(**cls.update_values(data), version=cls.model.version + 1)
+            .returning(cls.model.spot_name, cls.model.spot_description, cls.model.version)
+            .execution_options(synchronize_session=False)
         )
+        if versions is not None:
+            query = query.where(cls.model.version.in_(versions))
 
         result = await db.execute(query)
+        row = result.one_or_none()
+        if row is None:
+            await missed_update(db, cls.model.spot_id, spot_id, versions)
+        spot_name, spot_description, version = row
+        await invalidate(db, spot_cache, spot_id)
+        reindex(db, "spot", spot_id, spot_name, spot_name, spot_description)
 
-        rows_updated = result.rowcount
-        if rows_updated:
-            return f"Spot with {spot_id=} is updated!"
-
-        raise NoResultFound
+        return version
 
     @classmethod
     async def delete_spot(cls, db: AsyncSession,
                           spot_id: int) -> Response:
-        """Delete spot from data base"""
+        """Delete spot with a single DELETE ... RETURNING"""
+
+        result = await db.execute(cls.delete_spots_query([spot_id]))
+        await cls.invalidate_deleted(db, [result.one()])
+
+        return Response(status_code=HTTPStatus.NO_CONTENT.value)
+
+
+class CRUDRating:
+    model = RatingDBModel
+
+    @classmethod
+    async def lock_spot(cls, db: AsyncSession, spot_id: int):
+        """Serialize rating writes of a spot, so each one sees the score it replaces"""
+
+        result = await db.execute(
+            select(SpotDBModel.spot_id).where(SpotDBModel.spot_id == spot_id).with_for_update())
+        result.scalar_one()
+
+    @classmethod
+    async def rate(cls, db: AsyncSession,
+                   spot_id: int,
+                   user_id: int,
+                   score: int,
+                   ) -> schema.SpotRatingSchema:
+        """Set the user's rating of a spot and move the spot aggregates
+        in the same transaction"""
+
+        await cls.lock_spot(db, spot_id)
+
+        previous = (
+            select(cls.model.score)
+            .where(cls.model.spot_id == spot_id, cls.model.user_id == user_id)
+            .cte("previous")
+        )
+        upsert = pg_insert(cls.model).values(spot_id=spot_id, user_id=user_id, score=score)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[cls.model.spot_id, cls.model.user_id],
+            set_={"score": upsert.excluded.score, "updated_at": utc_now()},
+        ).cte("upsert")
+        replaced_count = select(func.count()).select_from(previous).scalar_subquery()
+        replaced_sum = select(func.coalesce(func.sum(previous.c.score), 0)).scalar_subquery()
+        query = (
+            sqlalchemy_update(SpotDBModel)
+            .where(SpotDBModel.spot_id == spot_id)
+            .add_cte(previous)
+            .add_cte(upsert)
+            .values(**rating_values(1 - replaced_count, score - replaced_sum))
+            .returning(SpotDBModel.spot_id, SpotDBModel.spot_raiting,
+                       SpotDBModel.spot_rating_count)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(query)
+        await invalidate(db, spot_cache, spot_id)
+
+        return schema.SpotRatingSchema(**result.one()._mapping)
+
+    @classmethod
+    async def unrate(cls, db: AsyncSession,
+                     spot_id: int,
+                     user_id: int,
+                     ) -> schema.SpotRatingSchema:
+        """Remove the user's rating of a spot, if any"""
+
+        await cls.lock_spot(db, spot_id)
+
+        removed = (
+            delete(cls.model)
+            .where(cls.model.spot_id == spot_id, cls.model.user_id == user_id)
+            .returning(cls.model.score)
+            .cte("removed")
+        )
+        removed_count = select(func.count()).select_from(removed).scalar_subquery()
+        removed_sum = select(func.coalesce(func.sum(removed.c.score), 0)).scalar_subquery()
+        query = (
+            sqlalchemy_update(SpotDBModel)
+            .where(SpotDBModel.spot_id == spot_id)
+            .add_cte(removed)
+            .values(**rating_values(-removed_count, -removed_sum))
+            .returning(SpotDBModel.spot_id, SpotDBModel.spot_raiting,
+                       SpotDBModel.spot_rating_count)
+            .execution_options(synchronize_session=False)
+        )
+        result = await db.execute(query)
+        await invalidate(db, spot_cache, spot_id)
+
+        return schema.SpotRatingSchema(**result.one()._mapping)
+
+
+class CRUDFriend:
+    model = FriendshipDBModel
+
+    @classmethod
+    async def add_friend(cls, db: AsyncSession,
+                         user_id: int,
+                         friend_id: int) -> str:
+        """Befriend two users, both directions in one INSERT"""
+
+        await ensure_exists(db, UserDBModel.user_id, user_id, friend_id)
+        query = (
+            pg_insert(cls.model)
+            .values([{"user_id": user_id, "friend_id": friend_id},
+                     {"user_id": friend_id, "friend_id": user_id}])
+            .on_conflict_do_nothing()
+        )
+        await db.execute(query)
+
+        return f"Users {user_id=} and {friend_id=} are friends!"
+
+    @classmethod
+    async def remove_friend(cls, db: AsyncSession,
+                            user_id: int,
+                            friend_id: int) -> Response:
+        """Unfriend two users"""
+
+        query = delete(cls.model).where(
+            tuple_(cls.model.user_id, cls.model.friend_id).in_(
+                [(user_id, friend_id), (friend_id, user_id)]))
+        await db.execute(query)
+
+        return Response(status_code=HTTPStatus.NO_CONTENT.value)
+
+    @classmethod
+    async def get_friends(cls, db: AsyncSession,
+                          user_id: int,
+                          cursor: Optional[str],
+                          limit: int,
+                          ) -> schema.UserBriefPageSchema:
+        """Get a page of friends ordered by user_id, read along the primary key"""
+
+        query = (
+            select(UserDBModel)
+            .join(cls.model, cls.model.friend_id == UserDBModel.user_id)
+            .where(cls.model.user_id == user_id)
+            .order_by(cls.model.friend_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("user_id", cursor)
+        if after_id is not None:
+            query = query.where(cls.model.friend_id > after_id)
+        result = await db.execute(query)
+
+        friends, next_cursor = paginate(result.scalars().all(), "user_id", limit)
+        return schema.UserBriefPageSchema(items=friends, next_cursor=next_cursor)
 
-        query = select(cls.model).filter(cls.model.spot_id == spot_id)
+    @classmethod
+    async def get_mutual_friends(cls, db: AsyncSession,
+                                 user_id: int,
+                                 other_id: int,
+                                 cursor: Optional[str],
+                                 limit: int,
+                                 ) -> schema.UserBriefPageSchema:
+        """Get a page of friends two users share, a merge of two primary key ranges"""
+
+        mine, theirs = aliased(cls.model), aliased(cls.model)
+        query = (
+            select(UserDBModel)
+            .join(mine, mine.friend_id == UserDBModel.user_id)
+            .join(theirs, theirs.friend_id == mine.friend_id)
+            .where(mine.user_id == user_id, theirs.user_id == other_id)
+            .order_by(mine.friend_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("user_id", cursor)
+        if after_id is not None:
+            query = query.where(mine.friend_id > after_id)
+        result = await db.execute(query)
+
+        friends, next_cursor = paginate(result.scalars().all(), "user_id", limit)
+        return schema.UserBriefPageSchema(items=friends, next_cursor=next_cursor)
+
+    @classmethod
+    async def get_friends_spots(cls, db: AsyncSession,
+                                user_id: int,
+                                cursor: Optional[str],
+                                limit: int,
+                                ) -> schema.SpotWithIdPageSchema:
+        """Get a page of spots added by friends, newest first. Every friend
+        contributes at most one page from ix_spots_owner_id, so the cost is
+        bounded by friends * limit however many spots they added"""
+
+        recent = select(SpotDBModel.spot_id).where(SpotDBModel.owner_id == cls.model.friend_id)
+        after_id = decode_cursor("spot_id", cursor)
+        if after_id is not None:
+            recent = recent.where(SpotDBModel.spot_id < after_id)
+        recent = (
+            recent.order_by(SpotDBModel.spot_id.desc())
+            .limit(limit + 1)
+            .lateral("recent")
+        )
+        # the page is picked on (owner_id, spot_id) index entries alone,
+        # only its own rows are read from the table
+        page = (
+            select(recent.c.spot_id)
+            .select_from(cls.model)
+            .join(recent, true())
+            .where(cls.model.user_id == user_id)
+            .order_by(recent.c.spot_id.desc())
+            .limit(limit + 1)
+            .subquery("page")
+        )
+        query = (
+            select(*schema_columns(SpotDBModel, schema.SpotWithIdSchema))
+            .join(page, page.c.spot_id == SpotDBModel.spot_id)
+            .order_by(SpotDBModel.spot_id.desc())
+        )
         result = await db.execute(query)
-        spot = result.scalar_one()
-        await db.delete(spot)
+
+        spots, next_cursor = paginate(result.all(), "spot_id", limit)
+        return schema.SpotWithIdPageSchema.construct(
+            items=[trusted(schema.SpotWithIdSchema, spot) for spot in spots],
+            next_cursor=next_cursor)
+
+
+class CRUDFeed:
+
+    @classmethod
+    async def get_feed(cls, db: AsyncSession,
+                       user_id: int,
+                       cursor: Optional[str],
+                       limit: int,
+                       ) -> schema.FeedPageSchema:
+        """Get a page of the user's feed, newest first: one range read of the
+        fanned out feed, plus the outboxes of friends too popular to fan out.
+        Entries of deleted spots and comments are left out"""
+
+        before = decode_feed_cursor(cursor)
+        entries = await feed_store.range(user_id, before, limit + 1)
+
+        celebrity_ids = await feed_store.celebrities()
+        if celebrity_ids:
+            result = await db.execute(
+                select(FriendshipDBModel.friend_id)
+                .where(FriendshipDBModel.user_id == user_id,
+                       FriendshipDBModel.friend_id.in_(celebrity_ids)))
+            for actor_id in result.scalars().all():
+                entries += await feed_store.range_outbox(actor_id, before, limit + 1)
+            entries.sort(key=feed_position, reverse=True)
+
+        items = entries[:limit]
+        # from the page as stored, a page of deleted entries still leads on
+        next_cursor = encode_feed_cursor(items[-1]) if len(entries) > limit else None
+        return schema.FeedPageSchema(items=await cls.live_entries(db, items), next_cursor=next_cursor)
+
+    @classmethod
+    async def live_entries(cls, db: AsyncSession,
+                           entries: List[schema.FeedEntrySchema],
+                           ) -> List[schema.FeedEntrySchema]:
+        """Entries whose spot or comment still exists, looked up in one query:
+        deletes don't reach the feeds they were fanned out to"""
+
+        if not entries:
+            return entries
+        ids = {kind: [entry.id for entry in entries if entry.kind == kind] for kind in ("spot", "comment")}
+        query = union_all(
+            select(literal_column("'spot'"), SpotDBModel.spot_id)
+            .where(SpotDBModel.spot_id.in_(ids["spot"])),
+            select(literal_column("'comment'"), CommentDBModel.comment_id)
+            .where(CommentDBModel.comment_id.in_(ids["comment"])),
+        )
+        live = set((await db.execute(query)).all())
+        return [entry for entry in entries if (entry.kind, entry.id) in live]
+
+
+class CRUDFavourite:
+    model = FavouriteSpotDBModel
+
+    @classmethod
+    async def add_favourite(cls, db: AsyncSession,
+                            user_id: int,
+                            spot_id: int) -> str:
+        """Mark a spot as the user's favourite"""
+
+        await ensure_exists(db, SpotDBModel.spot_id, spot_id)
+        query = (
+            pg_insert(cls.model)
+            .values(user_id=user_id, spot_id=spot_id)
+            .on_conflict_do_nothing()
+        )
+        await db.execute(query)
+
+        return f"Spot with {spot_id=} is a favourite of {user_id=}!"
+
+    @classmethod
+    async def remove_favourite(cls, db: AsyncSession,
+                               user_id: int,
+                               spot_id: int) -> Response:
+        """Unmark a favourite spot"""
+
+        query = delete(cls.model).where(cls.model.user_id == user_id,
+                                        cls.model.spot_id == spot_id)
+        await db.execute(query)
 
         return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
+    @classmethod
+    async def get_favourite_spots(cls, db: AsyncSession,
+                                  user_id: int,
+                                  cursor: Optional[str],
+                                  limit: int,
+                                  ) -> schema.SpotWithIdPageSchema:
+        """Get a page of the user's favourite spots ordered by spot_id"""
+
+        query = (
+            select(*schema_columns(SpotDBModel, schema.SpotWithIdSchema))
+            .join(cls.model, cls.model.spot_id == SpotDBModel.spot_id)
+            .where(cls.model.user_id == user_id)
+            .order_by(cls.model.spot_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("spot_id", cursor)
+        if after_id is not None:
+            query = query.where(cls.model.spot_id > after_id)
+        result = await db.execute(query)
+
+        spots, next_cursor = paginate(result.all(), "spot_id", limit)
+        return schema.SpotWithIdPageSchema.construct(
+            items=[trusted(schema.SpotWithIdSchema, spot) for spot in spots],
+            next_cursor=next_cursor)
+
+    @classmethod
+    async def get_favourited_by(cls, db: AsyncSession,
+                                spot_id: int,
+                                cursor: Optional[str],
+                                limit: int,
+                                ) -> schema.UserBriefPageSchema:
+        """Get a page of users who favourited a spot, read from ix_favourite_spots_spot_id"""
+
+        query = (
+            select(UserDBModel)
+            .join(cls.model, cls.model.user_id == UserDBModel.user_id)
+            .where(cls.model.spot_id == spot_id)
+            .order_by(cls.model.user_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("user_id", cursor)
+        if after_id is not None:
+            query = query.where(cls.model.user_id > after_id)
+        result = await db.execute(query)
+
+        users, next_cursor = paginate(result.scalars().all(), "user_id", limit)
+        return schema.UserBriefPageSchema(items=users, next_cursor=next_cursor)
+
 
 class CRUDComment:
     model = CommentDBModel
@@ -164,12 +1200,45 @@ class CRUDComment:
     @classmethod
     async def get_comment_by_id(cls, db: AsyncSession,
                                 comment_id: int,
-                                ) -> schema.CommentFullSchema:
-        """Get comment by id"""
-        query = select(cls.model).where(cls.model.comment_id == comment_id)
+                                ) -> schema.CommentVersionedSchema:
+        """Get comment by id with its version, as current as the database it reads"""
+
+        async def load(session: AsyncSession) -> schema.CommentVersionedSchema:
+            query = select(cls.model).where(cls.model.comment_id == comment_id)
+            result = await session.execute(query)
+
+            return schema.CommentVersionedSchema.from_orm(result.scalar_one())
+
+        return await versioned_read(db, comment_cache, cls.model.version, cls.model.comment_id,
+                                    comment_id, load)
+
+    @classmethod
+    async def get_spot_comments(cls, db: AsyncSession,
+                                spot_id: int,
+                                cursor: Optional[str],
+                                limit: int,
+                                ) -> schema.CommentPageSchema:
+        """Get a page of spot comments ordered by comment_id"""
+
+        query = (
+            select(cls.model)
+            .where(cls.model.spot_id == spot_id)
+            .order_by(cls.model.comment_id)
+            .limit(limit + 1)
+        )
+        after_id = decode_cursor("comment_id", cursor)
+        if after_id is not None:
+            query = query.where(cls.model.comment_id > after_id)
         result = await db.execute(query)
 
-        return result.scalar_one()
+        comments, next_cursor = paginate(result.scalars().all(), "comment_id", limit)
+        if not comments:
+            # an empty page is fine, an unknown spot is not
+            spot = await db.execute(
+                select(SpotDBModel.spot_id).where(SpotDBModel.spot_id == spot_id))
+            spot.scalar_one()
+
+        return schema.CommentPageSchema(items=comments, next_cursor=next_cursor)
 
     @classmethod
     async def add_comment(cls, db: AsyncSession,
@@ -178,4 +1247,9 @@ class CRUDComment:
 
         db.add(comment)
         await db.flush()
+        await invalidate(db, comment_cache, comment.comment_id)
+        reindex(db, "comment", comment.comment_id, comment.body, comment.body)
+        await publish(db, {comment.owner_id: [feed_entry("comment", comment.comment_id,
+                                                         comment.owner_id, comment.body,
+                                                         comment.created_at)]})
         return comment
@@ -1,26 +1,226 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+import itertools
+import logging
+import os
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 from api import models
 
+from api.constants import PRIMARY_STICKY_COOKIE
+from api.metrics import Gauge, TimedQueuePool, instrument_engine
 from api.settings import settings
 
+logger = logging.getLogger(__name__)
+
+
+def build_engine(dsn: str, name: str = "primary") -> AsyncEngine:
+    """Engine with the pool tuned from Settings, `name` labels its metrics"""
+
+    engine = create_async_engine(
+        make_url(dsn).update_query_dict(
+            {"prepared_statement_cache_size": str(settings.db_statement_cache_size)}),
+        poolclass=TimedQueuePool,
+        pool_logging_name=name,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_recycle=settings.db_pool_recycle,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        connect_args={"timeout": settings.db_query_timeout}
+    )
+    if settings.metrics_enabled or settings.db_slow_query_ms or settings.db_query_budget:
+        instrument_engine(engine, name)
+    return engine
+
+
+class ReplicaRouter:
+    """Picks the engine a read-only session is bound to"""
+
+    def __init__(self, primary: AsyncEngine,
+                 replicas: List[AsyncEngine],
+                 balancing: str = "round_robin"):
+        self.primary = primary
+        self.replicas = replicas
+        self.balancing = balancing
+        self._round_robin = itertools.cycle(replicas)
+
+    def choose(self, primary: bool = False) -> AsyncEngine:
+        if primary or not self.replicas:
+            return self.primary
+        if self.balancing == "least_connections":
+            return min(self.replicas, key=lambda engine: engine.sync_engine.pool.checkedout())
+        return next(self._round_robin)
+
+
+_replica_router: Optional[ReplicaRouter] = None
+
+
+def replica_router() -> ReplicaRouter:
+    """Primary and replica engines, built from Settings on first use"""
+    global _replica_router
+    if _replica_router is None:
+        primary = build_engine(settings.db_dsn)
+        replicas = [build_engine(dsn, f"replica{index}")
+                    for index, dsn in enumerate(settings.db_replica_dsns)]
+        _replica_router = ReplicaRouter(primary, replicas,
+                                        balancing=settings.db_replica_balancing)
+    return _replica_router
+
+
+def get_engine() -> AsyncEngine:
+    """The primary engine"""
+    return replica_router().primary
+
+
+def all_engines() -> List[AsyncEngine]:
+    """Engines built so far, none before the first database use"""
+    if _replica_router is None:
+        return []
+    return [_replica_router.primary, *_replica_router.replicas]
+
+
+async def warm_up_pools(connections: int):
+    """Open pool connections up front, so the first requests after a start
+    don't pay for connects. A database that is down only delays them"""
+    replica_router()
+    for engine in all_engines():
+        try:
+            async with AsyncExitStack() as stack:
+                for _ in range(min(connections, settings.db_pool_size)):
+                    connection = await stack.enter_async_context(engine.connect())
+                    await connection.exec_driver_sql("SELECT 1")
+        except Exception as exc:
+            logger.warning(f"Pool warm-up of {engine.sync_engine.pool.logging_name} failed: {exc}")
+
+
+async def dispose_pools():
+    """Close every pooled connection, on shutdown"""
+    for engine in all_engines():
+        await engine.dispose()
+
+
+def forget_pools():
+    """A forked child drops the connections it inherited without closing
+    them, they still belong to the parent"""
+    for engine in all_engines():
+        engine.sync_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=forget_pools)
+
+
+def pool_connections() -> Dict[Tuple[str, str], int]:
+    """Connections of every pool by state, read at scrape time"""
+    connections = {}
+    for engine in all_engines():
+        pool = engine.sync_engine.pool
+        connections[(pool.logging_name, "checked_out")] = pool.checkedout()
+        connections[(pool.logging_name, "idle")] = pool.checkedin()
+        connections[(pool.logging_name, "overflow")] = max(pool.overflow(), 0)
+    return connections
 
-async_engine = create_async_engine(
-    settings.db_dsn,
-    pool_pre_ping=True,
-    connect_args={"timeout": settings.db_query_timeout}
-)
 
+Gauge("spotapp_db_pool_connections", "Pool connections by state", ("pool", "state"),
+      collect=pool_connections)
+
+# bound per session with get_engine(), the engine is built on first use
 SessionFactory = sessionmaker(autocommit=False,
                               autoflush=False,
-                              bind=async_engine,
                               class_=AsyncSession)
 
+# autocommit connections: a read-only handler skips BEGIN/COMMIT round-trips
+ReadSessionFactory = sessionmaker(autocommit=False,
+                                  autoflush=False,
+                                  class_=AsyncSession)
+_read_binds: Dict[AsyncEngine, AsyncEngine] = {}
+
+
+def read_bind(engine: AsyncEngine) -> AsyncEngine:
+    """Autocommit variant of `engine`, sharing its pool"""
+    if engine not in _read_binds:
+        _read_binds[engine] = engine.execution_options(isolation_level="AUTOCOMMIT")
+    return _read_binds[engine]
+
+
+def on_commit(session: AsyncSession,
+              callback: Callable[[], Awaitable[None]]):
+    """Schedule a callback to run once the session transaction is committed"""
+
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+def mark_written(session: Session):
+    """Flag the request of a session that wrote, its client then reads its own
+    writes from the primary. Set while the handler runs: the commit comes after
+    the response has started"""
+
+    state = session.info.get("request_state")
+    if state is not None:
+        state.wrote = True
+
+
+@event.listens_for(Session, "after_flush")
+def flushed(session: Session, flush_context):
+    mark_written(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def executed(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        mark_written(orm_execute_state.session)
 
-async def get_session() -> AsyncSession:
+
+async def get_session(request: Request) -> AsyncSession:
     """Session factory"""
 
-    async with SessionFactory() as session:
+    async with SessionFactory(bind=get_engine()) as session:
+        session.info["request_state"] = request.state
         async with session.begin():
             yield session
             await session.commit()
+
+        for callback in session.info.pop("on_commit", []):
+            await callback()
+
+
+def sticks_to_primary(request: Optional[Request]) -> bool:
+    """Client wrote recently and must read its own writes"""
+
+    if request is None:
+        return False
+    try:
+        return int(request.cookies.get(PRIMARY_STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """Session factory for read-only handlers, routed to a replica if any"""
+
+    primary = sticks_to_primary(request)
+    engine = replica_router().choose(primary=primary)
+    async with ReadSessionFactory(bind=read_bind(engine)) as session:
+        session.info["reads_own_writes"] = primary
+        yield session
+
+
+def reads_own_writes(session: AsyncSession) -> bool:
+    """The session is pinned to the primary, so its client sees its own writes"""
+    return session.info.get("reads_own_writes", False)
+
+
+@asynccontextmanager
+async def shared_read_session(session: AsyncSession,
+                              primary: bool = False) -> AsyncIterator[AsyncSession]:
+    """Short-lived read session on the engine `session` reads from, for a load
+    shared by several requests: any of them may end while it runs.
+    On the primary with `primary`, for loads a cache keeps"""
+
+    bind = read_bind(replica_router().primary) if primary else session.bind
+    async with ReadSessionFactory(bind=bind) as shared:
+        yield shared
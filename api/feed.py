@@ -0,0 +1,142 @@
+import bisect
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from api import schema
+from api.lazy import Lazy
+from api.pagination import InvalidCursorError, cursor_key, decode_position, encode_position
+from api.settings import settings
+
+# entry time, then kind and id: entries of the same microsecond keep an order
+FeedPosition = Tuple[int, str, int]
+
+
+def feed_position(entry: schema.FeedEntrySchema) -> FeedPosition:
+    return entry.score, entry.kind, entry.id
+
+
+def encode_feed_cursor(entry: schema.FeedEntrySchema) -> str:
+    return encode_position({"score": entry.score, "kind": entry.kind, "id": entry.id})
+
+
+def decode_feed_cursor(cursor: Optional[str]) -> Optional[FeedPosition]:
+    """Position the next page starts after"""
+    if not cursor:
+        return None
+    position = decode_position(cursor)
+    if not isinstance(position.get("kind"), str):
+        raise InvalidCursorError(f"Malformed cursor: {cursor!r}")
+    return cursor_key(position, "score", cursor), position["kind"], cursor_key(position, "id", cursor)
+
+
+class MemoryFeedStore:
+    """Per-user feeds in process memory, newest entries last"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.feeds: Dict[str, tuple] = {}
+        self.celebrity_ids: Set[int] = set()
+
+    def _push(self, key: str, entry: schema.FeedEntrySchema):
+        positions, entries = self.feeds.setdefault(key, ([], []))
+        position = feed_position(entry)
+        index = bisect.bisect_right(positions, position)
+        positions.insert(index, position)
+        entries.insert(index, entry)
+        if len(positions) > self.max_entries:
+            del positions[:-self.max_entries]
+            del entries[:-self.max_entries]
+
+    def _range(self, key: str, before: Optional[FeedPosition],
+               limit: int) -> List[schema.FeedEntrySchema]:
+        positions, entries = self.feeds.get(key, ([], []))
+        end = len(positions) if before is None else bisect.bisect_left(positions, before)
+        return entries[max(end - limit, 0):end][::-1]
+
+    async def push(self, user_ids: Iterable[int], entry: schema.FeedEntrySchema):
+        for user_id in user_ids:
+            self._push(f"feed:{user_id}", entry)
+
+    async def push_outbox(self, actor_id: int, entry: schema.FeedEntrySchema):
+        self.celebrity_ids.add(actor_id)
+        self._push(f"outbox:{actor_id}", entry)
+
+    async def range(self, user_id: int, before: Optional[FeedPosition],
+                    limit: int) -> List[schema.FeedEntrySchema]:
+        return self._range(f"feed:{user_id}", before, limit)
+
+    async def range_outbox(self, actor_id: int, before: Optional[FeedPosition],
+                           limit: int) -> List[schema.FeedEntrySchema]:
+        return self._range(f"outbox:{actor_id}", before, limit)
+
+    async def celebrities(self) -> Set[int]:
+        return self.celebrity_ids
+
+
+class RedisFeedStore:
+    """Feeds as sorted sets scored by entry time, over any client with
+    the redis.asyncio sorted set API"""
+
+    def __init__(self, client: Any, max_entries: int):
+        self.client = client
+        self.max_entries = max_entries
+
+    async def _push(self, keys: Iterable[str], entry: schema.FeedEntrySchema):
+        member = entry.json()
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.zadd(key, {member: entry.score})
+            # keep the newest max_entries
+            pipeline.zremrangebyrank(key, 0, -self.max_entries - 1)
+        await pipeline.execute()
+
+    async def _range(self, key: str, before: Optional[FeedPosition],
+                     limit: int) -> List[schema.FeedEntrySchema]:
+        members = await self.client.zrevrangebyscore(
+            key, "+inf" if before is None else f"({before[0]}", "-inf", start=0, num=limit)
+        entries = [schema.FeedEntrySchema.parse_raw(member) for member in members]
+
+        # members of one score come in member order, not position order:
+        # the score the cursor points into and the one the page may cut
+        # through are read whole
+        scores = set() if before is None else {before[0]}
+        if len(entries) == limit:
+            scores.add(entries[-1].score)
+        for score in scores:
+            entries += [schema.FeedEntrySchema.parse_raw(member)
+                        for member in await self.client.zrangebyscore(key, score, score)]
+
+        by_position = {feed_position(entry): entry for entry in entries
+                       if before is None or feed_position(entry) < before}
+        return [by_position[position] for position in sorted(by_position, reverse=True)[:limit]]
+
+    async def push(self, user_ids: Iterable[int], entry: schema.FeedEntrySchema):
+        await self._push([f"spotapp:feed:{user_id}" for user_id in user_ids], entry)
+
+    async def push_outbox(self, actor_id: int, entry: schema.FeedEntrySchema):
+        await self.client.sadd("spotapp:feed:celebrities", actor_id)
+        await self._push([f"spotapp:outbox:{actor_id}"], entry)
+
+    async def range(self, user_id: int, before: Optional[FeedPosition],
+                    limit: int) -> List[schema.FeedEntrySchema]:
+        return await self._range(f"spotapp:feed:{user_id}", before, limit)
+
+    async def range_outbox(self, actor_id: int, before: Optional[FeedPosition],
+                           limit: int) -> List[schema.FeedEntrySchema]:
+        return await self._range(f"spotapp:outbox:{actor_id}", before, limit)
+
+    async def celebrities(self) -> Set[int]:
+        return {int(actor_id) for actor_id in await self.client.smembers("spotapp:feed:celebrities")}
+
+
+def make_feed_store():
+    """Build the store configured in Settings"""
+    if settings.feed_backend == "redis":
+        from redis import asyncio as aioredis  # optional dependency
+
+        return RedisFeedStore(aioredis.from_url(settings.feed_redis_url or settings.cache_redis_url),
+                              max_entries=settings.feed_max_entries)
+
+    return MemoryFeedStore(max_entries=settings.feed_max_entries)
+
+
+feed_store = Lazy(make_feed_store)
@@ -0,0 +1,122 @@
+import math
+from typing import List, Tuple
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+
+
+def encode_geohash(latitude: float, longitude: float,
+                   precision: int = GEOHASH_PRECISION) -> str:
+    """Interleave longitude/latitude bisections into a base32 geohash"""
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits = bits * 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = bit_count = 0
+
+    return "".join(geohash)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Height and width of a geohash cell in degrees"""
+
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_prefixes(latitude: float, longitude: float,
+                      radius_km: float) -> List[str]:
+    """Geohash cells covering a circle: the cell around the center and its
+    8 neighbours, at the finest precision whose cell is wider than the radius.
+    Empty when no precision fits, e.g. next to the poles"""
+
+    lon_km_per_degree = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = cell_size(precision)
+        if (lat_step * KM_PER_DEGREE >= radius_km
+                and lon_step * lon_km_per_degree >= radius_km):
+            break
+    else:
+        return []
+
+    cells = set()
+    for lat_offset in (-lat_step, 0, lat_step):
+        for lon_offset in (-lon_step, 0, lon_step):
+            lat = min(max(latitude + lat_offset, -90.0), 90.0)
+            lon = (longitude + lon_offset + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+
+    return sorted(cells)
+
+
+def bounding_box(latitude: float, longitude: float,
+                 radius_km: float) -> Tuple[float, float, float, float]:
+    """(min_lat, min_lon, max_lat, max_lon) around a circle, latitudes clamped
+    to the map, longitudes past ±180 where it crosses the antimeridian"""
+
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_km_per_degree = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    lon_delta = min(radius_km / lon_km_per_degree if lon_km_per_degree > 1e-9 else 180.0, 180.0)
+    return (max(latitude - lat_delta, -90.0), longitude - lon_delta,
+            min(latitude + lat_delta, 90.0), longitude + lon_delta)
+
+
+def longitude_ranges(min_lon: float, max_lon: float) -> List[Tuple[float, float]]:
+    """Longitude span of a box as ranges on the map, two of them
+    when the span runs past ±180"""
+
+    if max_lon - min_lon >= 360.0:
+        return [(-180.0, 180.0)]
+    if min_lon < -180.0:
+        return [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+    return [(min_lon, max_lon)]
+
+
+def box_span_km(min_lat: float, min_lon: float,
+                max_lat: float, max_lon: float) -> float:
+    """Longer side of a bounding box, its width taken where it is widest"""
+
+    widest_lat = 0.0 if min_lat <= 0.0 <= max_lat else min(abs(min_lat), abs(max_lat))
+    return max((max_lat - min_lat) * KM_PER_DEGREE,
+               (max_lon - min_lon) * KM_PER_DEGREE * math.cos(math.radians(widest_lat)))
+
+
+def enclosing_radius_km(min_lat: float, min_lon: float,
+                        max_lat: float, max_lon: float) -> float:
+    """Radius of the circle around a bounding box center that holds the whole box"""
+
+    latitude, longitude = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    return max(haversine_km(latitude, longitude, corner_lat, corner_lon)
+               for corner_lat in (min_lat, max_lat) for corner_lon in (min_lon, max_lon))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points"""
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
@@ -0,0 +1,41 @@
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+Target = TypeVar("Target")
+
+
+class Lazy(Generic[Target]):
+    """Stands in for the object `factory` returns, built on first use.
+    Attribute reads, writes (and so mock.patch) and len() go to that object"""
+
+    def __init__(self, factory: Callable[[], Target]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_target", None)
+
+    def _resolve(self) -> Target:
+        if self._target is None:
+            object.__setattr__(self, "_target", self._factory())
+        return self._target
+
+    def _is_resolved(self) -> bool:
+        return self._target is not None
+
+    def _replace(self, target: Optional[Target]):
+        """Use `target` from now on, None builds a new one on next use"""
+        object.__setattr__(self, "_target", target)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._resolve(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._resolve(), name, value)
+
+    def __delattr__(self, name: str):
+        delattr(self._resolve(), name)
+
+    def __len__(self) -> int:
+        return len(self._resolve())
+
+    def __repr__(self) -> str:
+        if self._target is None:
+            return f"<Lazy {getattr(self._factory, '__name__', self._factory)}>"
+        return repr(self._target)
@@ -0,0 +1,38 @@
+import logging
+
+from api.db import dispose_pools, warm_up_pools
+from api.settings import settings
+from api.utils import PasswordHasher
+
+logger = logging.getLogger(__name__)
+
+_draining = False
+_shared_draining = None  # an Event of the supervisor when running as one of its workers
+
+
+def is_draining() -> bool:
+    """Shutdown was asked for, requests are still served but /health fails"""
+    return _draining or (_shared_draining is not None and _shared_draining.is_set())
+
+
+def start_draining():
+    global _draining
+    _draining = True
+    if _shared_draining is not None:
+        _shared_draining.set()
+
+
+def share_draining(event):
+    """Drain along with the other workers, `event` is set by whichever drains first"""
+    global _shared_draining
+    _shared_draining = event
+
+
+async def startup():
+    if settings.db_pool_warm_up:
+        await warm_up_pools(settings.db_pool_warm_up)
+
+
+async def shutdown():
+    await dispose_pools()
+    PasswordHasher.shutdown()
@@ -0,0 +1,199 @@
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from api.querylog import check_query_budget, log_slow_statement
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REGISTRY: List["Metric"] = []
+
+# DB time, statement count and ASGI scope of the request being served,
+# the engine hooks add to them
+request_timings: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_timings", default=None)
+
+
+def escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """A metric family in the Prometheus text format"""
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 registry: Optional[List["Metric"]] = None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], Any] = {}
+        (REGISTRY if registry is None else registry).append(self)
+
+    def key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.values.items():
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    """Values are read by `collect` at scrape time, as {label values: value}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 collect: Callable[[], Dict[Tuple[Any, ...], float]] = dict,
+                 registry: Optional[List[Metric]] = None):
+        super().__init__(name, help, labels, registry)
+        self.collect = collect
+
+    def samples(self) -> Iterator[str]:
+        for key, value in self.collect().items():
+            yield f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS,
+                 registry: Optional[List[Metric]] = None):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        series = self.values.get(key)
+        if series is None:
+            # per bucket counts, cumulated at scrape time, then sum and count
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        names = self.labels + ("le",)
+        for key, (counts, total, count) in self.values.items():
+            cumulated = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulated += bucket_count
+                labels = format_labels(names, key + (format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulated}"
+            yield f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.labels, key)} {count}"
+
+
+def render(registry: Optional[List[Metric]] = None) -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "\n".join(line for metric in (REGISTRY if registry is None else registry)
+                     for line in metric.render()) + "\n"
+
+
+http_request_duration = Histogram(
+    "spotapp_http_request_duration_seconds", "Request latency by route template",
+    ("method", "route", "status"))
+http_request_db_duration = Histogram(
+    "spotapp_http_request_db_seconds", "Time a request spent in database statements",
+    ("method", "route"))
+http_request_queries = Histogram(
+    "spotapp_http_request_queries", "Database statements a request ran or tried",
+    ("method", "route"), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+db_query_duration = Histogram(
+    "spotapp_db_query_duration_seconds", "Database statement execution time", ("pool",))
+db_query_errors = Counter(
+    "spotapp_db_query_errors_total", "Database errors, failed statements and connects", ("pool",))
+db_pool_wait = Histogram(
+    "spotapp_db_pool_checkout_wait_seconds",
+    "Time to get a connection from the pool, pre-ping and new connections included", ("pool",))
+password_hasher_wait = Histogram(
+    "spotapp_password_hasher_wait_seconds", "Time bcrypt work waited for a hasher slot",
+    ("operation",))
+password_hasher_duration = Histogram(
+    "spotapp_password_hasher_duration_seconds", "bcrypt hash and verify time in the hasher pool",
+    ("operation",))
+jwt_decode_duration = Histogram(
+    "spotapp_jwt_decode_seconds", "Time to decode and verify an uncached JWT")
+response_render_duration = Histogram(
+    "spotapp_response_render_seconds", "Time to encode a JSON response body")
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool recording how long each checkout waits, labelled by pool_logging_name"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started, pool=self.logging_name or "primary")
+
+
+def instrument_engine(engine: AsyncEngine, name: str):
+    """Count and time every statement the engine runs, per pool and per request,
+    log the slow ones and hold requests to the query budget"""
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_started", []).append(time.perf_counter())
+        timings = request_timings.get()
+        if timings is not None:
+            timings["queries"] += 1
+            check_query_budget(statement, timings)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["statement_started"].pop()
+        db_query_duration.observe(elapsed, pool=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings["db"] += elapsed
+        log_slow_statement(name, statement, parameters, executemany, elapsed, timings)
+
+    def handle_error(context):
+        started = context.connection.info.get("statement_started") if context.connection else None
+        if started:
+            started.pop()
+        db_query_errors.inc(pool=name)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", handle_error)
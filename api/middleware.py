@@ -1,5 +1,18 @@
+import time
+import zlib
+from typing import List, Optional
+
 from fastapi import HTTPException, Request
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.constants import NDJSON_MEDIA_TYPE, PRIMARY_STICKY_COOKIE
+from api.metrics import (http_request_db_duration, http_request_duration, http_request_queries,
+                         request_timings)
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+COMPRESSIBLE_TYPES = ("application/json", NDJSON_MEDIA_TYPE, "text/")
 
 
 async def http_exception_handler(request: Request, exception: HTTPException):
@@ -10,3 +23,204 @@ async def http_exception_handler(request: Request, exception: HTTPException):
             "code": exception.status_code,
         },
     )
+
+
+class ReadYourWritesMiddleware:
+    """After a successful write the client reads from the primary for a while,
+    so replica lag can't hide its own changes. Requests whose session wrote
+    nothing, a login for one, leave the client on the replicas"""
+
+    def __init__(self, app: ASGIApp, window: int):
+        self.app = app
+        self.window = window
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message):
+            # request.state, flagged by the session as it writes
+            wrote = scope.get("state", {}).get("wrote", False)
+            if message["type"] == "http.response.start" and message["status"] < 400 and wrote:
+                expires = int(time.time()) + self.window
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{PRIMARY_STICKY_COOKIE}={expires}; Max-Age={self.window}; "
+                    f"Path=/; HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+class MetricsMiddleware:
+    """Latency, DB time and statement count of every request, labelled by
+    the route template so /spots/{spot_id} is one series for all ids.
+    The query budget and the slow-query log rely on it too"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        timings = {"db": 0.0, "queries": 0, "scope": scope}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_timings.reset(token)
+            route = scope.get("route")
+            labels = {"method": scope["method"],
+                      "route": route.path if route is not None else "unmatched"}
+            http_request_duration.observe(elapsed, status=status, **labels)
+            http_request_db_duration.observe(timings["db"], **labels)
+            http_request_queries.observe(timings["queries"], **labels)
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self.compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, level: int):
+        import brotli  # optional dependency
+
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+    def finish(self) -> bytes:
+        return self.compressor.finish()
+
+
+def brotli_available() -> bool:
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def accepted_encodings(header: str) -> dict:
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+class CompressionMiddleware:
+    """Compress bodies of at least minimum_size bytes with the encoding the client
+    prefers, ties go to the order of `encodings`. Streamed bodies are compressed
+    chunk by chunk and flushed, so NDJSON rows still reach the client as they come"""
+
+    compressors = {"br": BrotliCompressor, "gzip": GzipCompressor}
+
+    def __init__(self, app: ASGIApp, encodings: List[str], minimum_size: int,
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.encodings = [encoding for encoding in encodings if encoding in self.compressors
+                          and (encoding != "br" or brotli_available())]
+        self.minimum_size = max(minimum_size, 1)
+        self.levels = {"br": brotli_quality, "gzip": gzip_level}
+
+    def negotiate(self, header: str) -> Optional[str]:
+        accepted = accepted_encodings(header)
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def compressible(self, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if "content-encoding" in headers:
+            return False
+        if not headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+            return False
+        return more_body or len(body) >= self.minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor = None
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # held back until the first body chunk tells whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            pending, start = start, None
+            if pending is not None:
+                headers = MutableHeaders(scope=pending)
+                if self.compressible(headers, body, more_body):
+                    compressor = self.compressors[encoding](self.levels[encoding])
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                    del headers["Content-Length"]
+
+            if compressor is not None:
+                body = compressor.compress(body) + (compressor.flush() if more_body else compressor.finish())
+                message = {**message, "body": body}
+                if pending is not None and not more_body:
+                    MutableHeaders(scope=pending)["Content-Length"] = str(len(body))
+
+            if pending is not None:
+                await send(pending)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
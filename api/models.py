@@ -1,8 +1,10 @@
 import asyncio
 from datetime import datetime
 
-from sqlalchemy import ARRAY, Boolean, Column, DateTime, ForeignKey, Integer, String, Float, Text
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import (ARRAY, Boolean, CheckConstraint, Column, Computed, DateTime, ForeignKey,
+                        Index, Integer, SmallInteger, String, Float, Text, func)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import declarative_base, deferred, relationship
 
 
 Base = declarative_base()
@@ -18,15 +20,18 @@ class UserDBModel(Base):
     user_pic = Column(String, nullable=True, )
     email = Column(String, unique=True, nullable=False, )
     password = Column(String, nullable=False)
-    friends = Column(ARRAY(String), nullable=True, )
+    # friends live in friendships, favourite spots in favourite_spots,
+    # added spots are the spots the user owns
     spot_photos = Column(ARRAY(String), nullable=True, )
-    added_spots = Column(ARRAY(String), nullable=True, )
-    favourite_spots = Column(ARRAY(String), nullable=True, )
     premium_account_type = Column(Boolean, default=False)
 
-    spots = relationship("SpotDBModel")
+    # the database clears spots.owner_id when its user goes
+    spots = relationship("SpotDBModel", passive_deletes=True)
     # comments = relationship("Comment", back_populates="users")
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # bumped by every UPDATE, ETag and If-Match compare it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class SpotDBModel(Base):
@@ -45,14 +50,45 @@ class SpotDBModel(Base):
 
     spot_full_address = Column(Text)
 
+    spot_latitude = Column(Float)
+    spot_longitude = Column(Float)
+    # byte-wise collation keeps geohash prefix ranges on the btree index
+    spot_geohash = Column(String(12, collation="C"))
+
     spot_description = Column(Text)
+    spot_search = deferred(Column(TSVECTOR, Computed(
+        "to_tsvector('simple', coalesce(spot_name, '') || ' ' || coalesce(spot_description, ''))",
+        persisted=True)))
+    # average of ratings.score, kept in step with count and sum on every rating write
     spot_raiting = Column(Float)
+    spot_rating_count = Column(Integer, nullable=False, default=0, server_default="0")
+    spot_rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
     comment = Column(ARRAY(String))
-    owner_id = Column(Integer, ForeignKey("users.user_id"))
+    owner_id = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"))
 
     # owner = relationship("Users", back_populates="spots")
-    # comments = relationship("Comment", back_populates="comments")
+    # loaded explicitly with selectinload, never lazily on an async session
+    comments = relationship("CommentDBModel", back_populates="spot", lazy="raise",
+                            order_by="CommentDBModel.comment_id", passive_deletes=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # bumped by every UPDATE, ETag and If-Match compare it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # address filters match case-insensitively, every SpotFilterSchema
+    # combination has an index prefix, spot_id last serves keyset paging
+    __table_args__ = (
+        Index("ix_spots_owner_id", owner_id, spot_id),
+        Index("ix_spots_country_city_street",
+              func.lower(spot_country), func.lower(spot_city), func.lower(spot_street), spot_id),
+        Index("ix_spots_city_street", func.lower(spot_city), func.lower(spot_street), spot_id),
+        Index("ix_spots_street", func.lower(spot_street), spot_id),
+        Index("ix_spots_geohash", spot_geohash),
+        Index("ix_spots_latitude_longitude", spot_latitude, spot_longitude),
+        Index("ix_spots_search", spot_search, postgresql_using="gin"),
+        Index("ix_spots_city_rating",
+              func.lower(spot_city), spot_raiting.desc().nullslast(), spot_id),
+    )
 
 
 class CommentDBModel(Base):
@@ -60,11 +96,62 @@ class CommentDBModel(Base):
 
     comment_id = Column(Integer, primary_key=True, index=True)
     body = Column(Text)
+    body_search = deferred(Column(TSVECTOR, Computed(
+        "to_tsvector('simple', coalesce(body, ''))", persisted=True)))
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    owner_id = Column(Integer, ForeignKey("users.user_id"))
+    # bumped by every UPDATE, ETag and If-Match compare it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    owner_id = Column(Integer, ForeignKey("users.user_id", ondelete="SET NULL"))
+    spot_id = Column(Integer, ForeignKey("spots.spot_id", ondelete="CASCADE"))
 
     # owner = relationship("User", back_populates="spots")
-    # spots = relationship("Spot", back_populates="comments")
+    spot = relationship("SpotDBModel", back_populates="comments", lazy="raise")
+
+    __table_args__ = (
+        Index("ix_comments_spot_id", spot_id, comment_id),
+        Index("ix_comments_body_search", body_search, postgresql_using="gin"),
+    )
+
+
+class RatingDBModel(Base):
+    __tablename__ = "ratings"
+
+    spot_id = Column(Integer, ForeignKey("spots.spot_id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    score = Column(SmallInteger, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint("score BETWEEN 1 AND 5", name="ck_ratings_score"),
+    )
+
+
+class FriendshipDBModel(Base):
+    """Friendship stored once per direction, the primary key serves
+    both the friends list and the mutual friends merge"""
+    __tablename__ = "friendships"
+
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    friend_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        CheckConstraint("user_id <> friend_id", name="ck_friendships_not_self"),
+    )
+
+
+class FavouriteSpotDBModel(Base):
+    __tablename__ = "favourite_spots"
+
+    user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    spot_id = Column(Integer, ForeignKey("spots.spot_id", ondelete="CASCADE"), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_favourite_spots_spot_id", spot_id, user_id),
+    )
 
 
 async def async_create_tables():  # pragma: no cover
@@ -0,0 +1,69 @@
+import base64
+import binascii
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from api.settings import settings
+
+
+class InvalidCursorError(ValueError):
+    """Pagination cursor can't be decoded"""
+
+
+def encode_position(position: Dict[str, Any]) -> str:
+    """Build an opaque cursor pointing right after the given keys"""
+
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_position(cursor: str) -> Dict[str, Any]:
+    """Keys the next page starts after"""
+
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorError(f"Malformed cursor: {cursor!r}")
+    if not isinstance(position, dict):
+        raise InvalidCursorError(f"Malformed cursor: {cursor!r}")
+    return position
+
+
+def cursor_key(position: Dict[str, Any], key: str, cursor: str) -> int:
+    value = position.get(key)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise InvalidCursorError(f"Malformed cursor: {cursor!r}")
+    return value
+
+
+def encode_cursor(key: str, value: int) -> str:
+    """Build an opaque cursor pointing right after the given primary key"""
+
+    return encode_position({key: value})
+
+
+def decode_cursor(key: str, cursor: Optional[str]) -> Optional[int]:
+    """Extract the primary key the next page starts after"""
+
+    if not cursor:
+        return None
+    return cursor_key(decode_position(cursor), key, cursor)
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Apply the default page size and the server-side cap"""
+
+    if not limit or limit < 1:
+        return settings.page_size_default
+    return min(limit, settings.page_size_max)
+
+
+def paginate(rows: Sequence[Any], key: str,
+             limit: int) -> Tuple[List[Any], Optional[str]]:
+    """Split `limit + 1` fetched rows into a page and the next cursor"""
+
+    items = list(rows[:limit])
+    if len(rows) > limit:
+        return items, encode_cursor(key, getattr(items[-1], key))
+    return items, None
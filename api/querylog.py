@@ -0,0 +1,77 @@
+import logging
+import re
+from typing import Any, Dict, Optional
+
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+BIND_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|%s")
+PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    """A request ran more statements than db_query_budget allows"""
+
+
+def normalize_sql(statement: str) -> str:
+    """Statement with literals and parameters as `?` and IN lists folded,
+    so the same query logs the same way whatever its values"""
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = BIND_PARAMETER.sub("?", statement)
+    statement = NUMBER_LITERAL.sub("?", statement)
+    statement = PARAMETER_LIST.sub("(...)", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+def value_types(parameters: Any) -> str:
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}"
+                               for key, value in sorted(parameters.items())) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+
+
+def parameters_shape(parameters: Any, executemany: bool) -> str:
+    """Types of the parameters, never their values"""
+    if not parameters:
+        return "()"
+    if executemany:
+        return f"{value_types(parameters[0])} x {len(parameters)}"
+    return value_types(parameters)
+
+
+def route_of(timings: Optional[Dict[str, Any]]) -> str:
+    """Route template of the request being served"""
+    if timings is None:
+        return "no request"
+    route = timings["scope"].get("route")
+    return route.path if route is not None else "unmatched"
+
+
+def log_slow_statement(pool: str, statement: str, parameters: Any, executemany: bool,
+                       elapsed: float, timings: Optional[Dict[str, Any]]):
+    if not settings.db_slow_query_ms or elapsed * 1000 < settings.db_slow_query_ms:
+        return
+    logger.warning(f"Slow statement {elapsed * 1000:.1f} ms on {pool} "
+                   f"from {route_of(timings)}: {normalize_sql(statement)} "
+                   f"params={parameters_shape(parameters, executemany)}")
+
+
+def check_query_budget(statement: str, timings: Dict[str, Any]):
+    """Called before every statement of a request, warns once when the
+    request goes over budget or raises, as the tests run it"""
+    budget = settings.db_query_budget
+    if not budget or timings["queries"] <= budget:
+        return
+
+    raising = settings.db_query_budget_mode == "raise"
+    if not raising and timings["queries"] > budget + 1:
+        return
+    message = (f"{route_of(timings)} ran {timings['queries']} statements, "
+               f"over the budget of {budget}: {normalize_sql(statement)}")
+    if raising:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
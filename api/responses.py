@@ -0,0 +1,57 @@
+import functools
+import json
+from datetime import date, datetime
+from typing import Any, Callable
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from api.metrics import response_render_duration
+from api.settings import settings
+
+
+def to_builtin(value: Any) -> Any:
+    """Values the encoders can't serialize on their own"""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def json_encoder() -> Callable[[Any], bytes]:
+    def encode(content: Any) -> bytes:
+        return json.dumps(content, default=to_builtin, ensure_ascii=False,
+                          allow_nan=False, separators=(",", ":")).encode("utf-8")
+    return encode
+
+
+def orjson_encoder() -> Callable[[Any], bytes]:
+    import orjson
+
+    def encode(content: Any) -> bytes:
+        return orjson.dumps(content, default=to_builtin)
+    return encode
+
+
+ENCODERS = {
+    "json": json_encoder,
+    "orjson": orjson_encoder,
+}
+
+
+@functools.lru_cache()
+def encoder(name: str) -> Callable[[Any], bytes]:
+    """Encoder by name, orjson is only imported when used"""
+    return ENCODERS[name]()
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class, bodies are dumped by settings.response_encoder.
+    Returned from a route with a response_model, FastAPI still validates and
+    runs jsonable_encoder first, only handlers that return it directly, as the
+    list routes do, skip both"""
+
+    def render(self, content: Any) -> bytes:
+        with response_render_duration.time():
+            return encoder(settings.response_encoder)(content)
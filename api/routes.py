@@ -1,17 +1,28 @@
+import asyncio
 import logging
-from typing import List, Union
+from typing import Any, AsyncIterator, Callable, Dict, List, Type, Union
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import NoResultFound
 
 from api import schema
 from api.authentication import get_current_user
-from api.crud import CRUDSpot, CRUDUser, CRUDComment
-from api.db import get_session
+from api.bulk import bulk_result, validate_items
+from api.conditional import PreconditionFailed, etag, if_match_versions, not_modified
+from api.constants import NDJSON_MEDIA_TYPE
+from api.crud import (CRUDSpot, CRUDUser, CRUDComment, CRUDRating, CRUDFriend, CRUDFavourite,
+                      CRUDFeed)
+from api.db import SessionFactory, get_read_session, get_session, reads_own_writes, replica_router
+from api.geo import box_span_km
 from api.models import SpotDBModel, UserDBModel, CommentDBModel
-from api.utils import PasswordHasher
+from api.pagination import InvalidCursorError, clamp_limit
+from api.responses import FastJSONResponse
+from api.settings import settings
+from api.utils import PasswordHasher, ndjson_lines
 
 
 spotapp_user_router = APIRouter(prefix="/users", tags=["Users"])
@@ -20,24 +31,79 @@ spotapp_comment_router = APIRouter(prefix="/comments", tags=["Comments"])
 logger = logging.getLogger(__name__)
 
 
+def wants_ndjson(request: Request) -> bool:
+    """Client asked for the streaming export"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def check_bulk_size(items: List[Any]):
+    if len(items) > settings.bulk_max_items:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.bulk_max_items} items per request",
+        )
+
+
+class UnknownTokenUser(Exception):
+    """The user a token was issued to is gone"""
+
+
+class ActingForAnotherUser(Exception):
+    """The authorized user acts on someone else's friends, favourites or feed"""
+
+
+async def current_user_id(db: AsyncSession, current_user: schema.TokenData) -> int:
+    """Id of the authorized user, tokens issued without `uid` are resolved by email"""
+    if current_user.user_id is not None:
+        return current_user.user_id
+    try:
+        user = await CRUDUser.login(db=db, username=current_user.email)
+    except NoResultFound:
+        raise UnknownTokenUser(current_user.email)
+    return user.user_id
+
+
+async def check_acting_user(db: AsyncSession, current_user: schema.TokenData, user_id: int):
+    """Users change only their own friends and favourites, and read only their own feed"""
+    if await current_user_id(db, current_user) != user_id:
+        raise ActingForAnotherUser(user_id)
+
+
+async def export_ndjson(stream: Callable[..., AsyncIterator[Any]],
+                        row_schema: Type[BaseModel],
+                        primary: bool = False,
+                        **kwargs) -> AsyncIterator[str]:
+    """Run the export in its own session on a replica, it outlives the request handler.
+    Not on the autocommit read bind: a server-side cursor needs a transaction"""
+
+    async with SessionFactory(bind=replica_router().choose(primary=primary)) as session:
+        async with session.begin():
+            async for line in ndjson_lines(stream(db=session, **kwargs), row_schema):
+                yield line
+
+
 @spotapp_user_router.get(
     path="/{user_id}",
     response_model=schema.UserOpenSchema,
     responses={
         200: {"description": "User requested by user_id"},
+        304: {"description": "Unchanged since the ETag or date the client holds"},
         404: {"model": schema.Error, "description": "Requested user was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
     },
 )
 async def get_user(user_id: int,
-                   db: AsyncSession = Depends(get_session),
+                   request: Request,
+                   response: Response,
+                   db: AsyncSession = Depends(get_read_session),
                    ) -> schema.UserOpenSchema:
-    """Getting user by the user id"""
+    """Getting user by the user id, 304 if the client copy is current"""
 
     try:
         schema.InputDataValidator(user_id=user_id)
+        user = await CRUDUser.get_user_by_id(db=db, user_id=user_id)
 
-        return await CRUDUser.get_user_by_id(db=db, user_id=user_id)
+        return not_modified(request, response, "user", user_id, user) or user
 
     except ValidationError as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
@@ -53,17 +119,35 @@ async def get_user(user_id: int,
 
 @spotapp_user_router.get(
     path="/all/",
-    response_model=List[schema.UserOpenSchema],
+    response_model=schema.UserPageSchema,
     responses={
-        200: {"description": "getting all users"},
+        200: {
+            "description": "getting a page of users, or all of them as NDJSON",
+            "content": {NDJSON_MEDIA_TYPE: {}},
+        },
+        406: {"model": schema.Error, "description": "Input data format error"},
     },
 )
-async def get_all_users(db: AsyncSession = Depends(get_session),
-                        ) -> List[schema.UserOpenSchema]:
-    """Getting all users"""
+async def get_all_users(request: Request,
+                        cursor: Union[str, None] = None,
+                        limit: Union[int, None] = None,
+                        db: AsyncSession = Depends(get_read_session),
+                        ) -> schema.UserPageSchema:
+    """Getting users page by page, pass `next_cursor` back to get the next one.
+    With `Accept: application/x-ndjson` all users are streamed row by row"""
     try:
-        return await CRUDUser.get_all_users(db=db)
+        if wants_ndjson(request):
+            return StreamingResponse(
+                export_ndjson(CRUDUser.stream_users, schema.UserOpenSchema,
+                              primary=reads_own_writes(db)),
+                media_type=NDJSON_MEDIA_TYPE,
+            )
+
+        return FastJSONResponse(await CRUDUser.get_all_users(db=db, cursor=cursor,
+                                                             limit=clamp_limit(limit)))
 
+    except InvalidCursorError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
@@ -80,7 +164,7 @@ async def create_user(payload: schema.UserCreationSchema,
     """Creating a new user"""
 
     try:
-        hashed_password = PasswordHasher().hash_password(payload.password)
+        hashed_password = await PasswordHasher().hash_password_async(payload.password)
         payload.password = hashed_password
         new_user = UserDBModel(**payload.dict())
 
@@ -91,6 +175,89 @@ async def create_user(payload: schema.UserCreationSchema,
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
 
 
+@spotapp_user_router.post(
+    path="/bulk/create/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def create_users(payload: List[Dict[str, Any]] = Body(...),
+                       db: AsyncSession = Depends(get_session),
+                       ) -> schema.BulkResultSchema:
+    """Creating many users in one request"""
+
+    check_bulk_size(payload)
+    try:
+        valid, failed = validate_items(payload, schema.UserCreationSchema)
+        hasher = PasswordHasher()
+        hashed_passwords = await asyncio.gather(
+            *[hasher.hash_password_async(user.password) for _, user in valid])
+        users = [(index, {**user.dict(), "password": hashed_password})
+                 for (index, user), hashed_password in zip(valid, hashed_passwords)]
+
+        return bulk_result(failed + await CRUDUser.add_users(db=db, users=users))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.put(
+    path="/bulk/update/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def update_users(payload: List[Dict[str, Any]] = Body(...),
+                       db: AsyncSession = Depends(get_session),
+                       current_user: UserDBModel = Depends(get_current_user),
+                       ) -> schema.BulkResultSchema:
+    """Updating many users in one request, every item names its user_id"""
+
+    check_bulk_size(payload)
+    try:
+        valid, failed = validate_items(payload, schema.UserBulkUpdateSchema)
+        hasher = PasswordHasher()
+        new_passwords = [user for _, user in valid if user.password]
+        hashed_passwords = await asyncio.gather(
+            *[hasher.hash_password_async(user.password) for user in new_passwords])
+        for user, hashed_password in zip(new_passwords, hashed_passwords):
+            user.password = hashed_password
+
+        return bulk_result(failed + await CRUDUser.update_users(db=db, updates=valid))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.delete(
+    path="/bulk/destroy/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def destroy_users(user_ids: List[int] = Body(...),
+                        db: AsyncSession = Depends(get_session),
+                        current_user: UserDBModel = Depends(get_current_user),
+                        ) -> schema.BulkResultSchema:
+    """Deleting many users in one request"""
+
+    check_bulk_size(user_ids)
+    try:
+        return bulk_result(await CRUDUser.delete_users(db=db, user_ids=user_ids))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
 @spotapp_user_router.put(
     path="/{user_id}",
     status_code=status.HTTP_202_ACCEPTED,
@@ -98,19 +265,25 @@ async def create_user(payload: schema.UserCreationSchema,
         202: {"description": "User have been updated"},
         404: {"model": schema.Error, "description": "Requested user was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
+        412: {"model": schema.Error, "description": "If-Match names an outdated version"},
     },
 )
 async def update_user(user_id: int,
                       payload: schema.UserSchema,
+                      request: Request,
+                      response: Response,
                       db: AsyncSession = Depends(get_session),
                       ) -> str:
-    """Updating user by the user id"""
+    """Updating user by the user id, with `If-Match` only from that version"""
 
     try:
         schema.InputDataValidator(user_id=user_id)
         data_to_update = payload.dict()
 
-        return await CRUDUser.update(db=db, user_id=user_id, data=data_to_update)
+        version = await CRUDUser.update(db=db, user_id=user_id, data=data_to_update,
+                                        versions=if_match_versions(request, "user", user_id))
+        response.headers["ETag"] = etag("user", user_id, version)
+        return f"User with {user_id=} is updated!"
 
     except ValidationError as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
@@ -119,6 +292,11 @@ async def update_user(user_id: int,
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Specified {user_id=} was not found",
         )
+    except PreconditionFailed:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail=f"Specified {user_id=} was changed meanwhile",
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
@@ -155,6 +333,316 @@ async def destroy_user(user_id: int,
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
 
 
+@spotapp_user_router.get(
+    path="/{user_id}/friends",
+    response_model=schema.UserBriefPageSchema,
+    responses={
+        200: {"description": "A page of the user's friends"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_friends(user_id: int,
+                      cursor: Union[str, None] = None,
+                      limit: Union[int, None] = None,
+                      db: AsyncSession = Depends(get_read_session),
+                      current_user: schema.TokenData = Depends(get_current_user),
+                      ) -> schema.UserBriefPageSchema:
+    """Getting user friends page by page"""
+
+    try:
+        schema.InputDataValidator(user_id=user_id)
+
+        return await CRUDFriend.get_friends(db=db, user_id=user_id,
+                                            cursor=cursor, limit=clamp_limit(limit))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.get(
+    path="/{user_id}/friends/mutual/{other_id}",
+    response_model=schema.UserBriefPageSchema,
+    responses={
+        200: {"description": "A page of friends both users have"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_mutual_friends(user_id: int,
+                             other_id: int,
+                             cursor: Union[str, None] = None,
+                             limit: Union[int, None] = None,
+                             db: AsyncSession = Depends(get_read_session),
+                             current_user: schema.TokenData = Depends(get_current_user),
+                             ) -> schema.UserBriefPageSchema:
+    """Getting mutual friends of two users page by page"""
+
+    try:
+        schema.InputDataValidator(user_id=user_id)
+        schema.InputDataValidator(user_id=other_id)
+
+        return await CRUDFriend.get_mutual_friends(db=db, user_id=user_id, other_id=other_id,
+                                                   cursor=cursor, limit=clamp_limit(limit))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.get(
+    path="/{user_id}/friends/spots",
+    response_model=schema.SpotWithIdPageSchema,
+    responses={
+        200: {"description": "A page of spots added by the user's friends, newest first"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_friends_spots(user_id: int,
+                            cursor: Union[str, None] = None,
+                            limit: Union[int, None] = None,
+                            db: AsyncSession = Depends(get_read_session),
+                            current_user: schema.TokenData = Depends(get_current_user),
+                            ) -> schema.SpotWithIdPageSchema:
+    """Getting spots added by friends page by page"""
+
+    try:
+        schema.InputDataValidator(user_id=user_id)
+
+        return FastJSONResponse(await CRUDFriend.get_friends_spots(
+            db=db, user_id=user_id, cursor=cursor, limit=clamp_limit(limit)))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.get(
+    path="/{user_id}/feed",
+    response_model=schema.FeedPageSchema,
+    responses={
+        200: {"description": "A page of recent spots and comments of friends, newest first"},
+        403: {"model": schema.Error, "description": "Reading another user's feed"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_feed(user_id: int,
+                   cursor: Union[str, None] = None,
+                   limit: Union[int, None] = None,
+                   db: AsyncSession = Depends(get_read_session),
+                   current_user: schema.TokenData = Depends(get_current_user),
+                   ) -> schema.FeedPageSchema:
+    """Getting user home feed page by page"""
+
+    try:
+        await check_acting_user(db, current_user, user_id)
+        return await CRUDFeed.get_feed(db=db, user_id=user_id,
+                                       cursor=cursor, limit=clamp_limit(limit))
+
+    except InvalidCursorError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except ActingForAnotherUser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to act for {user_id=}",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.put(
+    path="/{user_id}/friends/{friend_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {"description": "Users are friends"},
+        403: {"model": schema.Error, "description": "Acting for another user"},
+        404: {"model": schema.Error, "description": "Requested user was not found"},
+        406: {"model": schema.Error, "description": "Users can't befriend themselves"},
+    },
+)
+async def add_friend(user_id: int,
+                     friend_id: int,
+                     db: AsyncSession = Depends(get_session),
+                     current_user: schema.TokenData = Depends(get_current_user),
+                     ) -> str:
+    """Befriending a user"""
+
+    try:
+        await check_acting_user(db, current_user, user_id)
+        schema.FriendshipValidator(user_id=user_id, friend_id=friend_id)
+
+        return await CRUDFriend.add_friend(db=db, user_id=user_id, friend_id=friend_id)
+
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except NoResultFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Specified {friend_id=} was not found",
+        )
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except ActingForAnotherUser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to act for {user_id=}",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.delete(
+    path="/{user_id}/friends/{friend_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        204: {"description": "Users are not friends anymore"},
+        403: {"model": schema.Error, "description": "Acting for another user"},
+    },
+)
+async def remove_friend(user_id: int,
+                        friend_id: int,
+                        db: AsyncSession = Depends(get_session),
+                        current_user: schema.TokenData = Depends(get_current_user),
+                        ) -> Response:
+    """Unfriending a user"""
+
+    try:
+        await check_acting_user(db, current_user, user_id)
+        return await CRUDFriend.remove_friend(db=db, user_id=user_id, friend_id=friend_id)
+
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except ActingForAnotherUser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to act for {user_id=}",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.get(
+    path="/{user_id}/favourites",
+    response_model=schema.SpotWithIdPageSchema,
+    responses={
+        200: {"description": "A page of the user's favourite spots"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_favourite_spots(user_id: int,
+                              cursor: Union[str, None] = None,
+                              limit: Union[int, None] = None,
+                              db: AsyncSession = Depends(get_read_session),
+                              current_user: schema.TokenData = Depends(get_current_user),
+                              ) -> schema.SpotWithIdPageSchema:
+    """Getting user favourite spots page by page"""
+
+    try:
+        schema.InputDataValidator(user_id=user_id)
+
+        return FastJSONResponse(await CRUDFavourite.get_favourite_spots(
+            db=db, user_id=user_id, cursor=cursor, limit=clamp_limit(limit)))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.put(
+    path="/{user_id}/favourites/{spot_id}",
+    status_code=status.HTTP_202_ACCEPTED,
+    responses={
+        202: {"description": "Spot is a favourite"},
+        403: {"model": schema.Error, "description": "Acting for another user"},
+        404: {"model": schema.Error, "description": "Requested spot was not found"},
+    },
+)
+async def add_favourite(user_id: int,
+                        spot_id: int,
+                        db: AsyncSession = Depends(get_session),
+                        current_user: schema.TokenData = Depends(get_current_user),
+                        ) -> str:
+    """Marking a spot as favourite"""
+
+    try:
+        await check_acting_user(db, current_user, user_id)
+        return await CRUDFavourite.add_favourite(db=db, user_id=user_id, spot_id=spot_id)
+
+    except NoResultFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Specified {spot_id=} was not found",
+        )
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except ActingForAnotherUser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to act for {user_id=}",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_user_router.delete(
+    path="/{user_id}/favourites/{spot_id}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    responses={
+        204: {"description": "Spot is not a favourite anymore"},
+        403: {"model": schema.Error, "description": "Acting for another user"},
+    },
+)
+async def remove_favourite(user_id: int,
+                           spot_id: int,
+                           db: AsyncSession = Depends(get_session),
+                           current_user: schema.TokenData = Depends(get_current_user),
+                           ) -> Response:
+    """Unmarking a favourite spot"""
+
+    try:
+        await check_acting_user(db, current_user, user_id)
+        return await CRUDFavourite.remove_favourite(db=db, user_id=user_id, spot_id=spot_id)
+
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except ActingForAnotherUser:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"Not allowed to act for {user_id=}",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
 @spotapp_spot_router.post(
     path="/create/",
     response_model=schema.SpotSchema,
@@ -167,10 +655,7 @@ async def create_spot(payload: schema.SpotSchema,
     """Creating a new spot"""
 
     try:
-        new_spot = SpotDBModel(
-            **payload.dict(),
-            spot_full_address=f"{payload.spot_street}, {payload.spot_street_number}. "
-                              f"{payload.spot_country}, {payload.spot_city},")
+        new_spot = SpotDBModel(**CRUDSpot.spot_values(payload))
 
         return await CRUDSpot.add_spot(db=db, spot=new_spot)
 
@@ -179,27 +664,205 @@ async def create_spot(payload: schema.SpotSchema,
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
 
 
+@spotapp_spot_router.post(
+    path="/bulk/create/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def create_spots(payload: List[Dict[str, Any]] = Body(...),
+                       db: AsyncSession = Depends(get_session),
+                       current_user: UserDBModel = Depends(get_current_user),
+                       ) -> schema.BulkResultSchema:
+    """Creating many spots in one request"""
+
+    check_bulk_size(payload)
+    try:
+        valid, failed = validate_items(payload, schema.SpotSchema)
+
+        return bulk_result(failed + await CRUDSpot.add_spots(db=db, spots=valid))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.put(
+    path="/bulk/update/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def update_spots(payload: List[Dict[str, Any]] = Body(...),
+                       db: AsyncSession = Depends(get_session),
+                       current_user: UserDBModel = Depends(get_current_user),
+                       ) -> schema.BulkResultSchema:
+    """Updating many spots in one request, every item names its spot_id"""
+
+    check_bulk_size(payload)
+    try:
+        valid, failed = validate_items(payload, schema.SpotBulkUpdateSchema)
+
+        return bulk_result(failed + await CRUDSpot.update_spots(db=db, updates=valid))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.delete(
+    path="/bulk/destroy/",
+    response_model=schema.BulkResultSchema,
+    responses={
+        200: {"description": "Result for every item, failed items carry an error"},
+        413: {"model": schema.Error, "description": "Too many items"},
+    },
+)
+async def destroy_spots(spot_ids: List[int] = Body(...),
+                        db: AsyncSession = Depends(get_session),
+                        current_user: UserDBModel = Depends(get_current_user),
+                        ) -> schema.BulkResultSchema:
+    """Deleting many spots in one request"""
+
+    check_bulk_size(spot_ids)
+    try:
+        return bulk_result(await CRUDSpot.delete_spots(db=db, spot_ids=spot_ids))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.get(
+    path="/nearby",
+    response_model=List[schema.SpotNearbySchema],
+    responses={
+        200: {"description": "Spots nearest first"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_nearby_spots(latitude: Union[float, None] = None,
+                           longitude: Union[float, None] = None,
+                           radius_km: Union[float, None] = None,
+                           min_latitude: Union[float, None] = None,
+                           min_longitude: Union[float, None] = None,
+                           max_latitude: Union[float, None] = None,
+                           max_longitude: Union[float, None] = None,
+                           limit: Union[int, None] = None,
+                           db: AsyncSession = Depends(get_read_session),
+                           current_user: UserDBModel = Depends(get_current_user),
+                           ) -> List[schema.SpotNearbySchema]:
+    """Getting spots within a radius around a point or inside a bounding box,
+    a box at most as wide as the largest circle"""
+
+    box = (min_latitude, min_longitude, max_latitude, max_longitude)
+    max_span_km = 2 * settings.nearby_max_radius_km
+    if None not in box and box_span_km(*box) > max_span_km:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                            detail=f"Bounding box is wider than {max_span_km} km")
+    try:
+        if radius_km is not None:
+            radius_km = min(radius_km, settings.nearby_max_radius_km)
+        area = schema.NearbyQuerySchema(
+            latitude=latitude,
+            longitude=longitude,
+            radius_km=radius_km,
+            min_latitude=min_latitude,
+            min_longitude=min_longitude,
+            max_latitude=max_latitude,
+            max_longitude=max_longitude)
+
+        return await CRUDSpot.get_nearby_spots(db=db, area=area, limit=clamp_limit(limit))
+
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.get(
+    path="/search",
+    response_model=schema.SearchPageSchema,
+    responses={
+        200: {"description": "Spots and comments matching every word, best first"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def search_spots(q: str,
+                       cursor: Union[str, None] = None,
+                       limit: Union[int, None] = None,
+                       db: AsyncSession = Depends(get_read_session),
+                       current_user: UserDBModel = Depends(get_current_user),
+                       ) -> schema.SearchPageSchema:
+    """Full-text search over spot names, descriptions and comments,
+    words match as prefixes"""
+
+    try:
+        query = schema.SearchQuerySchema(q=q)
+
+        return await CRUDSpot.search(db=db, query=query, cursor=cursor,
+                                     limit=clamp_limit(limit))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.get(
+    path="/top-rated",
+    response_model=List[schema.SpotWithIdSchema],
+    responses={
+        200: {"description": "Best rated spots of the city first"},
+    },
+)
+async def get_top_rated_spots(spot_city: str,
+                              limit: Union[int, None] = None,
+                              db: AsyncSession = Depends(get_read_session),
+                              current_user: UserDBModel = Depends(get_current_user),
+                              ) -> List[schema.SpotWithIdSchema]:
+    """Getting the best rated spots in a city"""
+
+    try:
+        return FastJSONResponse(await CRUDSpot.get_top_rated_spots(
+            db=db, spot_city=spot_city, limit=clamp_limit(limit)))
+
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
 @spotapp_spot_router.get(
     path="/{spot_id}",
     response_model=schema.SpotSchema,
     responses={
         200: {"description": "Spot requested by spot_id"},
+        304: {"description": "Unchanged since the ETag or date the client holds"},
         404: {"model": schema.Error, "description": "Requested spot was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
     },
 )
 async def get_spot_by_id(spot_id: int,
-                         db: AsyncSession = Depends(get_session),
+                         request: Request,
+                         response: Response,
+                         db: AsyncSession = Depends(get_read_session),
                          current_user: UserDBModel = Depends(get_current_user),
                          ) -> schema.SpotSchema:
-    """Getting spot by the id"""
+    """Getting spot by the id, 304 if the client copy is current"""
 
     try:
         schema.InputDataValidator(spot_id=spot_id)
-
-        return await CRUDSpot.get_spot_by_id(db=db,
+        spot = await CRUDSpot.get_spot_by_id(db=db,
                                              spot_id=spot_id)
 
+        return not_modified(request, response, "spot", spot_id, spot) or spot
+
     except ValidationError as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
     except NoResultFound:
@@ -212,23 +875,174 @@ async def get_spot_by_id(spot_id: int,
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
 
 
+@spotapp_spot_router.get(
+    path="/{spot_id}/comments",
+    response_model=schema.CommentPageSchema,
+    responses={
+        200: {"description": "Comments of the spot requested by spot_id"},
+        404: {"model": schema.Error, "description": "Requested spot was not found"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_spot_comments(spot_id: int,
+                            cursor: Union[str, None] = None,
+                            limit: Union[int, None] = None,
+                            db: AsyncSession = Depends(get_read_session),
+                            current_user: UserDBModel = Depends(get_current_user),
+                            ) -> schema.CommentPageSchema:
+    """Getting spot comments page by page"""
+
+    try:
+        schema.InputSpotDataValidator(spot_id=spot_id)
+
+        return await CRUDComment.get_spot_comments(db=db, spot_id=spot_id,
+                                                   cursor=cursor,
+                                                   limit=clamp_limit(limit))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except NoResultFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Specified {spot_id=} was not found",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.put(
+    path="/{spot_id}/rating",
+    response_model=schema.SpotRatingSchema,
+    responses={
+        200: {"description": "Rating saved, the spot aggregate after it"},
+        404: {"model": schema.Error, "description": "Requested spot was not found"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def rate_spot(spot_id: int,
+                    payload: schema.RatingSchema,
+                    db: AsyncSession = Depends(get_session),
+                    current_user: schema.TokenData = Depends(get_current_user),
+                    ) -> schema.SpotRatingSchema:
+    """Rating a spot by the current user, a new score replaces the previous one"""
+
+    try:
+        schema.InputSpotDataValidator(spot_id=spot_id)
+        user_id = await current_user_id(db, current_user)
+
+        return await CRUDRating.rate(db=db, spot_id=spot_id, user_id=user_id,
+                                     score=payload.score)
+
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except NoResultFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Specified {spot_id=} was not found",
+        )
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.delete(
+    path="/{spot_id}/rating",
+    response_model=schema.SpotRatingSchema,
+    responses={
+        200: {"description": "Rating removed, the spot aggregate after it"},
+        404: {"model": schema.Error, "description": "Requested spot was not found"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def unrate_spot(spot_id: int,
+                      db: AsyncSession = Depends(get_session),
+                      current_user: schema.TokenData = Depends(get_current_user),
+                      ) -> schema.SpotRatingSchema:
+    """Removing the current user rating of a spot"""
+
+    try:
+        schema.InputSpotDataValidator(spot_id=spot_id)
+        user_id = await current_user_id(db, current_user)
+
+        return await CRUDRating.unrate(db=db, spot_id=spot_id, user_id=user_id)
+
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except NoResultFound:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Specified {spot_id=} was not found",
+        )
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
+@spotapp_spot_router.get(
+    path="/{spot_id}/favourited-by",
+    response_model=schema.UserBriefPageSchema,
+    responses={
+        200: {"description": "A page of users who favourited the spot"},
+        406: {"model": schema.Error, "description": "Input data format error"},
+    },
+)
+async def get_favourited_by(spot_id: int,
+                            cursor: Union[str, None] = None,
+                            limit: Union[int, None] = None,
+                            db: AsyncSession = Depends(get_read_session),
+                            current_user: schema.TokenData = Depends(get_current_user),
+                            ) -> schema.UserBriefPageSchema:
+    """Getting users who favourited a spot page by page"""
+
+    try:
+        schema.InputSpotDataValidator(spot_id=spot_id)
+
+        return await CRUDFavourite.get_favourited_by(db=db, spot_id=spot_id,
+                                                     cursor=cursor, limit=clamp_limit(limit))
+
+    except (ValidationError, InvalidCursorError) as exc:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
+
+
 @spotapp_spot_router.get(
     path="/filtered/",
-    response_model=List[schema.SpotSchema],
+    response_model=schema.SpotPageSchema,
     responses={
-        200: {"description": "Spot requested by spot_id"},
+        200: {
+            "description": "Filtered spots page, or all of them as NDJSON",
+            "content": {NDJSON_MEDIA_TYPE: {}},
+        },
         404: {"model": schema.Error, "description": "Requested spot was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
     },
 )
-async def get_spots(spot_country: Union[str, None] = None,
+async def get_spots(request: Request,
+                    spot_country: Union[str, None] = None,
                     spot_city: Union[str, None] = None,
                     spot_street: Union[str, None] = None,
                     owner_id: Union[int, None] = None,
-                    db: AsyncSession = Depends(get_session),
+                    cursor: Union[str, None] = None,
+                    limit: Union[int, None] = None,
+                    include_comments: bool = False,
+                    db: AsyncSession = Depends(get_read_session),
                     current_user: UserDBModel = Depends(get_current_user),
-                    ) -> List[schema.SpotSchema]:
-    """Getting filtered spots"""
+                    ) -> schema.SpotPageSchema:
+    """Getting filtered spots page by page, with their comments if asked.
+    With `Accept: application/x-ndjson` all matching spots are streamed row by row"""
 
     try:
         filter_params = schema.SpotFilterSchema(
@@ -237,14 +1051,24 @@ async def get_spots(spot_country: Union[str, None] = None,
             spot_street=spot_street,
             owner_id=owner_id)
 
-        result = await CRUDSpot.get_filtered_spots(db=db, filter=filter_params)
+        if wants_ndjson(request):
+            return StreamingResponse(
+                export_ndjson(CRUDSpot.stream_filtered_spots, schema.SpotSchema,
+                              primary=reads_own_writes(db), filter=filter_params),
+                media_type=NDJSON_MEDIA_TYPE,
+            )
+
+        result = await CRUDSpot.get_filtered_spots(db=db, filter=filter_params,
+                                                   cursor=cursor,
+                                                   limit=clamp_limit(limit),
+                                                   include_comments=include_comments)
 
-        if result:
-            return result
+        if result.items:
+            return FastJSONResponse(result)
 
         raise NoResultFound
 
-    except ValidationError as exc:
+    except (ValidationError, InvalidCursorError) as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
     except NoResultFound:
         raise HTTPException(
@@ -263,19 +1087,25 @@ async def get_spots(spot_country: Union[str, None] = None,
         202: {"description": "Spot have been updated"},
         404: {"model": schema.Error, "description": "Requested spot was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
+        412: {"model": schema.Error, "description": "If-Match names an outdated version"},
     },
 )
 async def update_spot(spot_id: int,
                       payload: schema.SpotUpdateSchema,
+                      request: Request,
+                      response: Response,
                       db: AsyncSession = Depends(get_session),
                       current_user: UserDBModel = Depends(get_current_user),
                       ) -> str:
-    """Updating spot by the spot id"""
+    """Updating spot by the spot id, with `If-Match` only from that version"""
 
     try:
         data_to_update = payload.dict()
 
-        return await CRUDSpot.update(db=db, spot_id=spot_id, data=data_to_update)
+        version = await CRUDSpot.update(db=db, spot_id=spot_id, data=data_to_update,
+                                        versions=if_match_versions(request, "spot", spot_id))
+        response.headers["ETag"] = etag("spot", spot_id, version)
+        return f"Spot with {spot_id=} is updated!"
 
     except ValidationError as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
@@ -284,6 +1114,11 @@ async def update_spot(spot_id: int,
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Specified {spot_id=} was not found",
         )
+    except PreconditionFailed:
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail=f"Specified {spot_id=} was changed meanwhile",
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
@@ -326,19 +1161,23 @@ async def destroy_spot(spot_id: int,
     response_model=schema.CommentFullSchema,
     responses={
         200: {"description": "Comment requested by comment_id"},
+        304: {"description": "Unchanged since the ETag or date the client holds"},
         404: {"model": schema.Error, "description": "Requested comment was not found"},
         406: {"model": schema.Error, "description": "Input data format error"},
     },
 )
 async def get_comment(comment_id: int,
-                      db: AsyncSession = Depends(get_session),
+                      request: Request,
+                      response: Response,
+                      db: AsyncSession = Depends(get_read_session),
                       ) -> schema.CommentFullSchema:
-    """Getting comment by the comment id"""
+    """Getting comment by the comment id, 304 if the client copy is current"""
 
     try:
         schema.InputDataValidator(comment_id=comment_id)
+        comment = await CRUDComment.get_comment_by_id(db=db, comment_id=comment_id)
 
-        return await CRUDComment.get_comment_by_id(db=db, comment_id=comment_id)
+        return not_modified(request, response, "comment", comment_id, comment) or comment
 
     except ValidationError as exc:
         raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=exc)
@@ -359,14 +1198,21 @@ async def get_comment(comment_id: int,
 )
 async def create_comment(payload: schema.CommentNewSchema,
                          db: AsyncSession = Depends(get_session),
+                         current_user: schema.TokenData = Depends(get_current_user),
                          ) -> schema.CommentFullSchema:
-    """Creating a new comment"""
+    """Creating a new comment, authored by the authorized user"""
 
     try:
-        new_comment = CommentDBModel(**payload.dict())
+        owner_id = await current_user_id(db, current_user)
+        new_comment = CommentDBModel(**payload.dict(), owner_id=owner_id)
 
         return await CRUDComment.add_comment(db=db, comment=new_comment)
 
+    except UnknownTokenUser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User of the token was not found",
+        )
     except Exception as exc:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=exc)
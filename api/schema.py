@@ -1,6 +1,7 @@
+import re
 from datetime import datetime
 from typing import List, Optional, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, root_validator, validator
 
 
 class Error(BaseModel):
@@ -20,12 +21,24 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     email: Union[str, None] = None
+    user_id: Union[int, None] = None
 
 
 class InputDataValidator(BaseModel):
     user_id: Optional[int] = Field(gt=0, le=2147483647)  # check int32 range
 
 
+class FriendshipValidator(BaseModel):
+    user_id: int
+    friend_id: int
+
+    @root_validator(skip_on_failure=True)
+    def check_friend(cls, values):
+        if values["user_id"] == values["friend_id"]:
+            raise ValueError("Users can't befriend themselves")
+        return values
+
+
 class InputSpotDataValidator(BaseModel):
     spot_id:  Union[int, None] = Field(gt=0, le=2147483647)  # check int32 range
     spot_country: Union[str, None] = None
@@ -60,15 +73,38 @@ class UserOpenSchema(BaseModel):
     first_name: str
     last_name: str
     user_pic: Union[str, None]
-    friends: Union[List[str], None] = []
     spot_photos: Union[List[str], None] = []
-    added_spots: Union[List[str], None] = []
-    favourite_spots: Union[List[str], None] = []
 
     class Config:
         orm_mode = True
 
 
+class UserVersionedSchema(UserOpenSchema):
+    version: int
+    updated_at: datetime
+
+
+class UserPageSchema(BaseModel):
+    items: List[UserOpenSchema]
+    next_cursor: Union[str, None] = None
+
+
+class UserBriefSchema(BaseModel):
+    user_id: int
+    nickname: str
+    first_name: str
+    last_name: str
+    user_pic: Union[str, None]
+
+    class Config:
+        orm_mode = True
+
+
+class UserBriefPageSchema(BaseModel):
+    items: List[UserBriefSchema]
+    next_cursor: Union[str, None] = None
+
+
 class UserSchema(BaseModel):
     nickname: Union[str, None] = None
     first_name: Union[str, None] = None
@@ -82,6 +118,10 @@ class UserSchema(BaseModel):
         orm_mode = True
 
 
+class UserBulkUpdateSchema(UserSchema):
+    user_id: int = Field(gt=0, le=2147483647)  # check int32 range
+
+
 class UserFullSchema(BaseModel):
     nickname: Union[str, None] = None
     first_name: Union[str, None] = None
@@ -90,10 +130,7 @@ class UserFullSchema(BaseModel):
     email: Union[str, None] = None
     password: Union[str, None] = None
     premium_account_type: Union[bool, None] = None
-    friends: Union[List[str], None] = []
     spot_photos: Union[List[str], None] = []
-    added_spots: Union[List[str], None] = []
-    favourite_spots: Union[List[str], None] = []
     created_at: datetime
 
     class Config:
@@ -109,9 +146,12 @@ class SpotSchema(BaseModel):
     spot_street: str
     spot_street_number: str
     spot_description: Union[str, None] = None
-    spot_raiting: Union[int, None] = None
+    spot_raiting: Union[float, None] = None
+    spot_rating_count: int = 0
     comment: Union[List[str], None]
-    owner_id: int
+    owner_id: Union[int, None]  # None once its owner is deleted
+    spot_latitude: Union[float, None] = Field(None, ge=-90, le=90)
+    spot_longitude: Union[float, None] = Field(None, ge=-180, le=180)
 
     class Config:
         orm_mode = True
@@ -126,12 +166,20 @@ class SpotSchema(BaseModel):
                 "spot_street_number": "25",
                 "spot_description": "Doe",
                 "spot_raiting": 4.8,
+                "spot_rating_count": 5,
                 "comment": ["spot_name1", "spot_name2", ],
-                "owner_id": 1
+                "owner_id": 1,
+                "spot_latitude": 48.8566,
+                "spot_longitude": 2.3522,
             }
         }
 
 
+class SpotVersionedSchema(SpotSchema):
+    version: int
+    updated_at: datetime
+
+
 class SpotUpdateSchema(BaseModel):
     spot_name: Union[str, None] = None
     spot_photos: Union[List[str], None] = None
@@ -140,7 +188,14 @@ class SpotUpdateSchema(BaseModel):
     spot_street: Union[str, None] = None
     spot_street_number: Union[str, None] = None
     spot_description: Union[str, None] = None
-    spot_raiting: Union[int, None] = None
+    spot_latitude: Union[float, None] = Field(None, ge=-90, le=90)
+    spot_longitude: Union[float, None] = Field(None, ge=-180, le=180)
+
+    @root_validator(skip_on_failure=True)
+    def check_coordinates(cls, values):
+        if (values.get("spot_latitude") is None) != (values.get("spot_longitude") is None):
+            raise ValueError("spot_latitude and spot_longitude are updated together")
+        return values
 
     class Config:
         orm_mode = True
@@ -153,11 +208,16 @@ class SpotUpdateSchema(BaseModel):
                 "spot_street": "Campbell Falls",
                 "spot_street_number": "25",
                 "spot_description": "Doe",
-                "spot_raiting": 4.8,
+                "spot_latitude": 48.8566,
+                "spot_longitude": 2.3522,
             }
         }
 
 
+class SpotBulkUpdateSchema(SpotUpdateSchema):
+    spot_id: int = Field(gt=0, le=2147483647)  # check int32 range
+
+
 class SpotFilterSchema(BaseModel):
     spot_id:  Union[int, None] = Field(gt=0, le=2147483647)  # check int32 range
     spot_country: Union[str, None] = None
@@ -178,14 +238,125 @@ class SpotFilterSchema(BaseModel):
         }
 
 
+class NearbyQuerySchema(BaseModel):
+    latitude: Union[float, None] = Field(None, ge=-90, le=90)
+    longitude: Union[float, None] = Field(None, ge=-180, le=180)
+    radius_km: Union[float, None] = Field(None, gt=0)
+    min_latitude: Union[float, None] = Field(None, ge=-90, le=90)
+    min_longitude: Union[float, None] = Field(None, ge=-180, le=180)
+    max_latitude: Union[float, None] = Field(None, ge=-90, le=90)
+    max_longitude: Union[float, None] = Field(None, ge=-180, le=180)
+
+    @root_validator(skip_on_failure=True)
+    def check_area(cls, values):
+        """Either a circle around a point or a bounding box"""
+        circle = [values.get(k) for k in ("latitude", "longitude", "radius_km")]
+        box = [values.get(k) for k in ("min_latitude", "min_longitude",
+                                       "max_latitude", "max_longitude")]
+        if all(v is not None for v in circle) and all(v is None for v in box):
+            return values
+        if all(v is not None for v in box) and values.get("radius_km") is None:
+            if box[0] > box[2] or box[1] > box[3]:
+                raise ValueError("Bounding box minimum is above its maximum")
+            return values
+        raise ValueError("Pass latitude, longitude and radius_km or a full bounding box")
+
+    def center(self):
+        if self.radius_km is not None:
+            return self.latitude, self.longitude
+        return ((self.min_latitude + self.max_latitude) / 2,
+                (self.min_longitude + self.max_longitude) / 2)
+
+
+class SpotNearbySchema(SpotSchema):
+    spot_id: int
+    distance_km: float
+
+
+class SpotWithIdSchema(SpotSchema):
+    spot_id: int
+
+
+class SpotWithIdPageSchema(BaseModel):
+    items: List[SpotWithIdSchema]
+    next_cursor: Union[str, None] = None
+
+
+class RatingSchema(BaseModel):
+    score: int = Field(ge=1, le=5)
+
+    class Config:
+        sample_schema = {
+            "example": {
+                "score": 5
+            }
+        }
+
+
+class SpotRatingSchema(BaseModel):
+    spot_id: int
+    spot_raiting: Union[float, None] = None
+    spot_rating_count: int
+
+
+class SearchQuerySchema(BaseModel):
+    q: str
+
+    @validator("q")
+    def check_words(cls, value):
+        if not re.search(r"\w", value):
+            raise ValueError("Search query has no words")
+        return value
+
+
+class SearchHitSchema(BaseModel):
+    kind: str = Field(description="spot or comment")
+    id: int
+    score: float
+    text: Union[str, None] = None
+
+
+class SearchPageSchema(BaseModel):
+    items: List[SearchHitSchema]
+    next_cursor: Union[str, None] = None
+
+
+class FeedEntrySchema(BaseModel):
+    kind: str
+    id: int
+    actor_id: int
+    text: Union[str, None] = None
+    created_at: datetime
+    score: int  # created_at in microseconds, orders the feed
+
+
+class FeedPageSchema(BaseModel):
+    items: List[FeedEntrySchema]
+    next_cursor: Union[str, None] = None
+
+
+class BulkItemResultSchema(BaseModel):
+    index: int = Field(description="Position of the item in the request")
+    id: Union[int, None] = None
+    error: Union[str, None] = None
+
+
+class BulkResultSchema(BaseModel):
+    succeeded: int
+    failed: int
+    items: List[BulkItemResultSchema]
+
+
 class CommentNewSchema(BaseModel):
     body: str
+    spot_id: Union[int, None] = None
 
     class Config:
         orm_mode = True
         sample_schema = {
             "example": {
-                "body": "This is awesome spot!"
+                "body": "This is awesome spot!",
+                "spot_id": 1
             }
         }
 
@@ -193,6 +364,7 @@ class CommentNewSchema(BaseModel):
 class CommentFullSchema(BaseModel):
     comment_id: int
     body: str
+    spot_id: Union[int, None] = None
     created_at: datetime
 
     class Config:
@@ -201,6 +373,27 @@ class CommentFullSchema(BaseModel):
             "example": {
                 "comment_id": 123,
                 "body": "This is awesome spot!",
+                "spot_id": 1,
                 "created_at": "2022-05-05"
             }
         }
+
+
+class CommentVersionedSchema(CommentFullSchema):
+    version: int
+    updated_at: datetime
+
+
+class CommentPageSchema(BaseModel):
+    items: List[CommentFullSchema]
+    next_cursor: Union[str, None] = None
+
+
+class SpotWithCommentsSchema(SpotSchema):
+    spot_id: int
+    comments: List[CommentFullSchema]
+
+
+class SpotPageSchema(BaseModel):
+    items: List[Union[SpotWithCommentsSchema, SpotSchema]]
+    next_cursor: Union[str, None] = None
@@ -0,0 +1,144 @@
+import bisect
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import desc, func, literal, literal_column, select, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api import schema
+from api.lazy import Lazy
+from api.models import CommentDBModel, SpotDBModel
+from api.settings import settings
+
+
+SEARCH_CONFIG = literal_column("'simple'")
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return WORD_RE.findall(text.lower()) if text else []
+
+
+class PostgresSearchIndex:
+    """Ranks over the generated tsvector columns and their GIN indexes,
+    Postgres keeps them current, so write hooks have nothing to do"""
+    needs_documents = False
+
+    async def search(self, db: AsyncSession,
+                     terms: List[str],
+                     offset: int,
+                     limit: int) -> List[schema.SearchHitSchema]:
+        # every term is a prefix, all of them must match
+        tsquery = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{term}:*" for term in terms))
+        spots = (
+            select(literal("spot").label("kind"),
+                   SpotDBModel.spot_id.label("id"),
+                   func.ts_rank(SpotDBModel.spot_search, tsquery).label("score"),
+                   SpotDBModel.spot_name.label("text"))
+            .where(SpotDBModel.spot_search.op("@@")(tsquery))
+        )
+        comments = (
+            select(literal("comment").label("kind"),
+                   CommentDBModel.comment_id.label("id"),
+                   func.ts_rank(CommentDBModel.body_search, tsquery).label("score"),
+                   CommentDBModel.body.label("text"))
+            .where(CommentDBModel.body_search.op("@@")(tsquery))
+        )
+        hits = union_all(spots, comments).subquery()
+        query = (
+            select(hits)
+            .order_by(desc(hits.c.score), hits.c.kind, hits.c.id)
+            .offset(offset)
+            .limit(limit)
+        )
+        result = await db.execute(query)
+
+        return [schema.SearchHitSchema(**row) for row in result.mappings()]
+
+    async def index_document(self, kind: str, pk: int, title: Optional[str],
+                             texts: Iterable[Optional[str]]):
+        pass
+
+    async def remove_document(self, kind: str, pk: int):
+        pass
+
+
+class MemorySearchIndex:
+    """In-process inverted index with tf-idf ranking, for tests and
+    single-worker setups, CRUD write paths keep it current"""
+    needs_documents = True
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[Tuple[str, int], int]] = {}
+        self.documents: Dict[Tuple[str, int], Tuple[Counter, Optional[str]]] = {}
+        self.vocabulary: List[str] = []
+
+    async def search(self, db: Optional[AsyncSession],
+                     terms: List[str],
+                     offset: int,
+                     limit: int) -> List[schema.SearchHitSchema]:
+        scores: Optional[Dict[Tuple[str, int], float]] = None
+        for term in terms:
+            term_scores: Dict[Tuple[str, int], float] = {}
+            for word in self._expand(term):
+                postings = self.postings[word]
+                idf = math.log(1 + len(self.documents) / len(postings))
+                for doc, frequency in postings.items():
+                    term_scores[doc] = max(term_scores.get(doc, 0.0), frequency * idf)
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc: score + term_scores[doc]
+                          for doc, score in scores.items() if doc in term_scores}
+
+        ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], item[0]))
+        return [
+            schema.SearchHitSchema(kind=kind, id=pk, score=score,
+                                   text=self.documents[(kind, pk)][1])
+            for (kind, pk), score in ranked[offset:offset + limit]
+        ]
+
+    def _expand(self, prefix: str) -> List[str]:
+        """Indexed words starting with the prefix"""
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        words = []
+        for word in self.vocabulary[start:]:
+            if not word.startswith(prefix):
+                break
+            words.append(word)
+        return words
+
+    async def index_document(self, kind: str, pk: int, title: Optional[str],
+                             texts: Iterable[Optional[str]]):
+        await self.remove_document(kind, pk)
+        frequencies = Counter(word for text in texts for word in tokenize(text))
+        self.documents[(kind, pk)] = (frequencies, title)
+        for word, frequency in frequencies.items():
+            if word not in self.postings:
+                self.postings[word] = {}
+                bisect.insort(self.vocabulary, word)
+            self.postings[word][(kind, pk)] = frequency
+
+    async def remove_document(self, kind: str, pk: int):
+        document = self.documents.pop((kind, pk), None)
+        if document is None:
+            return
+        for word in document[0]:
+            postings = self.postings[word]
+            postings.pop((kind, pk), None)
+            if not postings:
+                del self.postings[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+
+
+def make_search_index():
+    """Build the index configured in Settings"""
+    if settings.search_backend == "memory":
+        return MemorySearchIndex()
+    return PostgresSearchIndex()
+
+
+search_index = Lazy(make_search_index)
@@ -0,0 +1,152 @@
+"""Production entry point, one uvicorn worker per core:
+
+    python -m api.server --host 0.0.0.0 --port 8000
+
+On SIGTERM a worker keeps serving while /health answers 503 for
+server_drain_seconds, so the load balancer takes it out of rotation,
+then stops accepting and lets in-flight requests finish. Under the
+supervisor the workers leave signals to it, a kill of the whole process
+group reaches them too, and drain together once it sets their shared
+drain state. A second signal to the supervisor kills them.
+
+A "memory" feed or search backend keeps its state in one process, the
+launcher then runs a single worker.
+"""
+import argparse
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+from typing import List, Optional
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from api.lifecycle import share_draining, start_draining
+from api.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def process_local_stores() -> List[str]:
+    """Backends set to "memory", their state lives in one worker and
+    what one worker writes there the others never see"""
+    return [name for name in ("feed_backend", "search_backend") if getattr(settings, name) == "memory"]
+
+
+def worker_count() -> int:
+    if settings.server_workers:
+        return settings.server_workers
+    return 1 if process_local_stores() else os.cpu_count() or 1
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+class DrainingServer(uvicorn.Server):
+    """Drains on the first SIGTERM/SIGINT, a second one exits right away.
+    A supervised worker drains when the supervisor sets `drain_event` instead"""
+
+    def __init__(self, config: uvicorn.Config, drain_event: Optional[object] = None):
+        super().__init__(config)
+        self.drain_event = drain_event
+        self.draining = False
+
+    def run(self, sockets: Optional[List] = None):
+        if self.drain_event is not None:
+            share_draining(self.drain_event)
+        super().run(sockets=sockets)
+
+    def handle_exit(self, sig: int, frame: Optional[object]):
+        if self.drain_event is not None:
+            # a signal to the process group reaches the supervisor too, a
+            # second copy from it would cut the drain short
+            return
+        if self.draining or self.should_exit:
+            self.should_exit = self.force_exit = True
+            return
+        self.drain()
+
+    async def on_tick(self, counter: int) -> bool:
+        if self.drain_event is not None and self.drain_event.is_set() and not self.draining:
+            self.drain()
+        return await super().on_tick(counter)
+
+    def drain(self):
+        self.draining = True
+        start_draining()
+        logger.info(f"Draining for {settings.server_drain_seconds}s before shutdown")
+        asyncio.get_event_loop().call_later(settings.server_drain_seconds, self.shut_down)
+
+    def shut_down(self):
+        self.should_exit = True
+        # connections still open after the grace period are cut
+        asyncio.get_event_loop().call_later(settings.server_graceful_timeout,
+                                            setattr, self, "force_exit", True)
+
+
+class DrainingMultiprocess(Multiprocess):
+    """Drains all workers together through their shared event, instead of
+    signalling them one after the other"""
+
+    def __init__(self, *args, drain_event: object, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_event = drain_event
+
+    def signal_handler(self, sig: int, frame: Optional[object]):
+        if self.should_exit.is_set():
+            # a second signal, the workers exit right away
+            self.kill_workers()
+        self.drain_event.set()
+        self.should_exit.set()
+
+    def kill_workers(self):
+        for process in self.processes:
+            process.kill()
+
+    def shutdown(self):
+        # the workers stop on their own once drained
+        for process in self.processes:
+            process.join()
+        logger.info(f"Stopped {len(self.processes)} workers")
+
+
+def serve(host: str, port: int, workers: int):
+    # every worker opens its pool at startup, they are spawned, not forked
+    os.environ.setdefault("db_pool_warm_up", str(settings.db_pool_size))
+    config = uvicorn.Config("spotapp:app", host=host, port=port, workers=workers,
+                            loop=event_loop(), http=http_protocol(), lifespan="on")
+    logger.info(f"Starting {workers} workers on {host}:{port} with {config.loop} and {config.http}")
+
+    if workers > 1:
+        drain_event = multiprocessing.get_context("spawn").Event()
+        server = DrainingServer(config=config, drain_event=drain_event)
+        DrainingMultiprocess(config, target=server.run, sockets=[config.bind_socket()],
+                             drain_event=drain_event).run()
+    else:
+        DrainingServer(config=config).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SpotApp production server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=worker_count())
+    args = parser.parse_args()
+
+    workers = max(args.workers, 1)
+    local_stores = process_local_stores()
+    if workers > 1 and local_stores:
+        parser.error(f"{', '.join(local_stores)} \"memory\" can't be shared by {workers} workers, "
+                     f"run one worker or a shared backend")
+    serve(args.host, args.port, workers)
+
+
+if __name__ == "__main__":
+    main()
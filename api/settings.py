@@ -1,10 +1,12 @@
 import logging
 import os
-from typing import Optional
+import sys
+from typing import List, Optional
 
 from pydantic import BaseSettings, PostgresDsn
 
 from api.constants import DEFAULT_LOG_FORMAT
+from api.lazy import Lazy
 
 
 class Settings(BaseSettings):
@@ -14,15 +16,101 @@ class Settings(BaseSettings):
     log_format: Optional[str] = DEFAULT_LOG_FORMAT
     log_level: Optional[str] = "INFO"
     db_query_timeout: Optional[int] = 30
+    db_pool_size: Optional[int] = 5
+    db_max_overflow: Optional[int] = 10
+    db_pool_recycle: Optional[int] = 1800  # seconds, -1 keeps connections forever
+    # pre-ping costs a round-trip per checkout, recycle alone is usually enough
+    db_pool_pre_ping: Optional[bool] = True
+    db_pool_warm_up: Optional[int] = 0  # connections opened at startup, api.server uses db_pool_size
+    db_statement_cache_size: Optional[int] = 100  # prepared statements per connection
+    # read replicas as a JSON list of DSNs, balanced "round_robin" or "least_connections"
+    db_replica_dsns: Optional[List[PostgresDsn]] = []
+    db_replica_balancing: Optional[str] = "round_robin"
+    db_read_your_writes: Optional[int] = 0  # seconds reads stay on the primary after a write
+    page_size_default: Optional[int] = 50
+    page_size_max: Optional[int] = 500
+    export_batch_size: Optional[int] = 1000
+    nearby_max_radius_km: Optional[float] = 50.0
+    bulk_max_items: Optional[int] = 5000
+    bulk_chunk_size: Optional[int] = 500  # rows per multi-row statement
+    search_backend: Optional[str] = "postgres"  # or "memory", one process's as the feed's
+    # bcrypt runs off the event loop: "thread" or "process" pool
+    password_hasher_executor: Optional[str] = "thread"
+    password_hasher_workers: Optional[int] = None  # defaults to the core count
+    password_hasher_max_concurrency: Optional[int] = None  # defaults to workers
+    jwt_cache_size: Optional[int] = 10000
+    # by-id read-through cache: "memory" or "redis"
+    cache_backend: Optional[str] = "memory"
+    cache_redis_url: Optional[str] = None
+    cache_ttl: Optional[int] = 60
+    cache_max_entries: Optional[int] = 100000
+    # home feed: "memory" or "redis", feed_redis_url defaults to cache_redis_url.
+    # "memory" is one process's, api.server runs a single worker with it
+    feed_backend: Optional[str] = "memory"
+    feed_redis_url: Optional[str] = None
+    feed_max_entries: Optional[int] = 500  # newest entries kept per user
+    # authors with more friends are merged in on read instead of fanned out
+    feed_fanout_max_followers: Optional[int] = 5000
+    # response bodies: "orjson" or "json", compressed with the first of
+    # response_compression the client accepts ("br" needs brotli from requirements.txt,
+    # without it responses fall back to the next encoding)
+    response_encoder: Optional[str] = "orjson"
+    response_compression: Optional[List[str]] = ["br", "gzip"]
+    response_compression_min_size: Optional[int] = 1024  # bytes, smaller bodies go as they are
+    response_gzip_level: Optional[int] = 6
+    response_brotli_quality: Optional[int] = 4
+    # per-route latency, DB time and pool wait, served on /metrics
+    metrics_enabled: Optional[bool] = True
+    # statements slower than this are logged with their route, 0 turns it off
+    db_slow_query_ms: Optional[int] = 200
+    # statements one request may run, over it "warn" logs once, "raise" fails
+    # the request (the tests run with it), None turns the budget off
+    db_query_budget: Optional[int] = 20
+    db_query_budget_mode: Optional[str] = "warn"
+    # production launcher, python -m api.server
+    server_workers: Optional[int] = None  # defaults to the core count, 1 with a "memory" feed or search
+    server_drain_seconds: Optional[float] = 5  # /health fails this long before shutdown starts
+    server_graceful_timeout: Optional[float] = 30  # in-flight requests get this long to finish
 
 
-settings = Settings()
+# read from the environment on first use, so importing the app needs no db_dsn
+settings: Settings = Lazy(Settings)
+
+
+# built from settings on first use, use_settings() builds them again
+SETTINGS_DEPENDENTS = (("api.authentication", "token_cache"), ("api.crud", "cache_backend"),
+                       ("api.feed", "feed_store"), ("api.search", "search_index"))
+
+
+def use_settings(config: Settings):
+    """Run with `config` instead of the environment, what was built from the
+    previous settings is built again. Engines hold connections, they can't be"""
+    if settings._is_resolved() and settings._resolve() == config:
+        settings._replace(config)
+        return
+
+    db = sys.modules.get("api.db")
+    if db is not None and db.all_engines():
+        raise RuntimeError("Settings can't change once the database engines are built, "
+                           "install them before the first database use")
+
+    settings._replace(config)
+    for module_name, name in SETTINGS_DEPENDENTS:
+        module = sys.modules.get(module_name)  # not imported, nothing built
+        if module is not None:
+            getattr(module, name)._replace(None)
+    utils = sys.modules.get("api.utils")
+    if utils is not None:
+        utils.PasswordHasher.shutdown()
+        utils.PasswordHasher._limiter = None
 
 
 def configure_logger(logger_name: str,
-                     log_format: Optional[str] = settings.log_format,
-                     log_level: Optional[str] = settings.log_level):
+                     log_format: Optional[str] = None,
+                     log_level: Optional[str] = None):
     """Logger configuration"""
+    log_format = log_format or settings.log_format
+    log_level = log_level or settings.log_level
     try:
         logging.basicConfig(level=log_level, format=log_format)
         logger = logging.getLogger()
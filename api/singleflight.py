@@ -0,0 +1,51 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Identical concurrent calls share one execution: the first caller starts
+    the query and everyone arriving while it is in flight gets its result.
+    The query belongs to no caller, it brings its own session"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        self.calls += 1
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.executions += 1
+            # in an empty context, request timings and the like stay with the caller
+            flight = contextvars.Context().run(asyncio.ensure_future, func())
+            self._inflight[key] = flight
+            flight.add_done_callback(lambda done: self._done(key, done))
+
+        # a cancelled waiter must not cancel the query other waiters share
+        return await asyncio.shield(flight)
+
+    def forget(self, key: Hashable):
+        """Let the next call start a fresh execution"""
+        self._inflight.pop(key, None)
+
+    def _done(self, key: Hashable, flight: asyncio.Future):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def fan_out_ratio(self) -> float:
+        """Callers served per executed query"""
+        return self.calls / self.executions if self.executions else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "in_flight": len(self._inflight),
+            "fan_out_ratio": self.fan_out_ratio(),
+        }
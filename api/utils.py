@@ -1,11 +1,131 @@
-from passlib.context import CryptContext
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Type, TypeVar
+
+from pydantic import BaseModel
+
+from api.metrics import Gauge, password_hasher_duration, password_hasher_wait
+from api.settings import settings
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+Model = TypeVar("Model", bound=BaseModel)
 
 
 class PasswordHasher():
-    pass_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    stats: Dict[str, int] = {"queued": 0, "in_flight": 0, "completed": 0}
+
+    _context: Optional["CryptContext"] = None
+    _executor: Optional[Executor] = None
+    _limiter: Optional[asyncio.Semaphore] = None
+    _limiter_loop: Optional[asyncio.AbstractEventLoop] = None
 
     def verify_password(self, plain_password, hashed_password):
-        return self.pass_context.verify(plain_password, hashed_password)
+        return self.pass_context().verify(plain_password, hashed_password)
 
     def hash_password(self, password):
-        return self.pass_context.hash(password)
+        return self.pass_context().hash(password)
+
+    async def verify_password_async(self, plain_password, hashed_password) -> bool:
+        """Verify in the hasher pool without blocking the event loop"""
+        return await self._run(_verify, plain_password, hashed_password)
+
+    async def hash_password_async(self, password) -> str:
+        """Hash in the hasher pool without blocking the event loop"""
+        return await self._run(_hash, password)
+
+    @classmethod
+    def pass_context(cls) -> "CryptContext":
+        """bcrypt context, passlib is imported on first use"""
+        if cls._context is None:
+            from passlib.context import CryptContext
+
+            cls._context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        return cls._context
+
+    @classmethod
+    def workers(cls) -> int:
+        return settings.password_hasher_workers or os.cpu_count() or 1
+
+    @classmethod
+    def executor(cls) -> Executor:
+        """Shared pool for bcrypt work, created on first use"""
+        if cls._executor is None:
+            if settings.password_hasher_executor == "process":
+                cls._executor = ProcessPoolExecutor(max_workers=cls.workers())
+            else:
+                cls._executor = ThreadPoolExecutor(max_workers=cls.workers(),
+                                                   thread_name_prefix="bcrypt")
+        return cls._executor
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the pool, a new one is created on the next call"""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+
+    @classmethod
+    def limiter(cls) -> asyncio.Semaphore:
+        """Concurrency limit bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        if cls._limiter is None or cls._limiter_loop is not loop:
+            cls._limiter = asyncio.Semaphore(
+                settings.password_hasher_max_concurrency or cls.workers())
+            cls._limiter_loop = loop
+        return cls._limiter
+
+    @classmethod
+    async def _run(cls, func: Callable[..., Any], *args) -> Any:
+        operation = func.__name__.lstrip("_")
+        limiter = cls.limiter()
+        cls.stats["queued"] += 1
+        try:
+            with password_hasher_wait.time(operation=operation):
+                await limiter.acquire()
+        finally:
+            cls.stats["queued"] -= 1
+
+        cls.stats["in_flight"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with password_hasher_duration.time(operation=operation):
+                return await loop.run_in_executor(cls.executor(), func, *args)
+        finally:
+            cls.stats["in_flight"] -= 1
+            cls.stats["completed"] += 1
+            limiter.release()
+
+
+Gauge("spotapp_password_hasher_tasks", "bcrypt tasks waiting for a hasher slot or running", ("state",),
+      collect=lambda: {(state,): PasswordHasher.stats[state] for state in ("queued", "in_flight")})
+
+
+def _verify(plain_password, hashed_password) -> bool:
+    return PasswordHasher.pass_context().verify(plain_password, hashed_password)
+
+
+def _hash(password) -> str:
+    return PasswordHasher.pass_context().hash(password)
+
+
+async def ndjson_lines(rows: AsyncIterator[Any],
+                       row_schema: Type[BaseModel]) -> AsyncIterator[str]:
+    """Encode ORM rows one by one as newline delimited JSON"""
+    async for row in rows:
+        yield row_schema.from_orm(row).json() + "\n"
+
+
+def schema_columns(model: Any, row_schema: Type[BaseModel], *extra: Any) -> List[Any]:
+    """Columns of `model` behind the fields of `row_schema`, plus `extra` ones"""
+    return [getattr(model, name) for name in row_schema.__fields__] + list(extra)
+
+
+def trusted(row_schema: Type[Model], row: Any, **values: Any) -> Model:
+    """Build a response object from a row of our own database without
+    validating it again. `row` is a Core row or ORM object carrying every
+    field of `row_schema`, `values` fill or override fields"""
+    fields = {name: getattr(row, name) for name in row_schema.__fields__ if name not in values}
+    return row_schema.construct(**fields, **values)
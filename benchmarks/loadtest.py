@@ -0,0 +1,332 @@
+"""Load test of the main read paths and login.
+
+    # a scratch Postgres, seeded on the first run (--reset seeds it again)
+    python -m benchmarks.loadtest --dsn postgresql+asyncpg://u:p@localhost/loadtest
+    # no Postgres, CRUD reads are served from the seeded data in memory
+    python -m benchmarks.loadtest --stand-in
+
+Concurrent clients drive the ASGI app in process, so client and server share
+one event loop and CPU. Every scenario reports RPS, latency percentiles, DB
+statements per request and peak RSS, and the whole run is written as JSON.
+Pass --compare with an earlier result to print the differences.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+PASSWORD = "loadtest-password"
+CITIES = ["Paris", "Lyon", "Nice", "Lille", "Nantes", "Bordeaux", "Toulouse", "Rennes"]
+RESULTS_DIR = Path(__file__).parent / "results"
+
+Request = Tuple[str, str, Dict[str, Any]]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--dsn", help="scratch Postgres to seed and query")
+    target.add_argument("--stand-in", action="store_true", help="serve CRUD reads from memory")
+    parser.add_argument("--reset", action="store_true", help="drop the tables and seed again")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="earlier result to diff against")
+    return parser.parse_args()
+
+
+def configure(args: argparse.Namespace):
+    """Settings come from the environment, so it is set before the app is imported"""
+    if args.dsn:
+        os.environ["db_dsn"] = args.dsn
+    os.environ.setdefault("db_dsn", "postgresql+asyncpg://stand:in@localhost:5432/stand_in")
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("db_query_budget_mode", "warn")
+
+
+def user_rows(count: int, password_hash: str) -> List[Dict[str, Any]]:
+    return [
+        {
+            "nickname": f"user{index}",
+            "first_name": "Load",
+            "last_name": f"Tester{index}",
+            "user_pic": None,
+            "email": f"user{index}@loadtest.local",
+            "password": password_hash,
+            "spot_photos": [],
+            "premium_account_type": False,
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def spot_rows(count: int, users: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    from api import schema
+    from api.crud import CRUDSpot
+
+    return [
+        CRUDSpot.spot_values(schema.SpotSchema(
+            spot_name=f"Spot {index}",
+            spot_photos=[],
+            spot_country="France",
+            spot_city=CITIES[index % len(CITIES)],
+            spot_street=f"Street {index % 100}",
+            spot_street_number=str(index % 300 + 1),
+            spot_description=f"Seeded spot number {index}",
+            comment=[],
+            owner_id=rnd.randint(1, users),
+            spot_latitude=rnd.uniform(42.5, 51),
+            spot_longitude=rnd.uniform(-4.5, 8),
+        ))
+        for index in range(1, count + 1)
+    ]
+
+
+async def seed_postgres(args: argparse.Namespace, users: List[Dict[str, Any]],
+                        spots: List[Dict[str, Any]]):
+    from sqlalchemy import func, insert, select
+
+    from api.bulk import chunked
+    from api.db import get_engine
+    from api.models import Base, SpotDBModel, UserDBModel
+
+    async with get_engine().begin() as connection:
+        if args.reset:
+            await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+        seeded = await connection.scalar(select(func.count()).select_from(UserDBModel))
+        if seeded:
+            print(f"{seeded} users already seeded, pass --reset to seed again")
+            return
+        for model, rows in ((UserDBModel, users), (SpotDBModel, spots)):
+            for chunk in chunked(rows, 1000):
+                await connection.execute(insert(model), list(chunk))
+        await connection.exec_driver_sql("ANALYZE")
+
+
+def install_stand_in(users: List[Dict[str, Any]], spots: List[Dict[str, Any]]):
+    """Replace the CRUD reads the scenarios hit with lookups in the seeded rows,
+    the by-id caches and the response path stay as they are"""
+    from api import schema
+    from api.crud import CRUDSpot, CRUDUser, spot_cache, user_cache
+    from api.pagination import decode_cursor, paginate
+    from api.utils import trusted
+
+    now = datetime.utcnow()
+    users = [SimpleNamespace(user_id=index, version=1, updated_at=now, **row)
+             for index, row in enumerate(users, 1)]
+    spots = [SimpleNamespace(spot_id=index, version=1, updated_at=now, **row)
+             for index, row in enumerate(spots, 1)]
+    users_by_email = {user.email: user for user in users}
+
+    async def login(cls, db, username):
+        return users_by_email[username]
+
+    async def get_user_by_id(cls, db, user_id):
+        async def load():
+            return trusted(schema.UserVersionedSchema, users[user_id - 1])
+        return await user_cache.get_or_load(user_id, load)
+
+    async def get_spot_by_id(cls, db, spot_id):
+        async def load():
+            return trusted(schema.SpotVersionedSchema, spots[spot_id - 1])
+        return await spot_cache.get_or_load(spot_id, load)
+
+    async def get_all_users(cls, db, cursor, limit):
+        after_id = decode_cursor("user_id", cursor) or 0
+        page, next_cursor = paginate(users[after_id:after_id + limit + 1], "user_id", limit)
+        return schema.UserPageSchema.construct(
+            items=[trusted(schema.UserOpenSchema, user) for user in page], next_cursor=next_cursor)
+
+    async def get_filtered_spots(cls, db, filter, cursor, limit, include_comments=False):
+        after_id = decode_cursor("spot_id", cursor) or 0
+        city = (filter.spot_city or "").lower()
+        matching = [spot for spot in spots[after_id:]
+                    if not city or spot.spot_city.lower() == city][:limit + 1]
+        page, next_cursor = paginate(matching, "spot_id", limit)
+        return schema.SpotPageSchema.construct(
+            items=[trusted(schema.SpotSchema, spot) for spot in page], next_cursor=next_cursor)
+
+    for crud, method in ((CRUDUser, login), (CRUDUser, get_user_by_id), (CRUDUser, get_all_users),
+                         (CRUDSpot, get_spot_by_id), (CRUDSpot, get_filtered_spots)):
+        setattr(crud, method.__name__, classmethod(method))
+
+
+def login_request(args: argparse.Namespace) -> Callable[[random.Random], Request]:
+    def make(rnd: random.Random) -> Request:
+        email = f"user{rnd.randint(1, args.users)}@loadtest.local"
+        return "POST", "/login", {"data": {"username": email, "password": PASSWORD}}
+    return make
+
+
+def spot_request(args: argparse.Namespace) -> Callable[[random.Random], Request]:
+    def make(rnd: random.Random) -> Request:
+        return "GET", f"/spots/{rnd.randint(1, args.spots)}", {}
+    return make
+
+
+def filtered_request(args: argparse.Namespace) -> Callable[[random.Random], Request]:
+    def make(rnd: random.Random) -> Request:
+        return "GET", "/spots/filtered/", {"params": {"spot_city": rnd.choice(CITIES), "limit": 50}}
+    return make
+
+
+def users_request(args: argparse.Namespace) -> Callable[[random.Random], Request]:
+    def make(rnd: random.Random) -> Request:
+        return "GET", "/users/all/", {"params": {"limit": 50}}
+    return make
+
+
+# name: (request factory, method and route template as labelled in the metrics)
+SCENARIOS = {
+    "login": (login_request, ("POST", "/login")),
+    "spot": (spot_request, ("GET", "/spots/{spot_id}")),
+    "filtered": (filtered_request, ("GET", "/spots/filtered/")),
+    "users": (users_request, ("GET", "/users/all/")),
+}
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def statements(method: str, route: str) -> Tuple[float, int]:
+    """Statements and requests counted so far by the metrics for a route"""
+    from api.metrics import http_request_queries
+
+    series = http_request_queries.values.get(http_request_queries.key({"method": method, "route": route}))
+    return (series[1], series[2]) if series else (0.0, 0)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def run_scenario(client: Any, args: argparse.Namespace, name: str,
+                       headers: Dict[str, str]) -> Dict[str, Any]:
+    factory, (method, route) = SCENARIOS[name]
+    make_request = factory(args)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queries_before, requests_before = statements(method, route)
+
+    async def worker(index: int):
+        rnd = random.Random(args.seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            request_method, url, kwargs = make_request(rnd)
+            sent = time.perf_counter()
+            response = await client.request(request_method, url, headers=headers, **kwargs)
+            latencies.append(time.perf_counter() - sent)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(worker(index) for index in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    queries_after, requests_after = statements(method, route)
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            label: round(percentile(ordered, q) * 1000, 2)
+            for label, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+        },
+        "db_statements_per_request": round(
+            (queries_after - queries_before) / max(requests_after - requests_before, 1), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+
+    from api.utils import PasswordHasher
+    from spotapp import app
+
+    rnd = random.Random(args.seed)
+    # one bcrypt hash shared by every seeded user, hashing thousands would dominate seeding
+    users = user_rows(args.users, PasswordHasher().hash_password(PASSWORD))
+    spots = spot_rows(args.spots, args.users, rnd)
+    if args.stand_in:
+        install_stand_in(users, spots)
+    else:
+        await seed_postgres(args, users, spots)
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(app=app, base_url="http://loadtest", limits=limits) as client:
+        response = await client.post("/login", data={"username": "user1@loadtest.local",
+                                                     "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        results = {}
+        for name in args.scenarios.split(","):
+            results[name] = await run_scenario(client, args, name, headers)
+            print(f"{name:<9} {results[name]['rps']:>9} rps  "
+                  f"p50 {results[name]['latency_ms']['p50']:>8} ms  "
+                  f"p99 {results[name]['latency_ms']['p99']:>8} ms  "
+                  f"{results[name]['db_statements_per_request']:>5} stmt/req  "
+                  f"{results[name]['errors']} errors")
+
+    return {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "mode": "stand-in" if args.stand_in else "postgres",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {"users": args.users, "spots": args.spots, "concurrency": args.concurrency,
+                   "duration": args.duration, "seed": args.seed},
+        "scenarios": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    print(f"against {baseline['started_at']} ({baseline['mode']})")
+    for name, result in current["scenarios"].items():
+        before: Optional[Dict[str, Any]] = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        rps = (result["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+        p99 = result["latency_ms"]["p99"] - before["latency_ms"]["p99"]
+        print(f"{name:<9} rps {rps:+7.1f}%  p99 {p99:+8.2f} ms")
+
+
+def main():
+    args = parse_args()
+    configure(args)
+    result = asyncio.run(run(args))
+
+    output = args.output or RESULTS_DIR / f"loadtest-{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2) + "\n")
+    print(f"written to {output}")
+
+    if args.compare:
+        compare(result, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Overhead of the instrumentation itself.
+
+    db_dsn=postgresql+asyncpg://u:p@localhost/db python -m benchmarks.metrics
+
+Requests go straight through the ASGI app, statements run on in-memory
+sqlite, so the numbers are the instrumentation cost alone.
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, text
+
+from api.metrics import Histogram, instrument_engine, request_timings
+from api.settings import settings
+from spotapp import spotapp_api
+
+
+async def call(app, path: str = "/health"):
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+             "query_string": b"", "headers": [], "root_path": "", "scheme": "http",
+             "server": ("bench", 80), "client": ("bench", 1), "http_version": "1.1"}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def per_request(app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def per_statement(engine, statements: int) -> float:
+    with engine.connect() as connection:
+        started = time.perf_counter()
+        for _ in range(statements):
+            connection.execute(text("SELECT 1"))
+        return (time.perf_counter() - started) / statements * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--statements", type=int, default=50000)
+    args = parser.parse_args()
+
+    histogram = Histogram("bench_seconds", "bench", ("route",), registry=[])
+    started = time.perf_counter()
+    for _ in range(args.statements):
+        histogram.observe(0.01, route="/bench")
+    observe = (time.perf_counter() - started) / args.statements * 1e6
+
+    # with no budget the metrics switch alone decides about the middleware
+    settings.db_query_budget = None
+    apps = {}
+    for enabled in (False, True):
+        settings.metrics_enabled = enabled
+        apps[enabled] = spotapp_api()
+
+    plain = per_statement(create_engine("sqlite://"), args.statements)
+    engine = create_engine("sqlite://")
+    instrument_engine(SimpleNamespace(sync_engine=engine), "bench")
+    request_timings.set({"db": 0.0, "queries": 0, "scope": {}})
+    hooked = per_statement(engine, args.statements)
+
+    loop = asyncio.new_event_loop()
+    for app in apps.values():
+        loop.run_until_complete(per_request(app, 1000))  # warm up
+    without_metrics = loop.run_until_complete(per_request(apps[False], args.requests))
+    with_metrics = loop.run_until_complete(per_request(apps[True], args.requests))
+
+    print("microseconds per call")
+    print(f"  histogram observe      {observe:8.2f}")
+    print(f"  request, no metrics    {without_metrics:8.2f}")
+    print(f"  request, with metrics  {with_metrics:8.2f}  ({with_metrics - without_metrics:+.2f})")
+    print(f"  statement, no hooks    {plain:8.2f}")
+    print(f"  statement, with hooks  {hooked:8.2f}  ({hooked - plain:+.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Bytes on the wire and encode time for a page of 10k spots.
+
+    db_dsn=postgresql+asyncpg://u:p@localhost/db python -m benchmarks.responses
+
+"default" is what FastAPI does with a returned page: dump it, revalidate
+it against response_model, run jsonable_encoder and json.dumps the result.
+"""
+import argparse
+import gzip
+import random
+import time
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api import schema
+from api.middleware import brotli_available
+from api.responses import FastJSONResponse
+from api.settings import settings
+from tests import sample
+
+
+def spot_page(size: int) -> schema.SpotPageSchema:
+    random.seed(size)
+    items = [
+        schema.SpotSchema(**{
+            **sample.EXAMPLE_SPOT,
+            "spot_name": f"Spot {index}",
+            "spot_street_number": str(random.randint(1, 300)),
+            "spot_raiting": round(random.uniform(1, 5), 2),
+            "spot_rating_count": random.randint(0, 1000),
+            "spot_latitude": random.uniform(-90, 90),
+            "spot_longitude": random.uniform(-180, 180),
+        })
+        for index in range(size)
+    ]
+    return schema.SpotPageSchema(items=items, next_cursor=sample.NEXT_CURSOR)
+
+
+def default_path(page: schema.SpotPageSchema) -> bytes:
+    content = schema.SpotPageSchema.parse_obj(page.dict())
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(page: schema.SpotPageSchema) -> bytes:
+    return FastJSONResponse(page).body
+
+
+def timed(encode: Callable[[schema.SpotPageSchema], bytes],
+          page: schema.SpotPageSchema, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        encode(page)
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    page = spot_page(args.spots)
+    body = fast_path(page)
+
+    print(f"{args.spots} spots, {settings.response_encoder} encoder")
+    for name, encode in (("default", default_path), ("fast", fast_path)):
+        print(f"  {name:<8} {timed(encode, page, args.rounds):8.1f} ms")
+
+    print(f"  identity {len(body):>10} bytes")
+    compressed = gzip.compress(body, settings.response_gzip_level)
+    print(f"  gzip     {len(compressed):>10} bytes")
+    if brotli_available():
+        import brotli
+
+        compressed = brotli.compress(body, quality=settings.response_brotli_quality)
+        print(f"  br       {len(compressed):>10} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Per-row cost of turning spot rows into a response, validated vs trusted.
+
+    db_dsn=postgresql+asyncpg://u:p@localhost/db python -m benchmarks.rows
+
+"validated" is the former path: from_orm per row, the page validated again
+by FastAPI against response_model, then jsonable_encoder and json.dumps.
+"trusted" builds the page with construct() and dumps it with FastJSONResponse.
+"""
+import argparse
+import time
+from typing import Callable, List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api import schema
+from api.models import SpotDBModel
+from api.responses import FastJSONResponse
+from api.utils import trusted
+from benchmarks.responses import spot_page
+
+
+def validated_page(rows: List[SpotDBModel]) -> schema.SpotPageSchema:
+    return schema.SpotPageSchema(items=[schema.SpotSchema.from_orm(row) for row in rows])
+
+
+def validated_response(rows: List[SpotDBModel]) -> bytes:
+    content = schema.SpotPageSchema.parse_obj(validated_page(rows).dict())
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def trusted_page(rows: List[SpotDBModel]) -> schema.SpotPageSchema:
+    return schema.SpotPageSchema.construct(items=[trusted(schema.SpotSchema, row) for row in rows])
+
+
+def trusted_response(rows: List[SpotDBModel]) -> bytes:
+    return FastJSONResponse(trusted_page(rows)).body
+
+
+def per_row(build: Callable[[List[SpotDBModel]], object],
+            rows: List[SpotDBModel], rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        build(rows)
+    return (time.perf_counter() - started) / rounds / len(rows) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [SpotDBModel(spot_id=index, **spot.dict())
+            for index, spot in enumerate(spot_page(args.spots).items)]
+
+    print(f"{args.spots} spots, microseconds per row")
+    print(f"  {'':<10} {'page':>8} {'response':>9}")
+    for name, page, response in (("validated", validated_page, validated_response),
+                                 ("trusted", trusted_page, trusted_response)):
+        print(f"  {name:<10} {per_row(page, rows, args.rounds):8.2f} "
+              f"{per_row(response, rows, args.rounds):9.2f}")
+
+
+if __name__ == "__main__":
+    main()
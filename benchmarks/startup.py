@@ -0,0 +1,71 @@
+"""Cold start: import, app build and first response, each run in a fresh process.
+
+    db_dsn=postgresql+asyncpg://u:p@localhost/db python -m benchmarks.startup
+
+The first response is GET /health through the ASGI app, it needs no database,
+so the numbers are import and construction cost alone. "process" is the whole
+child, interpreter start and exit included.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+import spotapp
+imported = time.perf_counter()
+app = spotapp.app
+built = time.perf_counter()
+
+async def first_response():
+    scope = {"type": "http", "method": "GET", "path": "/health", "raw_path": b"/health",
+             "query_string": b"", "headers": [], "root_path": "", "scheme": "http",
+             "server": ("bench", 80), "client": ("bench", 1), "http_version": "1.1"}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    assert messages[0]["status"] == 200, messages
+
+asyncio.run(first_response())
+responded = time.perf_counter()
+print(json.dumps({"import": imported - started, "build": built - imported,
+                  "first response": responded - built, "import to response": responded - started}))
+"""
+
+
+def run_once() -> Dict[str, float]:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD], check=True,
+                            capture_output=True, text=True).stdout
+    timings = json.loads(output.splitlines()[-1])
+    timings["process"] = time.perf_counter() - started
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    run_once()  # fills the bytecode cache
+    runs: List[Dict[str, float]] = [run_once() for _ in range(args.runs)]
+
+    print(f"milliseconds over {args.runs} fresh processes    median      min")
+    for phase in runs[0]:
+        values = [run[phase] * 1000 for run in runs]
+        print(f"  {phase:<22} {statistics.median(values):16.1f} {min(values):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
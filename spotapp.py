@@ -1,32 +1,75 @@
-from fastapi import FastAPI, HTTPException
-from api.constants import API_TITLE
-from api.middleware import http_exception_handler
+"""ASGI entry point, `spotapp:app`. Importing this module is cheap: the app,
+its routers, settings, engine and password context are only built on first
+access to `app`, or by calling spotapp_api() with explicit settings."""
+from typing import TYPE_CHECKING, Optional
 
-from api.settings import configure_logger
-from api.routes import spotapp_user_router, spotapp_spot_router, spotapp_comment_router
-from api.authentication import spotapp_auth_router
+if TYPE_CHECKING:
+    from fastapi import FastAPI
+    from api.settings import Settings
 
 
-def spotapp_api() -> FastAPI:
+def spotapp_api(config: Optional["Settings"] = None) -> "FastAPI":
+    """Build the app, with `config` instead of the environment if given"""
+    from fastapi import FastAPI, HTTPException, Response, status
+    from api.settings import configure_logger, settings, use_settings
+
+    if config is not None:
+        use_settings(config)
+
+    from api import lifecycle, metrics
+    from api.constants import API_TITLE, METRICS_MEDIA_TYPE
+    from api.middleware import (CompressionMiddleware, MetricsMiddleware, ReadYourWritesMiddleware,
+                                http_exception_handler)
+    from api.responses import FastJSONResponse
+    from api.routes import spotapp_user_router, spotapp_spot_router, spotapp_comment_router
+    from api.authentication import spotapp_auth_router
+
     configure_logger(API_TITLE)
     app = FastAPI(
         title=API_TITLE,
         description="not forgot to fill",
         docs_url="/docs",
+        default_response_class=FastJSONResponse,
     )
     app.add_exception_handler(HTTPException, http_exception_handler)
+    app.add_event_handler("startup", lifecycle.startup)
+    app.add_event_handler("shutdown", lifecycle.shutdown)
+    if settings.db_replica_dsns and settings.db_read_your_writes:
+        app.add_middleware(ReadYourWritesMiddleware,
+                           window=settings.db_read_your_writes)
+    if settings.response_compression:
+        app.add_middleware(CompressionMiddleware,
+                           encodings=settings.response_compression,
+                           minimum_size=settings.response_compression_min_size,
+                           gzip_level=settings.response_gzip_level,
+                           brotli_quality=settings.response_brotli_quality)
+    if settings.metrics_enabled or settings.db_query_budget:
+        # outermost, so the latency covers the other middleware too
+        app.add_middleware(MetricsMiddleware)
 
     app.include_router(spotapp_auth_router)
     app.include_router(spotapp_user_router)
     app.include_router(spotapp_spot_router)
     app.include_router(spotapp_comment_router)
 
-    return app
+    @app.get("/health")
+    async def health_check(response: Response):
+        if lifecycle.is_draining():
+            # still serving, but the load balancer should stop sending requests
+            response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+            return {"message": "Draining"}
+        return {"message": "Just a health check"}
 
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics_export():
+        return Response(content=metrics.render(), media_type=METRICS_MEDIA_TYPE)
 
-app = application = api = spotapp_api()
+    return app
 
 
-@app.get("/health")
-async def health_check():
-    return {"message": "Just a health check"}
+def __getattr__(name: str) -> "FastAPI":
+    """`app` and its aliases, built from the environment on first access"""
+    if name not in ("app", "application", "api"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    app = globals()["app"] = globals()["application"] = globals()["api"] = spotapp_api()
+    return app
@@ -1,11 +1,20 @@
+import os
+
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
 from fastapi.testclient import TestClient
 
 import spotapp
+from api import schema
+from api.authentication import get_current_user
 from api.models import Base
-from api.db import async_engine
+from api.db import get_engine
+from tests import sample
+
+# a handler going over the query budget fails its test instead of logging,
+# settings are read on first use so collection needs no db_dsn
+os.environ.setdefault("db_query_budget_mode", "raise")
 
 
 @pytest.fixture
@@ -20,11 +29,28 @@ def client():
 async def async_client():
     """Async client fixture"""
 
-    async with async_engine.begin() as connection:
+    async with get_engine().begin() as connection:
         await connection.run_sync(Base.metadata.create_all)
 
     async with AsyncClient(app=spotapp.app, base_url="http://test") as client_fixture:
         yield client_fixture
 
-    async with async_engine.begin() as connection:
+    async with get_engine().begin() as connection:
         await connection.run_sync(Base.metadata.drop_all)
+
+
+@pytest.fixture
+def authorized_user():
+    """Authorized user with an id in the token"""
+
+    async def override_dependency(anything: str = None):
+        return schema.TokenData(email=sample.RAW_USER["email"], user_id=7)
+
+    overrides = spotapp.app.dependency_overrides
+    previous = overrides.get(get_current_user)
+    overrides[get_current_user] = override_dependency
+    yield
+    if previous is None:
+        overrides.pop(get_current_user)
+    else:
+        overrides[get_current_user] = previous
@@ -13,10 +13,15 @@ EXAMPLE_USER = {
     "first_name": "test_name",
     "last_name": "test_name2",
     "user_pic": "test_pic",
-    "friends": ["one_friend", "another_friend"],
     "spot_photos": ["photo", "photo1", ],
-    "added_spots": ["some_test_spot", ],
-    "favourite_spots": ["some_test_spot", ]
+}
+
+EXAMPLE_FRIEND = {
+    "user_id": 8,
+    "nickname": "test_friend",
+    "first_name": "test_name",
+    "last_name": "test_name2",
+    "user_pic": "test_pic",
 }
 
 EXAMPLE_NEW_USER_ADD = {
@@ -34,6 +39,14 @@ EXAMPLE_USER_422 = {
     ]
 }
 
+NEXT_CURSOR = "eyJzcG90X2lkIjoyfQ"
+EXAMPLE_VERSION = {
+    "version": 3,
+    "updated_at": "2022-06-24T10:00:00",
+}
+LAST_MODIFIED = "Fri, 24 Jun 2022 10:00:00 GMT"
+NEXT_COMMENT_CURSOR = "eyJjb21tZW50X2lkIjoxfQ"
+
 DELETED_USER = "User with user_id=123 is disappear..."
 DELETED_SPOT = "Spot with spot_id=123 is destroied..."
 
@@ -46,9 +59,26 @@ EXAMPLE_SPOT = {
     "spot_street": "Campbell Falls",
     "spot_street_number": "25",
     "spot_description": "Doe",
-    "spot_raiting": 4,
+    "spot_raiting": 4.5,
+    "spot_rating_count": 2,
     "comment": [],
-    "owner_id": 1
+    "owner_id": 1,
+    "spot_latitude": 48.8566,
+    "spot_longitude": 2.3522,
+}
+EXAMPLE_NEARBY_SPOT = {
+    **EXAMPLE_SPOT,
+    "spot_id": 1,
+    "distance_km": 0.4,
+}
+EXAMPLE_SPOT_WITH_ID = {
+    **EXAMPLE_SPOT,
+    "spot_id": 1,
+}
+EXAMPLE_SPOT_RATING = {
+    "spot_id": 1,
+    "spot_raiting": 4.5,
+    "spot_rating_count": 2,
 }
 EXAMPLE_SPOT_422 = {
     'detail': [
@@ -68,14 +98,18 @@ RAW_SPOT = {
     "spot_street": "Campbell Falls",
     "spot_street_number": "25",
     "spot_description": "Doe",
-    "owner_id": 1
+    "owner_id": 1,
+    "spot_latitude": 48.8566,
+    "spot_longitude": 2.3522,
 }
 RAW_COMMENT = {
     "body": "This is awesome spot!",
+    "spot_id": 1,
 }
 EXAMPLE_COMMENT = {
     "comment_id": 1,
     "body": "This is awesome spot!",
+    "spot_id": 1,
     "created_at": "2022-06-23T18:36:03.741328",
 }
 EXAMPLE_COMMENT_422 = {
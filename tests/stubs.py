@@ -1,7 +1,9 @@
 from http import HTTPStatus
+from types import SimpleNamespace
 from fastapi import Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from api import schema
 from tests import sample
 
 
@@ -12,11 +14,19 @@ async def get_user_by_id_empty_stub(db: AsyncSession,
 
 async def get_user_by_id_stub(db: AsyncSession,
                               user_id: int):
-    return sample.EXAMPLE_USER
+    return schema.UserVersionedSchema(**sample.EXAMPLE_USER, **sample.EXAMPLE_VERSION)
 
 
-async def get_all_users_stub(db: AsyncSession):
-    return [sample.EXAMPLE_USER, sample.EXAMPLE_USER]
+async def get_all_users_stub(db: AsyncSession,
+                             cursor: str,
+                             limit: int):
+    return schema.UserPageSchema(items=[sample.EXAMPLE_USER, sample.EXAMPLE_USER],
+                                 next_cursor=sample.NEXT_CURSOR)
+
+
+async def stream_users_stub(db: AsyncSession):
+    for user in [sample.EXAMPLE_USER, sample.EXAMPLE_USER]:
+        yield SimpleNamespace(**user)
 
 
 async def create_new_user_stub(db: AsyncSession,
@@ -31,12 +41,41 @@ async def delete_user_stub(db: AsyncSession,
 
 async def get_spot_by_id_stub(db: AsyncSession,
                               spot_id: int):
-    return sample.EXAMPLE_SPOT
+    return schema.SpotVersionedSchema(**sample.EXAMPLE_SPOT, **sample.EXAMPLE_VERSION)
+
+
+async def get_ownerless_spot_by_id_stub(db: AsyncSession,
+                                        spot_id: int):
+    return schema.SpotVersionedSchema(**{**sample.EXAMPLE_SPOT, "owner_id": None}, **sample.EXAMPLE_VERSION)
 
 
 async def get_spots_stub(db: AsyncSession,
-                         filter):
-    return [sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT]
+                         filter,
+                         cursor: str,
+                         limit: int,
+                         include_comments: bool = False):
+    return schema.SpotPageSchema(items=[sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT],
+                                 next_cursor=sample.NEXT_CURSOR)
+
+
+async def get_spots_empty_stub(db: AsyncSession,
+                               filter,
+                               cursor: str,
+                               limit: int,
+                               include_comments: bool = False):
+    return schema.SpotPageSchema(items=[])
+
+
+async def stream_spots_stub(db: AsyncSession,
+                            filter):
+    for spot in [sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT]:
+        yield SimpleNamespace(**spot)
+
+
+async def get_nearby_spots_stub(db: AsyncSession,
+                                area,
+                                limit: int):
+    return [sample.EXAMPLE_NEARBY_SPOT]
 
 
 async def get_spot_by_id_empty_stub(db: AsyncSession,
@@ -56,7 +95,7 @@ async def delete_spot_stub(db: AsyncSession,
 
 async def get_comment_by_id_stub(db: AsyncSession,
                                  comment_id: int):
-    return sample.EXAMPLE_COMMENT
+    return schema.CommentVersionedSchema(**sample.EXAMPLE_COMMENT, **sample.EXAMPLE_VERSION)
 
 
 async def get_comment_by_id_empty_stub(db: AsyncSession,
@@ -67,3 +106,97 @@ async def get_comment_by_id_empty_stub(db: AsyncSession,
 async def create_new_comment_stub(db: AsyncSession,
                                   comment):
     return sample.EXAMPLE_COMMENT
+
+
+async def rate_spot_stub(db: AsyncSession,
+                         spot_id: int,
+                         user_id: int,
+                         score: int):
+    return schema.SpotRatingSchema(**sample.EXAMPLE_SPOT_RATING)
+
+
+async def get_top_rated_spots_stub(db: AsyncSession,
+                                   spot_city: str,
+                                   limit: int):
+    return [sample.EXAMPLE_SPOT_WITH_ID]
+
+
+async def get_friends_stub(db: AsyncSession,
+                           user_id: int,
+                           cursor: str,
+                           limit: int):
+    return schema.UserBriefPageSchema(items=[sample.EXAMPLE_FRIEND])
+
+
+async def get_mutual_friends_stub(db: AsyncSession,
+                                  user_id: int,
+                                  other_id: int,
+                                  cursor: str,
+                                  limit: int):
+    return schema.UserBriefPageSchema(items=[sample.EXAMPLE_FRIEND])
+
+
+async def get_friends_spots_stub(db: AsyncSession,
+                                 user_id: int,
+                                 cursor: str,
+                                 limit: int):
+    return schema.SpotWithIdPageSchema(items=[sample.EXAMPLE_SPOT_WITH_ID],
+                                       next_cursor=sample.NEXT_CURSOR)
+
+
+async def add_friend_stub(db: AsyncSession,
+                          user_id: int,
+                          friend_id: int):
+    return f"Users {user_id=} and {friend_id=} are friends!"
+
+
+async def get_feed_stub(db: AsyncSession,
+                        user_id: int,
+                        cursor: str,
+                        limit: int):
+    return schema.FeedPageSchema(items=[{
+        "kind": "spot", "id": 1, "actor_id": 8, "text": "Theatr",
+        "created_at": "2022-06-23T18:36:03", "score": 1656009363000000,
+    }])
+
+
+async def get_favourited_by_stub(db: AsyncSession,
+                                 spot_id: int,
+                                 cursor: str,
+                                 limit: int):
+    return schema.UserBriefPageSchema(items=[sample.EXAMPLE_FRIEND])
+
+
+async def get_spot_comments_stub(db: AsyncSession,
+                                 spot_id: int,
+                                 cursor: str,
+                                 limit: int):
+    return schema.CommentPageSchema(items=[sample.EXAMPLE_COMMENT],
+                                    next_cursor=sample.NEXT_COMMENT_CURSOR)
+
+
+async def add_users_stub(db: AsyncSession,
+                         users):
+    return [schema.BulkItemResultSchema(index=index, id=index + 1) for index, _ in users]
+
+
+async def add_spots_stub(db: AsyncSession,
+                         spots):
+    return [schema.BulkItemResultSchema(index=index, id=index + 1) for index, _ in spots]
+
+
+async def delete_spots_stub(db: AsyncSession,
+                            spot_ids):
+    return [schema.BulkItemResultSchema(index=0, id=spot_ids[0]),
+            schema.BulkItemResultSchema(index=1, error="Spot with spot_id=404 was not found")]
+
+
+async def update_users_stub(db: AsyncSession,
+                            updates):
+    return [schema.BulkItemResultSchema(index=index, id=update.user_id) for index, update in updates]
+
+
+async def delete_users_stub(db: AsyncSession,
+                            user_ids):
+    return [schema.BulkItemResultSchema(index=0, id=user_ids[0]),
+            schema.BulkItemResultSchema(index=1, error="User with user_id=404 was not found")]
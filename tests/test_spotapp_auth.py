@@ -0,0 +1,91 @@
+import asyncio
+from datetime import timedelta
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from api import authentication
+from api.cache import TTLCache
+from api.crud import CRUDUser
+from api.utils import PasswordHasher
+from tests import sample
+
+
+@pytest.fixture
+def jwt_settings(monkeypatch):
+    monkeypatch.setattr(authentication, "SECRET_KEY", "unittest-secret")
+    monkeypatch.setattr(authentication, "ALGORITHM", "HS256")
+
+
+def test_login_ok(client, mocker, jwt_settings):
+    hashed_password = PasswordHasher().hash_password(sample.RAW_USER["password"])
+
+    async def login_stub(db, username):
+        return SimpleNamespace(user_id=1, email=username, password=hashed_password)
+
+    mocker.patch.object(CRUDUser, "login", side_effect=login_stub, autospec=True)
+    response = client.post("/login", data={"username": sample.RAW_USER["email"],
+                                           "password": sample.RAW_USER["password"]})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["token_type"] == "bearer"
+    claims = jwt.get_unverified_claims(response.json()["access_token"])
+    assert claims["uid"] == 1
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_async_runs_in_pool():
+    hasher = PasswordHasher()
+    hashed = await hasher.hash_password_async("secret")
+
+    results = await asyncio.gather(
+        hasher.verify_password_async("secret", hashed),
+        hasher.verify_password_async("wrong", hashed),
+    )
+
+    assert results == [True, False]
+    assert PasswordHasher.stats["queued"] == 0
+    assert PasswordHasher.stats["in_flight"] == 0
+    assert PasswordHasher.stats["completed"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_current_user_token_cache(jwt_settings):
+    authentication.token_cache.clear()
+    token = authentication.create_access_token(data={"sub": sample.RAW_USER["email"]})
+
+    first = await authentication.get_current_user(token)
+    second = await authentication.get_current_user(token)
+
+    assert first == second
+    assert first.email == sample.RAW_USER["email"]
+    assert authentication.token_cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_current_user_expired_token_not_cached(jwt_settings):
+    authentication.token_cache.clear()
+    token = authentication.create_access_token(data={"sub": sample.RAW_USER["email"]},
+                                               expires_delta=timedelta(seconds=-1))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await authentication.get_current_user(token)
+
+    assert exc_info.value.status_code == HTTPStatus.UNAUTHORIZED
+    assert len(authentication.token_cache) == 0
+
+
+def test_ttl_cache_lru_and_expiry():
+    now = [0.0]
+    cache = TTLCache(max_entries=2, clock=lambda: now[0])
+    cache.set("a", 1, ttl=10)
+    cache.set("b", 2, ttl=10)
+    cache.get("a")
+    cache.set("c", 3, ttl=10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("c") is None
@@ -0,0 +1,215 @@
+import asyncio
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+import pytest
+
+from api import crud, schema
+from api.cache import MemoryCacheBackend, ReadThroughCache, RedisCacheBackend
+from api.crud import CRUDSpot, spot_cache
+from api.singleflight import SingleFlight
+from tests import sample
+
+
+class FakeRedis:
+    """Just enough of redis.asyncio for the cache backend"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def make_loader(calls, delay=0):
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return schema.CommentFullSchema(**sample.EXAMPLE_COMMENT)
+    return load
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", [MemoryCacheBackend(max_entries=10),
+                                     RedisCacheBackend(FakeRedis())])
+async def test_read_through_hit_after_miss(backend):
+    cache = ReadThroughCache("comment", schema.CommentFullSchema, backend=backend, ttl=60)
+    calls = []
+
+    first = await cache.get_or_load(1, make_loader(calls))
+    second = await cache.get_or_load(1, make_loader(calls))
+
+    assert first == second
+    assert len(calls) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "loading": 0}
+
+
+@pytest.mark.asyncio
+async def test_stampede_guard_single_load():
+    cache = ReadThroughCache("comment", schema.CommentFullSchema,
+                             backend=MemoryCacheBackend(max_entries=10), ttl=60)
+    calls = []
+
+    results = await asyncio.gather(*[cache.get_or_load(1, make_loader(calls, delay=0.01))
+                                     for _ in range(20)])
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+
+
+@pytest.mark.asyncio
+async def test_invalidate_during_load_is_not_cached():
+    cache = ReadThroughCache("comment", schema.CommentFullSchema,
+                             backend=MemoryCacheBackend(max_entries=10), ttl=60)
+    calls = []
+
+    loading = asyncio.ensure_future(cache.get_or_load(1, make_loader(calls, delay=0.01)))
+    await asyncio.sleep(0)
+    await cache.invalidate(1)
+    await loading
+    await cache.get_or_load(1, make_loader(calls))
+
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_single_flight_fan_out():
+    flights = SingleFlight("test")
+    calls = []
+
+    results = await asyncio.gather(*[flights.do("key", make_loader(calls, delay=0.01))
+                                     for _ in range(10)])
+    await flights.do("key", make_loader(calls))
+
+    assert len(calls) == 2
+    assert results.count(results[0]) == 10
+    assert flights.stats()["fan_out_ratio"] == 5.5
+
+
+@pytest.mark.asyncio
+async def test_single_flight_leaves_the_callers_context():
+    request = ContextVar("request", default=None)
+    request.set("first caller")
+
+    async def load():
+        return request.get()
+
+    assert await SingleFlight("test").do("key", load) is None
+
+
+@pytest.mark.asyncio
+async def test_shared_load_outlives_a_cancelled_caller(mocker):
+    sessions = []
+
+    @asynccontextmanager
+    async def own_session(db, primary=False):
+        session = mocker.AsyncMock()
+        session.execute.return_value = mocker.MagicMock()
+        session.execute.return_value.scalar_one.return_value = SimpleNamespace(
+            **sample.EXAMPLE_SPOT, **sample.EXAMPLE_VERSION)
+        sessions.append(session)
+        await asyncio.sleep(0.01)
+        yield session
+
+    mocker.patch.object(crud, "shared_read_session", side_effect=own_session, autospec=True)
+    first_db, second_db = mocker.AsyncMock(info={}), mocker.AsyncMock(info={})
+    second_db.execute.return_value = mocker.MagicMock()
+    second_db.execute.return_value.scalar_one_or_none.return_value = sample.EXAMPLE_VERSION["version"]
+    await spot_cache.invalidate(404)
+
+    first = asyncio.ensure_future(CRUDSpot.get_spot_by_id(first_db, 404))
+    second = asyncio.ensure_future(CRUDSpot.get_spot_by_id(second_db, 404))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert (await second).spot_name == sample.EXAMPLE_SPOT["spot_name"]
+    assert first.cancelled()
+    assert len(sessions) == 1
+    first_db.execute.assert_not_awaited()
+    await spot_cache.invalidate(404)
+
+
+@pytest.mark.asyncio
+async def test_reads_own_writes_pass_the_cache_and_flights(mocker):
+    mocker.patch.object(crud, "shared_read_session", side_effect=lambda db, primary=False: nullcontext(db),
+                        autospec=True)
+
+    def session(spot_name, reads_own_writes, delay=0):
+        async def execute(query):
+            await asyncio.sleep(delay)
+            result = mocker.MagicMock()
+            result.scalar_one.return_value = SimpleNamespace(
+                **{**sample.EXAMPLE_SPOT, "spot_name": spot_name}, **sample.EXAMPLE_VERSION)
+            result.scalar_one_or_none.return_value = sample.EXAMPLE_VERSION["version"]
+            result.all.return_value = []
+            return result
+        return mocker.AsyncMock(info={"reads_own_writes": reads_own_writes}, execute=execute)
+
+    await spot_cache.invalidate(405)
+    replica, primary = session("Lagging", False), session("Written", True)
+    assert (await CRUDSpot.get_spot_by_id(replica, 405)).spot_name == "Lagging"
+    assert (await CRUDSpot.get_spot_by_id(primary, 405)).spot_name == "Written"
+    # and the primary read left the cache alone
+    assert (await CRUDSpot.get_spot_by_id(session("Other", False), 405)).spot_name == "Lagging"
+    await spot_cache.invalidate(405)
+
+    replica, primary = session("Lagging", False, delay=0.01), session("Written", True)
+    replica_page = asyncio.ensure_future(
+        CRUDSpot.get_filtered_spots(replica, schema.SpotFilterSchema(), cursor=None, limit=10))
+    await asyncio.sleep(0)
+    await CRUDSpot.get_filtered_spots(primary, schema.SpotFilterSchema(), cursor=None, limit=10)
+    assert not replica_page.done()  # not joined, or it would have waited for the replica
+    await replica_page
+
+
+@pytest.mark.asyncio
+async def test_cache_fills_from_the_primary(mocker):
+    shared_read_session = mocker.patch.object(crud, "shared_read_session",
+                                              side_effect=lambda db, primary=False: nullcontext(db),
+                                              autospec=True)
+    db = mocker.AsyncMock(info={})
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.scalar_one.return_value = SimpleNamespace(**sample.EXAMPLE_SPOT,
+                                                                      **sample.EXAMPLE_VERSION)
+    db.execute.return_value.scalar_one_or_none.return_value = sample.EXAMPLE_VERSION["version"]
+    db.execute.return_value.all.return_value = []
+    await spot_cache.invalidate(406)
+
+    await CRUDSpot.get_spot_by_id(db, 406)
+    await CRUDSpot.get_filtered_spots(db, schema.SpotFilterSchema(), cursor=None, limit=10)
+
+    # the filtered page is not kept, it may read a replica
+    assert [call.kwargs.get("primary", False) for call in shared_read_session.call_args_list] == [True, False]
+    await spot_cache.invalidate(406)
+
+
+@pytest.mark.asyncio
+async def test_cached_copy_behind_the_database_is_reloaded(mocker):
+    mocker.patch.object(crud, "shared_read_session", side_effect=lambda db, primary=False: nullcontext(db),
+                        autospec=True)
+
+    def loaded(spot_name, version):
+        result = mocker.MagicMock()
+        result.scalar_one.return_value = SimpleNamespace(
+            **{**sample.EXAMPLE_SPOT, "spot_name": spot_name}, **{**sample.EXAMPLE_VERSION, "version": version})
+        return result
+
+    # another worker wrote version 4, this process still caches version 3
+    probe = mocker.MagicMock()
+    probe.scalar_one_or_none.return_value = 4
+    db = mocker.AsyncMock(info={})
+    db.execute.side_effect = [loaded("Old", 3), probe, loaded("New", 4)]
+    await spot_cache.invalidate(407)
+
+    spot = await CRUDSpot.get_spot_by_id(db, 407)
+
+    assert (spot.spot_name, spot.version) == ("New", 4)
+    await spot_cache.invalidate(407)
@@ -1,7 +1,13 @@
+from contextlib import nullcontext
 from http import HTTPStatus
 import json
 
-from api.crud import CRUDComment
+import pytest
+from sqlalchemy.exc import NoResultFound
+
+from api import crud
+from api.crud import CRUDComment, CRUDSpot
+from api.schema import SpotFilterSchema
 from tests import stubs, sample
 
 
@@ -21,12 +27,50 @@ def test_comment_get_by_id_422(client, mocker):
     assert response.json() == sample.EXAMPLE_COMMENT_422
 
 
-def test_create_comment_ok(client, mocker):
-    mocker.patch.object(CRUDComment, "add_comment",
-                        side_effect=stubs.create_new_comment_stub, autospec=True)
-    response = client.post("/comments/create/", json.dumps(sample.RAW_COMMENT))
+def test_create_comment_ok(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDComment, "add_comment",
+                                    side_effect=stubs.create_new_comment_stub, autospec=True)
+    response = client.post("/comments/create/",
+                           json.dumps({**sample.RAW_COMMENT, "owner_id": 99}))
     assert response.status_code == HTTPStatus.CREATED
     assert response.json() == sample.EXAMPLE_COMMENT
+    assert crud_mock.call_args.kwargs["comment"].owner_id == 7
+
+
+def test_create_comment_needs_authorization_401(client):
+    response = client.post("/comments/create/", json.dumps(sample.RAW_COMMENT))
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_get_spot_comments_ok(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDComment, "get_spot_comments",
+                                    side_effect=stubs.get_spot_comments_stub, autospec=True)
+    response = client.get("/spots/1/comments", params={"limit": 1})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"items": [sample.EXAMPLE_COMMENT],
+                               "next_cursor": sample.NEXT_COMMENT_CURSOR}
+    assert crud_mock.call_args.kwargs["limit"] == 1
+
+
+def test_get_spot_comments_unknown_spot_404(client, mocker, authorized_user):
+    mocker.patch.object(CRUDComment, "get_spot_comments",
+                        side_effect=NoResultFound, autospec=True)
+    response = client.get("/spots/404/comments")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_spot_page_loads_comments_in_one_query(mocker):
+    db = mocker.AsyncMock(info={})
+    db.execute.return_value.scalars = mocker.Mock(return_value=mocker.Mock(all=list))
+    mocker.patch.object(crud, "shared_read_session", side_effect=nullcontext, autospec=True)
+
+    await CRUDSpot.get_filtered_spots(db, SpotFilterSchema(), cursor=None, limit=10,
+                                      include_comments=True)
+
+    statement = db.execute.await_args.args[0]
+    assert [option.path[-1].key for option in statement._with_options if option.path] == ["comments"]
+    assert db.execute.await_count == 1
 
 
 # def test_delete_comment_ok(client, mocker):
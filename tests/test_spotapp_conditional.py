@@ -0,0 +1,76 @@
+from http import HTTPStatus
+import json
+
+import pytest
+from starlette.requests import Request
+
+from api.conditional import PreconditionFailed, if_match_versions
+from api.crud import CRUDSpot, CRUDUser
+from tests import stubs, sample
+
+SPOT_ETAG = '"spot-1-3"'
+
+
+def test_spot_read_carries_validators(client, mocker, authorized_user):
+    mocker.patch.object(CRUDSpot, "get_spot_by_id",
+                        side_effect=stubs.get_spot_by_id_stub, autospec=True)
+    response = client.get("/spots/1")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == sample.EXAMPLE_SPOT
+    assert response.headers["ETag"] == SPOT_ETAG
+    assert response.headers["Last-Modified"] == sample.LAST_MODIFIED
+
+
+@pytest.mark.parametrize("headers, status", [
+    ({"If-None-Match": SPOT_ETAG}, HTTPStatus.NOT_MODIFIED),
+    ({"If-None-Match": f'"spot-1-2", W/{SPOT_ETAG}'}, HTTPStatus.NOT_MODIFIED),
+    ({"If-None-Match": '"spot-1-2"'}, HTTPStatus.OK),
+    ({"If-Modified-Since": sample.LAST_MODIFIED}, HTTPStatus.NOT_MODIFIED),
+    ({"If-Modified-Since": "Thu, 23 Jun 2022 10:00:00 GMT"}, HTTPStatus.OK),
+    # If-None-Match wins over the date
+    ({"If-None-Match": '"spot-1-2"', "If-Modified-Since": sample.LAST_MODIFIED}, HTTPStatus.OK),
+])
+def test_spot_conditional_read(client, mocker, authorized_user, headers, status):
+    mocker.patch.object(CRUDSpot, "get_spot_by_id",
+                        side_effect=stubs.get_spot_by_id_stub, autospec=True)
+    response = client.get("/spots/1", headers=headers)
+    assert response.status_code == status
+    assert response.headers["ETag"] == SPOT_ETAG
+    if status == HTTPStatus.NOT_MODIFIED:
+        assert response.content == b""
+
+
+def test_user_conditional_read(client, mocker):
+    mocker.patch.object(CRUDUser, "get_user_by_id",
+                        side_effect=stubs.get_user_by_id_stub, autospec=True)
+    response = client.get("/users/1", headers={"If-None-Match": '"user-1-3"'})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+
+def test_spot_update_if_match(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDSpot, "update", return_value=4, autospec=True)
+    response = client.put("/spots/1", json.dumps({"spot_name": "Eiffel"}),
+                          headers={"If-Match": SPOT_ETAG})
+    assert response.status_code == HTTPStatus.ACCEPTED
+    assert response.headers["ETag"] == '"spot-1-4"'
+    assert crud_mock.call_args.kwargs["versions"] == [3]
+
+
+def test_spot_update_stale_412(client, mocker, authorized_user):
+    mocker.patch.object(CRUDSpot, "update", side_effect=PreconditionFailed, autospec=True)
+    response = client.put("/spots/1", json.dumps({"spot_name": "Eiffel"}),
+                          headers={"If-Match": '"spot-1-2"'})
+    assert response.status_code == HTTPStatus.PRECONDITION_FAILED
+
+
+@pytest.mark.parametrize("header, versions", [
+    (None, None),
+    ("*", None),
+    ('"spot-1-3", "spot-1-5"', [3, 5]),
+    ('W/"spot-1-3"', []),
+    ('"spot-2-3", "user-1-3"', []),
+])
+def test_if_match_versions(header, versions):
+    headers = [] if header is None else [(b"if-match", header.encode())]
+    request = Request({"type": "http", "headers": headers})
+    assert if_match_versions(request, "spot", 1) == versions
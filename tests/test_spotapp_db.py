@@ -0,0 +1,146 @@
+import logging
+import time
+from http import HTTPStatus
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import spotapp
+from api import db, lifecycle
+from api.constants import PRIMARY_STICKY_COOKIE
+from api.db import ReplicaRouter, sticks_to_primary
+from api.middleware import ReadYourWritesMiddleware
+
+
+def fake_engine(name, checked_out=0):
+    pool = SimpleNamespace(checkedout=lambda: checked_out)
+    return SimpleNamespace(name=name, sync_engine=SimpleNamespace(pool=pool))
+
+
+def test_replica_router_round_robin():
+    primary = fake_engine("primary")
+    router = ReplicaRouter(primary, [fake_engine("r1"), fake_engine("r2")])
+
+    assert [router.choose().name for _ in range(4)] == ["r1", "r2", "r1", "r2"]
+    assert router.choose(primary=True) is primary
+
+
+def test_replica_router_least_connections():
+    router = ReplicaRouter(fake_engine("primary"),
+                           [fake_engine("busy", 5), fake_engine("idle", 1)],
+                           balancing="least_connections")
+
+    assert router.choose().name == "idle"
+
+
+def test_replica_router_without_replicas_uses_primary():
+    primary = fake_engine("primary")
+
+    assert ReplicaRouter(primary, []).choose() is primary
+
+
+def test_read_your_writes_cookie():
+    app = FastAPI()
+
+    @app.post("/write")
+    async def write(request: Request):
+        request.state.wrote = True
+        return {}
+
+    @app.post("/login")
+    async def login():
+        return {}
+
+    @app.get("/read")
+    async def read():
+        return {}
+
+    app.add_middleware(ReadYourWritesMiddleware, window=5)
+    with TestClient(app) as client:
+        assert PRIMARY_STICKY_COOKIE not in client.get("/read").cookies
+        assert PRIMARY_STICKY_COOKIE not in client.post("/login").cookies
+        response = client.post("/write")
+
+    assert response.status_code == HTTPStatus.OK
+    request = SimpleNamespace(cookies=response.cookies)
+    assert int(response.cookies[PRIMARY_STICKY_COOKIE]) > time.time()
+    assert sticks_to_primary(request)
+
+
+def test_writing_session_flags_its_request():
+    state = SimpleNamespace()
+    db.mark_written(SimpleNamespace(info={"request_state": state}))
+    db.mark_written(SimpleNamespace(info={}))  # sessions outside a request
+
+    assert state.wrote
+
+
+@pytest.mark.asyncio
+async def test_sticky_read_session_reads_own_writes(mocker):
+    primary, replica = (create_async_engine(f"postgresql+asyncpg://u:p@{host}/db") for host in ("primary", "replica"))
+    mocker.patch.object(db, "_replica_router", ReplicaRouter(primary, [replica]))
+    sticky = SimpleNamespace(cookies={PRIMARY_STICKY_COOKIE: str(int(time.time()) + 5)})
+
+    async for session in db.get_read_session(sticky):
+        assert session.bind is db.read_bind(primary)
+        assert db.reads_own_writes(session)
+    async for session in db.get_read_session(SimpleNamespace(cookies={})):
+        assert session.bind is db.read_bind(replica)
+        assert not db.reads_own_writes(session)
+
+
+@pytest.mark.asyncio
+async def test_warm_up_opens_connections_at_once(mocker):
+    engine = mocker.MagicMock()
+    engine.connect.return_value.__aenter__.return_value = mocker.AsyncMock()
+    mocker.patch.object(db, "all_engines", return_value=[engine])
+    mocker.patch.object(db.settings, "db_pool_size", 3)
+
+    await db.warm_up_pools(10)
+
+    # capped at the pool size, all held together so they are distinct connections
+    assert engine.connect.call_count == 3
+    assert engine.connect.return_value.__aexit__.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failure_only_logs(mocker, caplog):
+    engine = mocker.MagicMock()
+    engine.connect.return_value.__aenter__.side_effect = OSError("connection refused")
+    mocker.patch.object(db, "all_engines", return_value=[engine])
+
+    with caplog.at_level(logging.WARNING, logger="api.db"):
+        await db.warm_up_pools(2)
+    assert "connection refused" in caplog.text
+
+
+def test_forked_child_forgets_pools(mocker):
+    engine = mocker.MagicMock()
+    mocker.patch.object(db, "all_engines", return_value=[engine])
+
+    db.forget_pools()
+
+    engine.sync_engine.dispose.assert_called_once_with(close=False)
+
+
+def test_pools_warm_up_and_close_with_the_app(mocker):
+    warm_up = mocker.patch.object(lifecycle, "warm_up_pools", autospec=True)
+    dispose = mocker.patch.object(lifecycle, "dispose_pools", autospec=True)
+    mocker.patch.object(lifecycle.settings, "db_pool_warm_up", 2)
+
+    with TestClient(spotapp.spotapp_api()):
+        warm_up.assert_awaited_once_with(2)
+        dispose.assert_not_awaited()
+    dispose.assert_awaited_once()
+
+
+def test_health_fails_while_draining(client, mocker):
+    assert client.get("/health").status_code == HTTPStatus.OK
+
+    mocker.patch.object(lifecycle, "_draining", True)
+    response = client.get("/health")
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.json() == {"message": "Draining"}
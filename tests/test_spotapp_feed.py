@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+import pytest
+
+from api import crud
+from api.crud import CRUDFeed, feed_entry, publish
+from api.feed import MemoryFeedStore, RedisFeedStore, feed_position
+from tests import stubs
+
+START = datetime(2022, 6, 23, 18, 36)
+
+
+def make_entry(pk, actor_id=1, kind="spot", seconds=None):
+    created_at = START + timedelta(seconds=pk if seconds is None else seconds)
+    return feed_entry(kind, pk, actor_id, f"{kind} {pk}", created_at)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def zadd(self, key, mapping):
+        self.calls.append(lambda: self.client.zadd(key, mapping))
+
+    def zremrangebyrank(self, key, start, stop):
+        self.calls.append(lambda: self.client.zremrangebyrank(key, start, stop))
+
+    async def execute(self):
+        for call in self.calls:
+            await call()
+
+
+class FakeRedis:
+    """Just enough of the redis.asyncio sorted set API for the feed store"""
+
+    def __init__(self):
+        self.zsets = {}
+        self.sets = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    async def zremrangebyrank(self, key, start, stop):
+        ranked = sorted(self.zsets[key].items(), key=lambda item: item[1])
+        for member, _ in ranked[start:max(len(ranked) + stop + 1, 0)]:
+            del self.zsets[key][member]
+
+    async def zrevrangebyscore(self, key, max, min, start, num):
+        bound = float("inf") if max == "+inf" else float(max.lstrip("("))
+        ranked = sorted(self.zsets.get(key, {}).items(), key=lambda item: -item[1])
+        return [member.encode() for member, score in ranked if score < bound][start:start + num]
+
+    async def zrangebyscore(self, key, min, max):
+        ranked = sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+        return [member.encode() for member, score in ranked if min <= score <= max]
+
+    async def sadd(self, key, value):
+        self.sets.setdefault(key, set()).add(str(value).encode())
+
+    async def smembers(self, key):
+        return self.sets.get(key, set())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", [MemoryFeedStore(max_entries=3),
+                                   RedisFeedStore(FakeRedis(), max_entries=3)])
+async def test_feed_store_keeps_newest_and_pages_back(store):
+    for pk in [1, 4, 2, 5, 3]:
+        await store.push([7, 8], make_entry(pk))
+
+    first = await store.range(7, before=None, limit=2)
+    second = await store.range(7, before=feed_position(first[-1]), limit=2)
+
+    assert [entry.id for entry in first] == [5, 4]
+    assert [entry.id for entry in second] == [3]
+    assert await store.range(9, before=None, limit=2) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("store", [MemoryFeedStore(max_entries=10),
+                                   RedisFeedStore(FakeRedis(), max_entries=10)])
+async def test_feed_store_pages_through_entries_of_one_microsecond(store):
+    for pk in [9, 10, 11, 12, 13]:
+        await store.push([7], make_entry(pk, seconds=1))
+    await store.push([7], make_entry(1, kind="comment", seconds=1))
+    await store.push([7], make_entry(2, seconds=0))
+
+    seen, before = [], None
+    while True:
+        page = await store.range(7, before=before, limit=2)
+        if not page:
+            break
+        seen += [(entry.kind, entry.id) for entry in page]
+        before = feed_position(page[-1])
+
+    assert seen == [("spot", 13), ("spot", 12), ("spot", 11), ("spot", 10), ("spot", 9),
+                    ("comment", 1), ("spot", 2)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("followers, fanned_out", [(3, True), (4, False)])
+async def test_publish_falls_back_to_outbox_for_celebrities(mocker, monkeypatch,
+                                                            followers, fanned_out):
+    store = MemoryFeedStore(max_entries=10)
+    monkeypatch.setattr(crud, "feed_store", store)
+    monkeypatch.setattr(crud.settings, "feed_fanout_max_followers", 3)
+    db = mocker.AsyncMock()
+    db.info = {}
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.all.return_value = [(1, friend_id) for friend_id in range(10, 10 + followers)]
+
+    await publish(db, {1: [make_entry(1)], None: [make_entry(2)]})
+    for callback in db.info.pop("on_commit"):
+        await callback()
+
+    assert bool(await store.range(10, before=None, limit=10)) is fanned_out
+    assert (await store.celebrities() == {1}) is not fanned_out
+
+
+@pytest.mark.asyncio
+async def test_feed_merges_followed_celebrity_outbox(mocker, monkeypatch):
+    store = MemoryFeedStore(max_entries=10)
+    monkeypatch.setattr(crud, "feed_store", store)
+    await store.push([7], make_entry(1, actor_id=2))
+    await store.push([7], make_entry(3, actor_id=2, kind="comment"))
+    await store.push_outbox(99, make_entry(2, actor_id=99))
+    db = mocker.AsyncMock()
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.scalars.return_value.all.return_value = [99]
+    db.execute.return_value.all.return_value = [("spot", 1), ("spot", 2), ("comment", 3)]
+
+    page = await CRUDFeed.get_feed(db=db, user_id=7, cursor=None, limit=2)
+    rest = await CRUDFeed.get_feed(db=db, user_id=7, cursor=page.next_cursor, limit=2)
+
+    assert [(entry.kind, entry.id) for entry in page.items] == [("comment", 3), ("spot", 2)]
+    assert [entry.id for entry in rest.items] == [1]
+    assert rest.next_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_feed_leaves_out_deleted_entries(mocker, monkeypatch):
+    store = MemoryFeedStore(max_entries=10)
+    monkeypatch.setattr(crud, "feed_store", store)
+    for pk in [1, 2, 3]:
+        await store.push([7], make_entry(pk, actor_id=2))
+    db = mocker.AsyncMock()
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.all.return_value = [("spot", 1)]  # 2 and 3 were deleted
+
+    page = await CRUDFeed.get_feed(db=db, user_id=7, cursor=None, limit=2)
+    rest = await CRUDFeed.get_feed(db=db, user_id=7, cursor=page.next_cursor, limit=2)
+
+    assert page.items == [] and page.next_cursor is not None
+    assert [entry.id for entry in rest.items] == [1]
+
+
+def test_get_feed_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFeed, "get_feed", side_effect=stubs.get_feed_stub, autospec=True)
+    response = client.get("/users/7/feed")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["items"][0]["kind"] == "spot"
+
+
+def test_get_feed_of_another_user_403(client, authorized_user):
+    response = client.get("/users/8/feed")
+    assert response.status_code == HTTPStatus.FORBIDDEN
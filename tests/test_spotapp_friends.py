@@ -0,0 +1,115 @@
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy.exc import NoResultFound
+
+import spotapp
+from api import schema
+from api.authentication import get_current_user
+from api.crud import CRUDFavourite, CRUDFriend, CRUDUser
+from tests import stubs, sample
+
+
+@pytest.fixture
+def deleted_user_token():
+    """Token without `uid` for a user that no longer exists"""
+
+    async def override_dependency(anything: str = None):
+        return schema.TokenData(email=sample.RAW_USER["email"])
+
+    spotapp.app.dependency_overrides[get_current_user] = override_dependency
+    yield
+    spotapp.app.dependency_overrides.pop(get_current_user, None)
+
+
+def test_get_friends_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFriend, "get_friends",
+                        side_effect=stubs.get_friends_stub, autospec=True)
+    response = client.get("/users/7/friends")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"items": [sample.EXAMPLE_FRIEND], "next_cursor": None}
+
+
+def test_get_mutual_friends_ok(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDFriend, "get_mutual_friends",
+                                    side_effect=stubs.get_mutual_friends_stub, autospec=True)
+    response = client.get("/users/7/friends/mutual/9")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["items"] == [sample.EXAMPLE_FRIEND]
+    assert crud_mock.call_args.kwargs["other_id"] == 9
+
+
+def test_get_friends_spots_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFriend, "get_friends_spots",
+                        side_effect=stubs.get_friends_spots_stub, autospec=True)
+    response = client.get("/users/7/friends/spots")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"items": [sample.EXAMPLE_SPOT_WITH_ID],
+                               "next_cursor": sample.NEXT_CURSOR}
+
+
+def test_add_friend_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFriend, "add_friend",
+                        side_effect=stubs.add_friend_stub, autospec=True)
+    response = client.put("/users/7/friends/8")
+    assert response.status_code == HTTPStatus.ACCEPTED
+
+
+def test_add_unknown_friend_404(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFriend, "add_friend", side_effect=NoResultFound, autospec=True)
+    response = client.put("/users/7/friends/404")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_add_self_as_friend_406(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDFriend, "add_friend",
+                                    side_effect=stubs.add_friend_stub, autospec=True)
+    response = client.put("/users/7/friends/7")
+    assert response.status_code == HTTPStatus.NOT_ACCEPTABLE
+    crud_mock.assert_not_called()
+
+
+@pytest.mark.parametrize("method, path", [
+    ("put", "/users/7/friends/8"),
+    ("delete", "/users/7/friends/8"),
+    ("put", "/users/7/favourites/1"),
+    ("delete", "/users/7/favourites/1"),
+    ("get", "/users/7/feed"),
+])
+def test_deleted_token_user_401(client, mocker, deleted_user_token, method, path):
+    mocker.patch.object(CRUDUser, "login", side_effect=NoResultFound, autospec=True)
+    response = getattr(client, method)(path)
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+@pytest.mark.parametrize("method, path", [
+    ("put", "/users/8/friends/7"),
+    ("delete", "/users/8/friends/7"),
+    ("put", "/users/8/favourites/1"),
+    ("delete", "/users/8/favourites/1"),
+])
+def test_acting_for_another_user_403(client, authorized_user, method, path):
+    response = getattr(client, method)(path)
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_get_favourited_by_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDFavourite, "get_favourited_by",
+                        side_effect=stubs.get_favourited_by_stub, autospec=True)
+    response = client.get("/spots/1/favourited-by")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["items"] == [sample.EXAMPLE_FRIEND]
+
+
+@pytest.mark.asyncio
+async def test_friends_spots_read_one_page_per_friend(mocker):
+    db = mocker.AsyncMock()
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.all.return_value = []
+
+    await CRUDFriend.get_friends_spots(db=db, user_id=7, cursor=sample.NEXT_CURSOR, limit=10)
+
+    assert db.execute.await_count == 1
+    compiled = str(db.execute.await_args.args[0])
+    assert "JOIN LATERAL" in compiled
+    assert "spots.spot_id < " in compiled
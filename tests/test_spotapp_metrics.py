@@ -0,0 +1,105 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.util import greenlet_spawn
+
+from api import metrics
+from api.authentication import token_cache
+from api.crud import spot_cache
+from api.metrics import Counter, Gauge, Histogram, TimedQueuePool, instrument_engine, request_timings
+from api.utils import PasswordHasher
+
+
+def test_histogram_render():
+    registry = []
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, route='/a"b')
+
+    assert metrics.render(registry).splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2',
+        'latency_seconds_bucket{route="/a\\"b",le="1"} 3',
+        'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a\\"b"} 3.65',
+        'latency_seconds_count{route="/a\\"b"} 4',
+    ]
+
+
+def test_counter_and_gauge_render():
+    registry = []
+    Counter("errors_total", "Errors", ("pool",), registry=registry).inc(pool="primary")
+    Gauge("connections", "Connections", ("state",), registry=registry,
+          collect=lambda: {("idle",): 3})
+
+    samples = [line for line in metrics.render(registry).splitlines() if not line.startswith("#")]
+    assert samples == ['errors_total{pool="primary"} 1', 'connections{state="idle"} 3']
+
+
+def series_count(histogram: Histogram, **labels) -> int:
+    series = histogram.values.get(histogram.key(labels))
+    return series[2] if series else 0
+
+
+def test_requests_are_recorded_by_route(client):
+    labels = {"method": "GET", "route": "/users/{user_id}", "status": 422}
+    before = series_count(metrics.http_request_duration, **labels)
+
+    client.get("/users/one")
+    client.get("/users/two")
+
+    assert series_count(metrics.http_request_duration, **labels) == before + 2
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'spotapp_http_request_duration_seconds_count{method="GET",route="/users/{user_id}",status="422"}' \
+        in response.text
+
+
+def test_caches_flights_and_hasher_are_exported(client, mocker):
+    mocker.patch.object(spot_cache, "hits", 3)
+    mocker.patch.object(spot_cache, "misses", 1)
+    mocker.patch.dict(PasswordHasher.stats, {"queued": 2})
+    token_cache._resolve()
+
+    samples = client.get("/metrics").text.splitlines()
+
+    assert 'spotapp_cache_lookups{cache="spot",result="hit"} 3' in samples
+    assert 'spotapp_cache_hit_ratio{cache="spot"} 0.75' in samples
+    assert 'spotapp_password_hasher_tasks{state="queued"} 2' in samples
+    assert any(line.startswith('spotapp_single_flight_fan_out_ratio{group="filtered_spots"} ') for line in samples)
+    assert any(line.startswith('spotapp_token_cache{stat="hit_ratio"} ') for line in samples)
+
+
+def test_statements_are_timed_per_request():
+    engine = create_engine("sqlite://")
+    instrument_engine(SimpleNamespace(sync_engine=engine), "test")
+    timings = {"db": 0.0, "queries": 0, "scope": {}}
+    token = request_timings.set(timings)
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+            connection.execute(text("SELECT 2"))
+            assert connection.info["statement_started"] == []
+    finally:
+        request_timings.reset(token)
+
+    assert timings["queries"] == 3  # the failed one included
+    assert timings["db"] > 0
+    assert series_count(metrics.db_query_duration, pool="test") == 2
+    assert metrics.db_query_errors.values[("test",)] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_checkout_wait_is_recorded():
+    pool = TimedQueuePool(lambda: sqlite3.connect(":memory:"), logging_name="waited")
+
+    connection = await greenlet_spawn(pool.connect)
+    await greenlet_spawn(connection.close)
+
+    assert series_count(metrics.db_pool_wait, pool="waited") == 1
@@ -0,0 +1,97 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from api.metrics import instrument_engine, request_timings
+from api.querylog import QueryBudgetExceeded, normalize_sql, parameters_shape
+from api.settings import settings
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    instrument_engine(SimpleNamespace(sync_engine=engine), "test")
+    return engine
+
+
+@pytest.fixture
+def request_context():
+    timings = {"db": 0.0, "queries": 0,
+               "scope": {"route": SimpleNamespace(path="/spots/{spot_id}")}}
+    token = request_timings.set(timings)
+    yield timings
+    request_timings.reset(token)
+
+
+@pytest.mark.parametrize("statement, normalized", [
+    ("SELECT spots.spot_id \n  FROM spots WHERE spots.spot_id = $1::INTEGER LIMIT 51",
+     "SELECT spots.spot_id FROM spots WHERE spots.spot_id = ?::INTEGER LIMIT ?"),
+    ("SELECT * FROM spots WHERE spot_id IN ($1, $2, $3) AND spot_city = 'Paris'",
+     "SELECT * FROM spots WHERE spot_id IN (...) AND spot_city = ?"),
+    ("UPDATE users SET nickname=%(nickname)s WHERE users.user_id = %(user_id_1)s",
+     "UPDATE users SET nickname=? WHERE users.user_id = ?"),
+    ("SELECT anon_1.spot_id FROM (SELECT -1.5 AS x) AS anon_1",
+     "SELECT anon_1.spot_id FROM (SELECT ? AS x) AS anon_1"),
+])
+def test_normalize_sql(statement, normalized):
+    assert normalize_sql(statement) == normalized
+
+
+@pytest.mark.parametrize("parameters, executemany, shape", [
+    ((1, "secret", None), False, "(int, str, NoneType)"),
+    ({"b": 1, "a": "x"}, False, "{a: str, b: int}"),
+    ([(1, "x"), (2, "y")], True, "(int, str) x 2"),
+    ((), False, "()"),
+])
+def test_parameters_shape(parameters, executemany, shape):
+    assert parameters_shape(parameters, executemany) == shape
+
+
+def test_slow_statement_logged_with_route(engine, request_context, mocker, caplog):
+    mocker.patch.object(settings, "db_slow_query_ms", 0.000001)
+    with caplog.at_level(logging.WARNING, logger="api.querylog"):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 'secret' WHERE 1 = :value"), {"value": 1})
+
+    [record] = caplog.records
+    assert "from /spots/{spot_id}: SELECT ? WHERE ? = ?" in record.message
+    assert "params=(int)" in record.message
+    assert "secret" not in record.message
+
+
+def test_fast_statement_not_logged(engine, request_context, mocker, caplog):
+    mocker.patch.object(settings, "db_slow_query_ms", 60000)
+    with caplog.at_level(logging.WARNING, logger="api.querylog"):
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+    assert caplog.records == []
+
+
+def test_query_budget_raises(engine, request_context, mocker):
+    mocker.patch.object(settings, "db_query_budget", 2)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        connection.execute(text("SELECT 2"))
+        with pytest.raises(QueryBudgetExceeded, match="/spots/{spot_id} ran 3 statements"):
+            connection.execute(text("SELECT 3"))
+
+
+def test_query_budget_warns_once(engine, request_context, mocker, caplog):
+    mocker.patch.object(settings, "db_query_budget", 1)
+    mocker.patch.object(settings, "db_query_budget_mode", "warn")
+    with caplog.at_level(logging.WARNING, logger="api.querylog"):
+        with engine.connect() as connection:
+            for _ in range(4):
+                connection.execute(text("SELECT 1"))
+
+    assert len([record for record in caplog.records if "over the budget" in record.message]) == 1
+    assert request_context["queries"] == 4
+
+
+def test_statements_outside_requests_have_no_budget(engine, mocker):
+    mocker.patch.object(settings, "db_query_budget", 1)
+    with engine.connect() as connection:
+        for _ in range(3):
+            connection.execute(text("SELECT 1"))
@@ -0,0 +1,76 @@
+from http import HTTPStatus
+import json
+
+import pytest
+from sqlalchemy.dialects.postgresql import asyncpg
+from sqlalchemy.exc import NoResultFound
+
+from api import schema
+from api.crud import CRUDRating, CRUDSpot, CRUDUser
+from tests import stubs, sample
+
+
+def test_rate_spot_ok(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDRating, "rate",
+                                    side_effect=stubs.rate_spot_stub, autospec=True)
+    response = client.put("/spots/1/rating", json.dumps({"score": 5}))
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == sample.EXAMPLE_SPOT_RATING
+    assert crud_mock.call_args.kwargs["user_id"] == 7
+
+
+def test_rate_spot_score_out_of_range_422(client, authorized_user):
+    response = client.put("/spots/1/rating", json.dumps({"score": 6}))
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_unrate_unknown_spot_404(client, mocker, authorized_user):
+    mocker.patch.object(CRUDRating, "unrate", side_effect=NoResultFound, autospec=True)
+    response = client.delete("/spots/404/rating")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_top_rated_spots_ok(client, mocker, authorized_user):
+    mocker.patch.object(CRUDSpot, "get_top_rated_spots",
+                        side_effect=stubs.get_top_rated_spots_stub, autospec=True)
+    response = client.get("/spots/top-rated", params={"spot_city": "Andresport"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [sample.EXAMPLE_SPOT_WITH_ID]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("call", [
+    lambda db: CRUDRating.rate(db, spot_id=1, user_id=7, score=5),
+    lambda db: CRUDRating.unrate(db, spot_id=1, user_id=7),
+])
+async def test_rating_write_locks_spot_then_moves_aggregate_once(mocker, call):
+    db = mocker.AsyncMock()
+    db.info = {}
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.one.return_value._mapping = sample.EXAMPLE_SPOT_RATING
+
+    assert await call(db) == schema.SpotRatingSchema(**sample.EXAMPLE_SPOT_RATING)
+
+    lock, write = [awaited.args[0] for awaited in db.execute.await_args_list]
+    assert lock._for_update_arg is not None
+    assert write.table.name == "spots"
+    assert [cte.name for cte in write._independent_ctes][-1] in {"upsert", "removed"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("call", [
+    lambda db: CRUDRating.rate(db, spot_id=1, user_id=7, score=5),
+    lambda db: CRUDRating.unrate(db, spot_id=1, user_id=7),
+    lambda db: CRUDUser.delete_user(db, user_id=7),
+])
+async def test_rating_writes_compile_for_asyncpg(mocker, call):
+    db = mocker.AsyncMock()
+    db.info = {}
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.one.return_value = mocker.MagicMock(
+        _mapping=sample.EXAMPLE_SPOT_RATING, __iter__=lambda self: iter((7, [1], [1, 2], [3])))
+
+    await call(db)
+
+    for awaited in db.execute.await_args_list:
+        awaited.args[0].compile(dialect=asyncpg.dialect())
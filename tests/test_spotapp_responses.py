@@ -0,0 +1,112 @@
+from contextlib import nullcontext
+from datetime import datetime
+from http import HTTPStatus
+from types import SimpleNamespace
+import gzip
+import json
+
+import pytest
+
+from api import crud, schema
+from api.crud import CRUDSpot, CRUDUser
+from api.middleware import CompressionMiddleware
+from api.models import SpotDBModel
+from api.responses import FastJSONResponse, json_encoder, orjson_encoder
+from api.utils import trusted
+from tests import sample
+
+
+def user_page(size: int) -> schema.UserPageSchema:
+    return schema.UserPageSchema(items=[sample.EXAMPLE_USER] * size,
+                                 next_cursor=sample.NEXT_CURSOR)
+
+
+@pytest.mark.parametrize("make_encoder", [json_encoder, orjson_encoder])
+def test_encoders_dump_models(make_encoder):
+    comment = schema.CommentFullSchema(**sample.EXAMPLE_COMMENT)
+    content = {"items": [comment], "at": datetime(2022, 6, 24, 10)}
+    assert json.loads(make_encoder()(content)) == {
+        "items": [sample.EXAMPLE_COMMENT], "at": "2022-06-24T10:00:00"}
+
+
+def test_fast_response_body():
+    response = FastJSONResponse(user_page(1))
+    assert json.loads(response.body) == {"items": [sample.EXAMPLE_USER],
+                                         "next_cursor": sample.NEXT_CURSOR}
+
+
+@pytest.mark.parametrize("size, accept, encoding", [
+    (100, "gzip, deflate", "gzip"),
+    (100, "identity", None),
+    (100, "gzip;q=0", None),
+    (1, "gzip", None),  # below the size threshold
+])
+def test_list_compression(client, mocker, size, accept, encoding):
+    mocker.patch.object(CRUDUser, "get_all_users", return_value=user_page(size), autospec=True)
+    response = client.get("/users/all/", headers={"Accept-Encoding": accept})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers.get("Content-Encoding") == encoding
+    assert len(response.json()["items"]) == size
+    if encoding:
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+
+@pytest.mark.parametrize("header, encoding", [
+    ("gzip, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("*", "br"),
+    ("br;q=0, *;q=0.1", "gzip"),
+    ("deflate", None),
+    ("", None),
+])
+def test_negotiate(header, encoding):
+    middleware = CompressionMiddleware(app=None, encodings=["br", "gzip"], minimum_size=1)
+    middleware.encodings = ["br", "gzip"]  # as if brotli was installed
+    assert middleware.negotiate(header) == encoding
+
+
+@pytest.mark.asyncio
+async def test_streamed_body_compressed_per_chunk():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson")]})
+        for row in (b'{"a":1}\n', b'{"a":2}\n'):
+            await send({"type": "http.response.body", "body": row, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = CompressionMiddleware(app, encodings=["gzip"], minimum_size=1024)
+    await middleware({"type": "http", "headers": [(b"accept-encoding", b"gzip")]}, None, send)
+
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    chunks = [message["body"] for message in sent[1:]]
+    # every row is flushed on its own, before the stream ends
+    assert all(chunks[:2])
+    assert gzip.decompress(b"".join(chunks)) == b'{"a":1}\n{"a":2}\n'
+
+
+def test_trusted_matches_validated():
+    spot = SpotDBModel(spot_id=1, **sample.EXAMPLE_SPOT)
+    assert trusted(schema.SpotWithIdSchema, spot) == schema.SpotWithIdSchema.from_orm(spot)
+
+
+@pytest.mark.asyncio
+async def test_spot_page_reads_only_schema_columns(mocker):
+    db = mocker.AsyncMock(info={})
+    db.execute.return_value = mocker.MagicMock()
+    db.execute.return_value.all.return_value = [SimpleNamespace(spot_id=1, **sample.EXAMPLE_SPOT)]
+    mocker.patch.object(crud, "shared_read_session", side_effect=nullcontext, autospec=True)
+    validate = mocker.spy(schema.SpotSchema, "validate")
+    from_orm = mocker.spy(schema.SpotSchema, "from_orm")
+
+    page = await CRUDSpot.get_filtered_spots(db, schema.SpotFilterSchema(), cursor=None, limit=10)
+
+    statement = db.execute.await_args.args[0]
+    assert [column.name for column in statement.selected_columns] == [*schema.SpotSchema.__fields__, "spot_id"]
+    assert page.dict() == {"items": [sample.EXAMPLE_SPOT], "next_cursor": None}
+    validate.assert_not_called()
+    from_orm.assert_not_called()
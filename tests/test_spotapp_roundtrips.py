@@ -0,0 +1,71 @@
+import pytest
+from sqlalchemy.exc import NoResultFound
+
+from api.conditional import PreconditionFailed
+from api.crud import CRUDSpot, CRUDUser
+
+
+@pytest.fixture
+def db(mocker):
+    """Session that counts the statements sent to the database"""
+
+    session = mocker.AsyncMock()
+    session.info = {}
+    result = mocker.MagicMock()
+    result.one.return_value = mocker.MagicMock(spot_id=1, comment_ids=None,
+                                               __iter__=lambda self: iter((1, None, None, None)))
+    result.one_or_none.return_value = ("Eiffel", "Tower", 2)
+    result.scalar_one_or_none.return_value = 2
+    session.execute.return_value = result
+    return session
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("call", [
+    lambda db: CRUDUser.update(db, 1, {"nickname": "Bob"}),
+    lambda db: CRUDUser.delete_user(db, 1),
+    lambda db: CRUDSpot.update(db, 1, {"spot_name": "Eiffel"}),
+    lambda db: CRUDSpot.delete_spot(db, 1),
+])
+async def test_single_round_trip(db, call):
+    await call(db)
+
+    assert db.execute.await_count == 1
+    db.get.assert_not_awaited()
+    db.delete.assert_not_awaited()
+    statement = db.execute.await_args.args[0]
+    assert statement._returning
+    assert statement.get_execution_options()["synchronize_session"] is False
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("call", [
+    lambda db: CRUDUser.update(db, 1, {"nickname": "Bob"}),
+    lambda db: CRUDUser.delete_user(db, 1),
+    lambda db: CRUDSpot.update(db, 1, {"spot_name": "Eiffel"}),
+    lambda db: CRUDSpot.delete_spot(db, 1),
+])
+async def test_missing_row_is_not_found(db, call):
+    db.execute.return_value.scalar_one.side_effect = NoResultFound()
+    db.execute.return_value.one.side_effect = NoResultFound()
+    db.execute.return_value.scalar_one_or_none.return_value = None
+    db.execute.return_value.one_or_none.return_value = None
+
+    with pytest.raises(NoResultFound):
+        await call(db)
+    assert db.info.get("on_commit", []) == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("call", [
+    lambda db: CRUDUser.update(db, 1, {"nickname": "Bob"}, versions=[1]),
+    lambda db: CRUDSpot.update(db, 1, {"spot_name": "Eiffel"}, versions=[1]),
+])
+async def test_stale_version_is_precondition_failed(db, call):
+    db.execute.return_value.scalar_one_or_none.return_value = None
+    db.execute.return_value.one_or_none.return_value = None
+    db.execute.return_value.scalar_one.return_value = 1  # the row exists
+
+    with pytest.raises(PreconditionFailed):
+        await call(db)
+    assert "version IN" in str(db.execute.await_args_list[0].args[0])
@@ -0,0 +1,62 @@
+from http import HTTPStatus
+
+import pytest
+
+from api import crud
+from api.crud import CRUDSpot
+from api.search import MemorySearchIndex
+from api.schema import SearchQuerySchema
+
+
+@pytest.fixture
+def memory_index(monkeypatch):
+    index = MemorySearchIndex()
+    monkeypatch.setattr(crud, "search_index", index)
+    return index
+
+
+async def fill(index):
+    await index.index_document("spot", 1, "Sky", ["Sky", "rooftop bar with a view"])
+    await index.index_document("spot", 2, "Cellar", ["Cellar", "wine bar downstairs"])
+    await index.index_document("comment", 7, "Best rooftop in town", ["Best rooftop in town"])
+
+
+@pytest.mark.asyncio
+async def test_search_prefix_and_ranking(memory_index):
+    await fill(memory_index)
+
+    page = await CRUDSpot.search(db=None, query=SearchQuerySchema(q="roof ba"),
+                                 cursor=None, limit=10)
+
+    assert [(hit.kind, hit.id) for hit in page.items] == [("spot", 1)]
+    assert page.next_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_search_pagination(memory_index):
+    await fill(memory_index)
+
+    first = await CRUDSpot.search(db=None, query=SearchQuerySchema(q="rooftop"),
+                                  cursor=None, limit=1)
+    second = await CRUDSpot.search(db=None, query=SearchQuerySchema(q="rooftop"),
+                                   cursor=first.next_cursor, limit=1)
+
+    assert {first.items[0].id, second.items[0].id} == {1, 7}
+    assert second.next_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_search_index_removal(memory_index):
+    await fill(memory_index)
+    await memory_index.remove_document("spot", 2)
+
+    page = await CRUDSpot.search(db=None, query=SearchQuerySchema(q="wine"),
+                                 cursor=None, limit=10)
+
+    assert page.items == []
+    assert "wine" not in memory_index.vocabulary
+
+
+def test_search_without_words_406(client, authorized_user):
+    response = client.get("/spots/search", params={"q": "  !! "})
+    assert response.status_code == HTTPStatus.NOT_ACCEPTABLE
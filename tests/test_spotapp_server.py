@@ -0,0 +1,113 @@
+import asyncio
+import multiprocessing
+import signal
+
+import pytest
+import uvicorn
+
+from api import lifecycle
+from api.server import DrainingMultiprocess, DrainingServer, main, worker_count
+
+
+@pytest.fixture(autouse=True)
+def not_draining(mocker):
+    mocker.patch.object(lifecycle, "_draining", False)
+    mocker.patch.object(lifecycle, "_shared_draining", None)
+
+
+@pytest.mark.asyncio
+async def test_first_signal_drains_second_exits():
+    server = DrainingServer(uvicorn.Config("spotapp:app"))
+
+    server.handle_exit(signal.SIGTERM, None)
+    assert lifecycle.is_draining()
+    assert (server.should_exit, server.force_exit) == (False, False)
+
+    server.handle_exit(signal.SIGTERM, None)
+    assert (server.should_exit, server.force_exit) == (True, True)
+
+
+@pytest.mark.asyncio
+async def test_drain_shuts_down_after_drain_seconds(mocker):
+    mocker.patch("api.server.settings.server_drain_seconds", 0)
+    server = DrainingServer(uvicorn.Config("spotapp:app"))
+
+    server.handle_exit(signal.SIGTERM, None)
+    await asyncio.sleep(0.01)
+    assert (server.should_exit, server.force_exit) == (True, False)
+
+
+def test_workers_share_the_drain():
+    event = multiprocessing.get_context("spawn").Event()
+    lifecycle.share_draining(event)
+    assert not lifecycle.is_draining()
+
+    event.set()  # another worker drains
+    assert lifecycle.is_draining()
+
+
+@pytest.mark.parametrize("sig", [signal.SIGINT, signal.SIGTERM])
+def test_supervised_worker_leaves_signals_to_supervisor(sig):
+    server = DrainingServer(uvicorn.Config("spotapp:app"), drain_event=multiprocessing.Event())
+    server.handle_exit(sig, None)
+    assert not server.draining
+
+
+@pytest.mark.asyncio
+async def test_supervised_worker_drains_through_twice_signalled_group():
+    event = multiprocessing.Event()
+    server = DrainingServer(uvicorn.Config("spotapp:app"), drain_event=event)
+
+    # a process group kill, then the supervisor passing it on
+    server.handle_exit(signal.SIGTERM, None)
+    event.set()
+    server.handle_exit(signal.SIGTERM, None)
+
+    assert await server.on_tick(1) is False
+    assert server.draining
+    assert (server.should_exit, server.force_exit) == (False, False)
+
+
+def test_supervisor_drains_all_workers_before_joining(mocker):
+    workers = mocker.Mock()
+    event = mocker.Mock()
+    supervisor = DrainingMultiprocess(mocker.Mock(), target=None, sockets=[], drain_event=event)
+    supervisor.processes = [workers.first, workers.second]
+
+    supervisor.signal_handler(signal.SIGTERM, None)
+    supervisor.shutdown()
+
+    event.set.assert_called_once_with()
+    assert workers.mock_calls == [mocker.call.first.join(), mocker.call.second.join()]
+
+
+def test_supervisor_second_signal_kills_workers(mocker):
+    workers = mocker.Mock()
+    supervisor = DrainingMultiprocess(mocker.Mock(), target=None, sockets=[], drain_event=mocker.Mock())
+    supervisor.processes = [workers.first, workers.second]
+
+    supervisor.signal_handler(signal.SIGTERM, None)
+    assert workers.mock_calls == []
+
+    supervisor.signal_handler(signal.SIGTERM, None)
+    assert workers.mock_calls == [mocker.call.first.kill(), mocker.call.second.kill()]
+
+
+@pytest.mark.parametrize("feed_backend, workers", [("memory", 1), ("redis", 4)])
+def test_memory_feed_runs_one_worker_by_default(mocker, feed_backend, workers):
+    mocker.patch("api.server.os.cpu_count", return_value=4)
+    mocker.patch("api.server.settings.server_workers", None)
+    mocker.patch("api.server.settings.search_backend", "postgres")
+    mocker.patch("api.server.settings.feed_backend", feed_backend)
+
+    assert worker_count() == workers
+
+
+def test_memory_feed_refuses_several_workers(mocker):
+    mocker.patch("api.server.settings.feed_backend", "memory")
+    serve = mocker.patch("api.server.serve")
+    mocker.patch("sys.argv", ["api.server", "--workers", "2"])
+
+    with pytest.raises(SystemExit):
+        main()
+    serve.assert_not_called()
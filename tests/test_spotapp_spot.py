@@ -1,16 +1,27 @@
 from http import HTTPStatus
 import json
 
+import pytest
+
+import spotapp
+from api.constants import NDJSON_MEDIA_TYPE
 from api.crud import CRUDSpot
+from api.geo import (bounding_box, covering_prefixes, enclosing_radius_km, encode_geohash, haversine_km,
+                     longitude_ranges)
+from api.settings import settings
 from api.authentication import get_current_user
-from spotapp import app
 from tests import stubs, sample
 
 
 async def override_dependency(anything: str = None):
     return {}
 
-app.dependency_overrides[get_current_user] = override_dependency
+
+@pytest.fixture(autouse=True)
+def authenticated():
+    spotapp.app.dependency_overrides[get_current_user] = override_dependency
+    yield
+    spotapp.app.dependency_overrides.pop(get_current_user, None)
 
 
 def test_spot_get_by_id_ok(client, mocker):
@@ -21,6 +32,14 @@ def test_spot_get_by_id_ok(client, mocker):
     assert response.json() == sample.EXAMPLE_SPOT
 
 
+def test_spot_get_by_id_of_deleted_owner(client, mocker):
+    mocker.patch.object(CRUDSpot, "get_spot_by_id",
+                        side_effect=stubs.get_ownerless_spot_by_id_stub, autospec=True)
+    response = client.get("/spots/1")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["owner_id"] is None
+
+
 def test_spot_get_by_id_422(client, mocker):
     mocker.patch.object(CRUDSpot, "get_spot_by_id",
                         side_effect=stubs.get_spot_by_id_empty_stub, autospec=True)
@@ -34,7 +53,79 @@ def test_get_spots_ok(client, mocker):
                         side_effect=stubs.get_spots_stub, autospec=True)
     response = client.get("/spots/filtered/")
     assert response.status_code == HTTPStatus.OK
-    assert response.json() == [sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT]
+    assert response.json() == {"items": [sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT],
+                               "next_cursor": sample.NEXT_CURSOR}
+
+
+def test_get_spots_empty_404(client, mocker):
+    mocker.patch.object(CRUDSpot, "get_filtered_spots",
+                        side_effect=stubs.get_spots_empty_stub, autospec=True)
+    response = client.get("/spots/filtered/", params={"spot_city": "Nowhere"})
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_spots_export_ndjson(client, mocker):
+    mocker.patch.object(CRUDSpot, "stream_filtered_spots",
+                        side_effect=stubs.stream_spots_stub, autospec=True)
+    response = client.get("/spots/filtered/", headers={"Accept": NDJSON_MEDIA_TYPE})
+    assert response.status_code == HTTPStatus.OK
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        sample.EXAMPLE_SPOT, sample.EXAMPLE_SPOT]
+
+
+def test_get_nearby_spots_ok(client, mocker):
+    crud_mock = mocker.patch.object(CRUDSpot, "get_nearby_spots",
+                                    side_effect=stubs.get_nearby_spots_stub, autospec=True)
+    response = client.get("/spots/nearby", params={"latitude": 48.85, "longitude": 2.35,
+                                                   "radius_km": 10000})
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [sample.EXAMPLE_NEARBY_SPOT]
+    assert crud_mock.call_args.kwargs["area"].radius_km == settings.nearby_max_radius_km
+
+
+def test_get_nearby_spots_needs_area_406(client):
+    response = client.get("/spots/nearby", params={"latitude": 48.85})
+    assert response.status_code == HTTPStatus.NOT_ACCEPTABLE
+
+
+@pytest.mark.parametrize("box, status", [
+    ((48.8, 2.3, 48.9, 2.4), HTTPStatus.OK),
+    ((-90, -180, 90, 180), HTTPStatus.NOT_ACCEPTABLE),
+    ((48.0, 2.3, 49.5, 2.4), HTTPStatus.NOT_ACCEPTABLE),
+])
+def test_get_nearby_spots_box_size(client, mocker, box, status):
+    mocker.patch.object(CRUDSpot, "get_nearby_spots",
+                        side_effect=stubs.get_nearby_spots_stub, autospec=True)
+    response = client.get("/spots/nearby", params=dict(zip(
+        ("min_latitude", "min_longitude", "max_latitude", "max_longitude"), box)))
+    assert response.status_code == status
+
+
+def test_covering_prefixes_contain_close_points():
+    prefixes = covering_prefixes(48.8566, 2.3522, radius_km=1)
+    nearby = encode_geohash(48.8600, 2.3600)
+
+    assert len(prefixes) == 9
+    assert any(nearby.startswith(prefix) for prefix in prefixes)
+    assert 0.6 < haversine_km(48.8566, 2.3522, 48.8600, 2.3600) < 0.7
+
+
+def test_covering_prefixes_contain_box_corners():
+    box = (48.80, 2.30, 48.90, 2.45)
+    prefixes = covering_prefixes(48.85, 2.375, enclosing_radius_km(*box))
+
+    for latitude in (box[0], box[2]):
+        for longitude in (box[1], box[3]):
+            assert any(encode_geohash(latitude, longitude).startswith(prefix) for prefix in prefixes)
+
+
+def test_bounding_box_splits_at_the_antimeridian():
+    _, min_lon, _, max_lon = bounding_box(-17.7, 179.9, radius_km=50)
+    (east_low, east_high), (west_low, west_high) = longitude_ranges(min_lon, max_lon)
+
+    assert (east_high, west_low) == (180.0, -180.0)
+    assert east_low < 179.9 and -180.0 < west_high < -179.5
+    assert longitude_ranges(2.3, 2.4) == [(2.3, 2.4)]
 
 
 def test_create_spot_ok(client, mocker):
@@ -45,6 +136,33 @@ def test_create_spot_ok(client, mocker):
     assert response.json() == sample.EXAMPLE_SPOT
 
 
+def test_bulk_create_spots_reports_bad_items(client, mocker):
+    mocker.patch.object(CRUDSpot, "add_spots",
+                        side_effect=stubs.add_spots_stub, autospec=True)
+    broken_spot = {**sample.RAW_SPOT, "owner_id": "nobody"}
+    response = client.post("/spots/bulk/create/",
+                           json.dumps([sample.RAW_SPOT, broken_spot, sample.RAW_SPOT]))
+    assert response.status_code == HTTPStatus.OK
+    result = response.json()
+    assert (result["succeeded"], result["failed"]) == (2, 1)
+    assert [item["index"] for item in result["items"]] == [0, 1, 2]
+    assert result["items"][1]["error"]
+
+
+def test_bulk_delete_spots(client, mocker):
+    mocker.patch.object(CRUDSpot, "delete_spots",
+                        side_effect=stubs.delete_spots_stub, autospec=True)
+    response = client.delete("/spots/bulk/destroy/", data=json.dumps([123, 404]))
+    assert response.status_code == HTTPStatus.OK
+    assert (response.json()["succeeded"], response.json()["failed"]) == (1, 1)
+
+
+def test_bulk_too_many_items_413(client, mocker):
+    mocker.patch.object(settings, "bulk_max_items", 1)
+    response = client.post("/spots/bulk/create/", json.dumps([sample.RAW_SPOT] * 2))
+    assert response.status_code == HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+
+
 def test_delete_spot_ok(client, mocker):
     mocker.patch.object(CRUDSpot, "delete_spot",
                         side_effect=stubs.delete_spot_stub, autospec=True)
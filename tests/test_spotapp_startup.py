@@ -0,0 +1,104 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import mock
+
+import pytest
+
+import spotapp
+from api import db
+from api.authentication import token_cache
+from api.lazy import Lazy
+from api.middleware import MetricsMiddleware
+from api.settings import settings, use_settings
+from api.utils import PasswordHasher
+
+
+def test_lazy_builds_on_first_use_only(mocker):
+    factory = mocker.Mock(return_value=mocker.Mock(size=3))
+    proxy = Lazy(factory)
+    factory.assert_not_called()
+
+    assert proxy.size == 3
+    proxy.size = 4
+    assert proxy.size == 4
+    factory.assert_called_once_with()
+
+
+def test_lazy_replace():
+    proxy = Lazy(dict)
+    proxy._replace({"a": 1})
+    assert proxy.get("a") == 1
+
+    proxy._replace(None)
+    assert not proxy._is_resolved()
+    assert len(proxy) == 0
+
+
+def test_patching_lazy_settings_restores_them():
+    previous = settings.cache_ttl
+    with mock.patch.object(settings, "cache_ttl", previous + 1):
+        assert settings.cache_ttl == previous + 1
+    assert settings.cache_ttl == previous
+
+
+def test_import_builds_nothing():
+    environment = {key: value for key, value in os.environ.items() if key != "db_dsn"}
+    script = ("import json, sys, spotapp; "
+              "print(json.dumps(sorted(name for name in ('fastapi', 'sqlalchemy', 'passlib', 'api.settings') "
+              "if name in sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", script], env=environment, check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(__file__))).stdout
+    assert json.loads(output) == []
+
+
+def test_app_factory_takes_explicit_settings(mocker):
+    mocker.patch.object(db, "_replica_router", None)
+    previous = settings._resolve()
+    config = previous.copy(update={"metrics_enabled": False, "db_query_budget": None})
+    try:
+        app = spotapp.spotapp_api(config)
+        assert settings.metrics_enabled is False
+        assert MetricsMiddleware not in [middleware.cls for middleware in app.user_middleware]
+    finally:
+        use_settings(previous)
+
+
+def test_app_factory_after_engines_are_built(mocker):
+    mocker.patch.object(db, "_replica_router", None)
+    engine = db.get_engine()
+    previous = settings._resolve()
+
+    with pytest.raises(RuntimeError):
+        spotapp.spotapp_api(previous.copy(update={"db_pool_size": previous.db_pool_size + 1}))
+    assert settings._resolve() is previous
+    spotapp.spotapp_api(previous)  # the same settings again are fine
+    assert db.get_engine() is engine
+
+
+def test_new_settings_rebuild_what_was_built(mocker):
+    mocker.patch.object(db, "_replica_router", None)
+    previous = settings._resolve()
+    token_cache._resolve()
+    try:
+        use_settings(previous.copy(update={"jwt_cache_size": 1}))
+        assert not token_cache._is_resolved()
+        assert token_cache.max_entries == 1
+    finally:
+        use_settings(previous)
+    assert token_cache.max_entries == previous.jwt_cache_size
+
+
+def test_engines_built_on_first_use(mocker):
+    mocker.patch.object(db, "_replica_router", None)
+    assert db.all_engines() == []
+
+    engine = db.get_engine()
+    assert db.get_engine() is engine
+    assert db.all_engines() == [engine]
+
+
+def test_password_context_built_once():
+    assert PasswordHasher.pass_context() is PasswordHasher.pass_context()
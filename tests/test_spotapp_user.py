@@ -1,7 +1,15 @@
 from http import HTTPStatus
 import json
+import time
+from types import SimpleNamespace
 
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from api import db as app_db
+from api.constants import NDJSON_MEDIA_TYPE, PRIMARY_STICKY_COOKIE
 from api.crud import CRUDUser
+from api.settings import settings
 from tests import stubs, sample
 
 
@@ -31,7 +39,50 @@ def test_user_get_all_ok(client, mocker):
                         side_effect=stubs.get_all_users_stub, autospec=True)
     response = client.get("/users/all/")
     assert response.status_code == HTTPStatus.OK
-    assert response.json() == [sample.EXAMPLE_USER, sample.EXAMPLE_USER]
+    assert response.json() == {"items": [sample.EXAMPLE_USER, sample.EXAMPLE_USER],
+                               "next_cursor": sample.NEXT_CURSOR}
+
+
+def test_user_get_all_limit_capped(client, mocker):
+    crud_mock = mocker.patch.object(CRUDUser, "get_all_users",
+                                    side_effect=stubs.get_all_users_stub, autospec=True)
+    response = client.get("/users/all/", params={"limit": 100000, "cursor": sample.NEXT_CURSOR})
+    assert response.status_code == HTTPStatus.OK
+    assert crud_mock.call_args.kwargs["limit"] == settings.page_size_max
+    assert crud_mock.call_args.kwargs["cursor"] == sample.NEXT_CURSOR
+
+
+def test_user_get_all_bad_cursor_406(client):
+    response = client.get("/users/all/", params={"cursor": "not-a-cursor"})
+    assert response.status_code == HTTPStatus.NOT_ACCEPTABLE
+
+
+def test_user_export_ndjson(client, mocker):
+    mocker.patch.object(CRUDUser, "stream_users",
+                        side_effect=stubs.stream_users_stub, autospec=True)
+    response = client.get("/users/all/", headers={"Accept": NDJSON_MEDIA_TYPE})
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == NDJSON_MEDIA_TYPE
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        sample.EXAMPLE_USER, sample.EXAMPLE_USER]
+
+
+@pytest.mark.parametrize("sticky, engine", [(False, "replica"), (True, "primary")])
+def test_user_export_streams_from_replica(client, mocker, sticky, engine):
+    engines = {host: create_async_engine(f"postgresql+asyncpg://u:p@{host}/db") for host in ("primary", "replica")}
+    mocker.patch.object(app_db, "_replica_router", app_db.ReplicaRouter(engines["primary"], [engines["replica"]]))
+    binds = []
+
+    async def stream_users(db):
+        binds.append(db.bind)
+        yield SimpleNamespace(**sample.EXAMPLE_USER)
+
+    mocker.patch.object(CRUDUser, "stream_users", side_effect=stream_users, autospec=True)
+    if sticky:
+        client.cookies.set(PRIMARY_STICKY_COOKIE, str(int(time.time()) + 5))
+    response = client.get("/users/all/", headers={"Accept": NDJSON_MEDIA_TYPE})
+    assert response.status_code == HTTPStatus.OK
+    assert binds == [engines[engine]]
 
 
 def test_create_user_ok(client, mocker):
@@ -42,6 +93,40 @@ def test_create_user_ok(client, mocker):
     assert response.json() == sample.EXAMPLE_NEW_USER_ADD
 
 
+def test_bulk_create_users(client, mocker):
+    crud_mock = mocker.patch.object(CRUDUser, "add_users",
+                                    side_effect=stubs.add_users_stub, autospec=True)
+    response = client.post("/users/bulk/create/",
+                           json.dumps([sample.RAW_USER, {"nickname": "no_email"}]))
+    assert response.status_code == HTTPStatus.OK
+    assert (response.json()["succeeded"], response.json()["failed"]) == (1, 1)
+    (index, user), = crud_mock.call_args.kwargs["users"]
+    assert index == 0
+    assert user["password"] != sample.RAW_USER["password"]
+
+
+def test_bulk_update_users(client, mocker, authorized_user):
+    crud_mock = mocker.patch.object(CRUDUser, "update_users",
+                                    side_effect=stubs.update_users_stub, autospec=True)
+    response = client.put("/users/bulk/update/",
+                          json.dumps([{"user_id": 1, "password": "secret"},
+                                      {"user_id": 2, "nickname": "renamed"},
+                                      {"nickname": "no_user_id"}]))
+    assert response.status_code == HTTPStatus.OK
+    assert (response.json()["succeeded"], response.json()["failed"]) == (2, 1)
+    (_, hashed), (_, renamed) = crud_mock.call_args.kwargs["updates"]
+    assert hashed.password != "secret"
+    assert renamed.password is None
+
+
+def test_bulk_delete_users(client, mocker, authorized_user):
+    mocker.patch.object(CRUDUser, "delete_users",
+                        side_effect=stubs.delete_users_stub, autospec=True)
+    response = client.delete("/users/bulk/destroy/", data=json.dumps([123, 404]))
+    assert response.status_code == HTTPStatus.OK
+    assert (response.json()["succeeded"], response.json()["failed"]) == (1, 1)
+
+
 def test_delete_user_ok(client, mocker):
     mocker.patch.object(CRUDUser, "delete_user",
                         side_effect=stubs.delete_user_stub, autospec=True)